@@ -10,6 +10,7 @@
  * 主要路由：
  * - /api/:module - 主API接口，支持GET/POST
  * - /proxy/:module/* - 代理接口
+ * - /api/py/search - Python 源聚合搜索
  * - /parse/:jx - 解析接口
  *
  * @author drpy-node
@@ -466,8 +467,10 @@ export default (fastify, options, done) => {
 
         try {
             // 调用模块的代理方法
+            // hipy 源的 localProxy 从参数中读取 range，转发客户端 Range 以便按区间流式代理
+            const proxyQuery = apiEngine === hipy && rangeHeader && !query.range ? {...query, range: rangeHeader} : query;
             const backRespList = await withTimeout(
-                apiEngine.proxy(modulePath, env, query),
+                apiEngine.proxy(modulePath, env, proxyQuery),
                 null,
                 `代理接口[${moduleName}]`
             );
@@ -541,6 +544,60 @@ export default (fastify, options, done) => {
         }
     });
 
+    /**
+     * Python 源聚合搜索路由 - 一次请求搜索多个 hipy 源
+     * 守护进程内并发搜索并按片名去重排序，软截止到期返回已有结果（partial=true）
+     *
+     * 路径格式：/api/py/search?wd=关键词&modules=源1,源2&quick=0&pg=1
+     * 可选：max_hits（命中数达到即返回）、soft_deadline（秒）
+     */
+    fastify.get('/api/py/search', {preHandler: validatePwd}, async (request, reply) => {
+        const query = request.query;
+        const modules = String(query.modules || '').split(',').map(it => it.trim()).filter(Boolean);
+        if (!query.wd || modules.length < 1) {
+            reply.status(400).send({error: 'wd and modules are required'});
+            return;
+        }
+        const protocol = request.headers['x-forwarded-proto'] || (request.socket.encrypted ? 'https' : 'http');
+        const hostname = request.hostname;
+        const requestHost = `${protocol}://${hostname}`;
+        const sources = modules
+            .map(name => ({name, filePath: path.join(options.pyDir, `${name}.py`)}))
+            .filter(src => existsSync(src.filePath))
+            .map(src => ({
+                ...src,
+                env: {
+                    requestHost,
+                    proxyUrl: `${requestHost}/proxy/${src.name}/?do=py&extend=`,
+                    publicUrl: `${requestHost}/public/`,
+                    jsonUrl: `${requestHost}/json/`,
+                    httpUrl: `${requestHost}/http`,
+                    imageApi: `${requestHost}/image`,
+                    mediaProxyUrl: `${requestHost}/mediaProxy`,
+                    hostUrl: `${hostname.split(':')[0]}`,
+                    hostname,
+                    ext: '',
+                },
+            }));
+        const searchOptions = {};
+        if (query.max_hits) searchOptions.max_hits = Number(query.max_hits);
+        if (query.soft_deadline) searchOptions.soft_deadline = Number(query.soft_deadline);
+        try {
+            const result = await withTimeout(
+                hipy.multiSearch(sources, query.wd, Number(query.quick) || 0, Number(query.pg) || 1, searchOptions),
+                null,
+                `聚合搜索[${modules.length}]`,
+                'search'
+            );
+            reply.send(result);
+        } catch (error) {
+            const error_msg = `Failed to search modules ${modules.join(',')}: ${error.message}`;
+            console.error(error_msg);
+            fastify.log.error(error_msg);
+            reply.status(500).send({error: error_msg});
+        }
+    });
+
     /**
      * 解析路由 - 处理视频链接解析
      * 用于解析各种视频网站的播放链接
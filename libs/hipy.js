@@ -7,7 +7,8 @@ import {md5} from "../libs_drpy/crypto-util.js";
 import {PythonShell, PythonShellError} from 'python-shell';
 import {fastify} from "../controllers/fastlogger.js";
 import {daemon} from "../utils/daemonManager.js";
-import {netCallPythonMethod} from '../spider/py/core/bridge.js';
+import {spawn} from 'child_process';
+import {FrameBuffer, netCallPythonMethod, netMultiSearch} from '../spider/py/core/bridge.js';
 
 // 缓存已初始化的模块和文件 hash 值
 const moduleCache = new Map();
@@ -17,6 +18,12 @@ const _data_path = path.join(__dirname, '../data');
 const _config_path = path.join(__dirname, '../config');
 const _lib_path = path.join(__dirname, '../spider/py');
 const timeout = 30000; // 30秒超时
+// 调用方式：daemon(默认，TCP 守护进程) / stdio(常驻 _bridge.py --serve 子进程，适用于无法运行守护进程的部署)
+const BRIDGE_MODE = process.env.T4_BRIDGE_MODE || 'daemon';
+// stdio 模式的子进程数：按脚本路径固定分配（spider 状态留在同一进程），某个子进程卡死被杀只影响分到它的源
+const BRIDGE_WORKERS = Math.max(1, Number(process.env.T4_BRIDGE_WORKERS) || 4);
+// stdio 模式调用超时后的探活时限：子进程在此时间内不回应 ping 才判定卡死并重启
+const BRIDGE_PING_TIMEOUT = Math.max(1000, Number(process.env.T4_BRIDGE_PING_TIMEOUT) || 5000);
 
 function stringify(arg) {
     return Array.isArray(arg) || typeof arg == "object" ? JSON.stringify(arg) : arg
@@ -32,6 +39,136 @@ const json2Object = function (json) {
     return JSON.parse(json);
 }
 
+/**
+ * 还原 _bridge.py 结果中的字节字段：{"$b64": base64} -> Buffer
+ */
+function reviveBytes(value) {
+    if (Array.isArray(value)) return value.map(reviveBytes);
+    if (value && typeof value === 'object') {
+        const keys = Object.keys(value);
+        if (keys.length === 1 && keys[0] === '$b64' && typeof value.$b64 === 'string') {
+            return Buffer.from(value.$b64, 'base64');
+        }
+        for (const key of keys) value[key] = reviveBytes(value[key]);
+    }
+    return value;
+}
+
+/**
+ * 常驻 _bridge.py 子进程：stdin/stdout 上收发 4 字节大端长度 + JSON 帧，按 id 对应请求与响应。
+ * 子进程内并发执行（同一 spider 串行），已加载的 spider 及其 init 状态在调用间保留；
+ * 超时的调用只拒绝该 id，并发送取消帧（迟到的响应按未知 id 丢弃）；随后 ping 探活，
+ * 子进程在 BRIDGE_PING_TIMEOUT 内完全不应答才杀掉，下次调用时重新拉起。
+ */
+class StdioBridge {
+    constructor(scriptPath) {
+        this.scriptPath = scriptPath;
+        this.proc = null;
+        this.pending = new Map();
+        this.nextId = 0;
+        this.probing = false;
+    }
+
+    start() {
+        const proc = spawn(daemon.getPythonPath(), ['-u', this.scriptPath, '--serve'], {
+            cwd: path.dirname(this.scriptPath),
+            env: {...process.env, PYTHONIOENCODING: 'utf-8'},
+            stdio: ['pipe', 'pipe', 'pipe'],
+        });
+        const frames = new FrameBuffer();
+        let expectedLength = null;
+        proc.stdout.on('data', (chunk) => {
+            frames.push(chunk);
+            while (true) {
+                if (expectedLength === null) {
+                    if (frames.length < 4) break;
+                    expectedLength = frames.take(4).readUInt32BE(0);
+                }
+                if (frames.length < expectedLength) break;
+                const msg = JSON.parse(frames.take(expectedLength).toString('utf8'));
+                expectedLength = null;
+                this.settle(msg);
+            }
+        });
+        proc.stderr.on('data', (data) => fastify.log.info(`hipy logs: ${data.toString().trimEnd()}`));
+        proc.on('exit', (code) => {
+            if (this.proc === proc) this.proc = null;
+            for (const {reject, timer} of this.pending.values()) {
+                clearTimeout(timer);
+                reject(new Error(`_bridge.py 常驻进程已退出: ${code}`));
+            }
+            this.pending.clear();
+            this.probing = false;
+        });
+        this.proc = proc;
+    }
+
+    send(frame) {
+        const payload = Buffer.from(JSON.stringify(frame), 'utf8');
+        const header = Buffer.alloc(4);
+        header.writeUInt32BE(payload.length, 0);
+        this.proc.stdin.write(Buffer.concat([header, payload]));
+    }
+
+    /**
+     * 探活：_bridge.py 在读线程直接回应 ping，线程池被卡住的调用占满时也能应答；
+     * 超时未应答说明子进程已卡死，杀掉后由下次调用重新拉起
+     */
+    probe() {
+        if (!this.proc || this.probing) return;
+        const proc = this.proc;
+        const id = ++this.nextId;
+        this.probing = true;
+        const done = () => {
+            this.probing = false;
+        };
+        const timer = setTimeout(() => {
+            this.pending.delete(id);
+            done();
+            fastify.log.warn(`_bridge.py 常驻进程 ${BRIDGE_PING_TIMEOUT}ms 内无应答，重启`);
+            proc.kill();
+        }, BRIDGE_PING_TIMEOUT);
+        this.pending.set(id, {resolve: done, reject: done, timer});
+        this.send({id, ping: true});
+    }
+
+    settle(msg) {
+        const entry = this.pending.get(msg.id);
+        if (!entry) return;
+        this.pending.delete(msg.id);
+        clearTimeout(entry.timer);
+        if (msg.error) {
+            entry.reject(new Error(`Python错误: ${msg.error}\n${msg.traceback}`));
+        } else {
+            entry.resolve(reviveBytes(msg.result));
+        }
+    }
+
+    call(script_path, method_name, env, args) {
+        if (!this.proc) this.start();
+        const id = ++this.nextId;
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                reject(new Error("Python桥接进程响应超时"));
+                if (!this.proc) return;
+                // 只放弃这一个调用：通知子进程取消，其余调用照常进行
+                this.send({id, cancel: true});
+                this.probe();
+            }, timeout);
+            this.pending.set(id, {resolve, reject, timer});
+            this.send({id, script_path, method_name, env, args});
+        });
+    }
+}
+
+const stdioBridges = new Array(BRIDGE_WORKERS).fill(null);
+
+function stdioBridgeFor(bridgePath, filePath) {
+    const index = parseInt(md5(filePath).slice(0, 8), 16) % BRIDGE_WORKERS;
+    return stdioBridges[index] = stdioBridges[index] || new StdioBridge(bridgePath);
+}
+
 const loadEsmWithHash = async function (filePath, fileHash, env) {
     // 创建Python模块代理
     const spiderProxy = {};
@@ -177,6 +314,9 @@ const loadEsmWithHash = async function (filePath, fileHash, env) {
     spiderMethods.forEach(method => {
         spiderProxy[method] = async (...args) => {
             // return callPythonMethod(method, env, ...args);
+            if (BRIDGE_MODE === 'stdio') {
+                return stdioBridgeFor(bridgePath, filePath).call(filePath, method, env, args);
+            }
             return netCallPythonMethod(filePath, method, env, ...args);
         };
     });
@@ -272,6 +412,31 @@ const search = async function (filePath, env, wd, quick = 0, pg = 1) {
     return json2Object(await moduleObject.search(wd, quick, pg));
 }
 
+/**
+ * 聚合搜索：一次请求搜索多个 Python 源，由守护进程并发执行 searchContent、按片名去重排序，软截止到期返回已有结果。
+ * stdio 模式没有守护进程，逐源调用 search 后直接拼接列表。
+ * @param {Array<{filePath: string, env: object, name?: string}>} sources
+ * @param {{parallel?: number, max_hits?: number, soft_deadline?: number}} options 透传给守护进程 multi_search
+ */
+const multiSearch = async function (sources, wd, quick = 0, pg = 1, options = {}) {
+    if (BRIDGE_MODE === 'stdio') {
+        const settled = await Promise.allSettled(sources.map(src => search(src.filePath, src.env, wd, quick, pg)));
+        const list = settled.flatMap(it => it.status === 'fulfilled' && Array.isArray(it.value.list) ? it.value.list : []);
+        return {list, total: list.length, partial: false};
+    }
+    return netMultiSearch({
+        ...options,
+        wd,
+        quick,
+        pg,
+        sources: sources.map(src => ({
+            script_path: src.filePath,
+            env: src.env,
+            name: src.name || path.basename(src.filePath, '.py'),
+        })),
+    });
+}
+
 const play = async function (filePath, env, flag, id, flags) {
     const moduleObject = await init(filePath, env);
     return json2Object(await moduleObject.play(flag, id, flags));
@@ -296,6 +461,7 @@ export default {
     category,
     detail,
     search,
+    multiSearch,
     play,
     proxy,
     action,
@@ -10,14 +10,13 @@
 
 # -*- coding: utf-8 -*-
 # 仅可用于学习用途
-from Crypto.Cipher import AES
-
 try:
     # from base.spider import Spider as BaseSpider
     from base.spider import BaseSpider
+    from base import crypto
 except ImportError:
     from t4.base.spider import BaseSpider
-from Crypto.Util.Padding import unpad
+    from t4.base import crypto
 import re, sys, time, json, base64, hashlib, urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -292,13 +291,8 @@ class Spider(BaseSpider):
         if not (key or iv):
             key = self.data_key
             iv = self.data_iv
-        key_bytes = key.encode('utf-8')
-        iv_bytes = iv.encode('utf-8')
         encrypted_data = base64.b64decode(data)
-        cipher = AES.new(key_bytes, AES.MODE_CBC, iv_bytes)
-        decrypted_padded = cipher.decrypt(encrypted_data)
-        decrypted = unpad(decrypted_padded, AES.block_size)
-        return decrypted.decode('utf-8')
+        return crypto.aes_decrypt(encrypted_data, key, iv).decode('utf-8')
 
     def t(self, s, v, v1):
         if s is not None and s != '':
@@ -8,15 +8,14 @@
 })
 """
 
-from Crypto.Cipher import AES
-
 try:
     # from base.spider import Spider as BaseSpider
     from base.spider import BaseSpider
+    from base import crypto
 except ImportError:
     from t4.base.spider import BaseSpider
-from Crypto.Util.Padding import unpad, pad
-import re, sys, time, json, base64, urllib3, hashlib, binascii
+    from t4.base import crypto
+import re, sys, time, json, base64, urllib3, hashlib
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 sys.path.append('..')
@@ -161,13 +160,9 @@ class Spider(BaseSpider):
             'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.3 Mobile/15E148 Safari/604.1'}}
 
     def ck_encrypt(self, str):
-        key = self.ckkey.encode('utf-8')
-        iv = self.ckiv.encode('utf-8')
         b64_1 = base64.b64encode(str.encode("utf-8"))
         b64_2 = base64.b64encode(b64_1)
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        padded_data = pad(b64_2, AES.block_size)
-        encrypted_bytes = cipher.encrypt(padded_data)
+        encrypted_bytes = crypto.aes_encrypt(b64_2, self.ckkey, self.ckiv)
         hex_encoded = encrypted_bytes.hex()
         hex_bytes = hex_encoded.encode('utf-8')
         final_ciphertext = base64.b64encode(hex_bytes).decode('utf-8')
@@ -177,13 +172,8 @@ class Spider(BaseSpider):
         prefix = "FROMSKZZJM"
         if data.startswith('FROMSKZZJM'):
             try:
-                encrypted_hex = data[len(prefix):]
-                key = self.key.encode('utf-8')
-                iv = self.iv.encode('utf-8')
-                encrypted_data = binascii.unhexlify(encrypted_hex)
-                cipher = AES.new(key, AES.MODE_CBC, iv)
-                decrypted_data = unpad(cipher.decrypt(encrypted_data), AES.block_size)
-                return decrypted_data.decode('utf-8')
+                encrypted_data = crypto.hex_to_bytes(data[len(prefix):])
+                return crypto.aes_decrypt(encrypted_data, self.key, self.iv).decode('utf-8')
             except Exception:
                 return None
         else:
@@ -1,8 +1,15 @@
+import base64
+import hashlib
 import importlib
+import importlib.util
+import struct
 import sys
+import threading
 import traceback
 import json
 import os
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 method_dict = {
     'init': 'init',
@@ -75,55 +82,58 @@ def t4_spider_init(spider, ext=''):
     return spider, result
 
 
-def call_spider_method(spider, method_name, env, args):
-    """调用 Spider 实例的指定方法"""
-    invoke_method_name = method_dict.get(method_name) or method_name
+def _parse_json(value):
+    if not isinstance(value, str):
+        return value
     try:
-        # 检查方法是否存在
-        if not hasattr(spider, invoke_method_name):
-            raise AttributeError(f"Spider has no method named '{invoke_method_name}'")
+        return json.loads(value)
+    except json.JSONDecodeError:
+        # 保持原始字符串
+        return value
 
-        method = getattr(spider, invoke_method_name)
 
-        # 解析参数
-        parsed_args = []
-        for arg in args:
-            try:
-                # 尝试解析 JSON
-                parsed_args.append(json.loads(arg))
-            except json.JSONDecodeError:
-                # 保持原始字符串
-                parsed_args.append(arg)
+def invoke_spider_method(spider, method_name, env, args):
+    """调用 Spider 实例的指定方法，出错时抛出异常"""
+    invoke_method_name = method_dict.get(method_name) or method_name
+    # 检查方法是否存在
+    if not hasattr(spider, invoke_method_name):
+        raise AttributeError(f"Spider has no method named '{invoke_method_name}'")
+
+    method = getattr(spider, invoke_method_name)
+
+    # 解析参数
+    parsed_args = [_parse_json(arg) for arg in args]
+    env = _parse_json(env)
+
+    print(f'parsed_args:{parsed_args}')
+
+    if method_name == 'init':
+        extend = parsed_args[0] if parsed_args and isinstance(parsed_args, list) else ''
+        spider, result = t4_spider_init(spider, extend)
+        #             result = spider.init(modules)
+        return result
+    else:
+        if not hasattr(spider, '_init_ok_'):
+            #                 spider,_ = t4_spider_init(spider,*parsed_args) # 需要传extend参数，暂时没有好办法
+            #                 extend = parsed_args[0] if parsed_args and isinstance(parsed_args,list)  else ''
+            #                 extend = env.get('ext','')
+            extend = env.get('ext') if isinstance(env, dict) else ''
+            spider, _ = t4_spider_init(spider, extend)
+            method = getattr(spider, invoke_method_name)
+        result = method(*parsed_args)
+    # 返回结果
+    if result:
         try:
-            env = json.loads(env)
-        except json.JSONDecodeError:
-            # 保持原始字符串
+            return spider.json2str(result)
+        except Exception as e:
             pass
+    return result
 
-        print(f'parsed_args:{parsed_args}')
-
-        if method_name == 'init':
-            extend = parsed_args[0] if parsed_args and isinstance(parsed_args, list) else ''
-            spider, result = t4_spider_init(spider, extend)
-            #             result = spider.init(modules)
-            return result
-        else:
-            if not hasattr(spider, '_init_ok_'):
-                #                 spider,_ = t4_spider_init(spider,*parsed_args) # 需要传extend参数，暂时没有好办法
-                #                 extend = parsed_args[0] if parsed_args and isinstance(parsed_args,list)  else ''
-                #                 extend = env.get('ext','')
-                extend = env.get('ext') if isinstance(env, dict) else ''
-                spider, _ = t4_spider_init(spider, extend)
-                method = getattr(spider, invoke_method_name)
-            result = method(*parsed_args)
-        # 返回结果
-        if result:
-            try:
-                return spider.json2str(result)
-            except Exception as e:
-                pass
-        return result
 
+def call_spider_method(spider, method_name, env, args):
+    """调用 Spider 实例的指定方法"""
+    try:
+        return invoke_spider_method(spider, method_name, env, args)
     except Exception as e:
         # 打印详细错误信息
         error_msg = {
@@ -133,7 +143,186 @@ def call_spider_method(spider, method_name, env, args):
         print(error_msg)
 
 
+# ---------- 常驻模式：python _bridge.py --serve ----------
+# stdin 读请求帧、stdout 写响应帧，帧 = 4 字节大端长度 + UTF-8 JSON：
+#   请求 {"id", "script_path", "method_name", "env", "args": [...]}
+#   响应 {"id", "result"} 或 {"id", "error", "traceback"}；结果中的 bytes 编码为 {"$b64": base64 字符串}
+#   取消 {"id", "cancel": true}：置位该请求的取消信号(BaseSpider.callCancelled)，无响应
+#   探活 {"id", "ping": true}：读线程立即回 {"id", "result": "pong"}
+# 已加载的 spider 及其 init 状态按 (script_path, env) 在调用间保留，脚本修改后重新导入。
+# 请求在线程池中并发执行：同一 spider 的调用串行，不同 spider 互不阻塞。
+SERVE_THREADS = int(os.environ.get('T4_BRIDGE_THREADS', 8))
+
+
+def _json_default(obj):
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        # 带标记返回，Node 端据此还原为 Buffer（与普通字符串区分）
+        return {'$b64': base64.b64encode(obj).decode('ascii')}
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _join_iterators(result):
+    """localProxy 可返回 [code, mime, 字节块生成器, ...]（流式）；JSON 帧无法流式传输，先拼接为完整 bytes"""
+    if not isinstance(result, (list, tuple)):
+        return result
+    joined = list(result)
+    for i, item in enumerate(joined):
+        if isinstance(item, Iterator):
+            try:
+                joined[i] = b''.join(bytes(chunk) for chunk in item)
+            finally:
+                close = getattr(item, 'close', None)
+                if close is not None:
+                    close()
+    return joined
+
+
+def _read_frame(stream):
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    (length,) = struct.unpack('>I', header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return json.loads(payload.decode('utf-8'))
+
+
+def _write_frame(stream, obj):
+    payload = json.dumps(obj, ensure_ascii=False, default=_json_default).encode('utf-8')
+    stream.write(struct.pack('>I', len(payload)) + payload)
+    stream.flush()
+
+
+def _load_spider_module(script_path, module_name):
+    """
+    每个 (script_path, env) 以独立模块名加载脚本（同守护进程）：BaseSpider 按类单例，
+    共用同一模块时不同 ext 会拿到同一个 spider 实例
+    """
+    script_dir = os.path.dirname(os.path.abspath(script_path))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f'cannot load spider script: {script_path}')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        sys.modules.pop(module_name, None)
+        raise
+    if not hasattr(module, 'Spider'):
+        raise AttributeError(f"Script {script_path} does not contain a 'Spider' class")
+    return module
+
+
+def _cached_spider(spiders, lock, script_path, env, create_locks):
+    """
+    按 (script_path, env) 复用 spider 实例；脚本 mtime 变化时以新模块重建
+    全局锁只保护字典查找与写入；导入脚本与实例化在按 key 的创建锁内进行，慢源不阻塞其它源
+    @param create_locks: key -> 创建锁，同一 key 只创建一次
+    @return: (spider, 该 spider 的调用锁)
+    """
+    env_key = env if isinstance(env, str) else json.dumps(env, sort_keys=True, ensure_ascii=False)
+    key = (script_path, env_key)
+    mtime = os.path.getmtime(script_path) if os.path.exists(script_path) else 0
+    with lock:
+        cached = spiders.get(key)
+        if cached and cached[1] == mtime:
+            return cached[0], cached[2]
+        create_lock = create_locks.setdefault(key, threading.Lock())
+    with create_lock:
+        with lock:
+            cached = spiders.get(key)
+            if cached and cached[1] == mtime:
+                return cached[0], cached[2]
+        module_name = 't4_bridge_' + hashlib.md5(f'{script_path}\n{env_key}'.encode('utf-8')).hexdigest()[:16]
+        module = _load_spider_module(script_path, module_name)
+        try:
+            parsed_env = json.loads(env_key)
+        except json.JSONDecodeError:
+            parsed_env = env_key
+        proxy_url = parsed_env.get('proxyUrl') if isinstance(parsed_env, dict) else ''
+        spider = module.Spider(t4_api=proxy_url)
+        with lock:
+            entry = (spider, mtime, cached[2] if cached else threading.Lock())
+            spiders[key] = entry
+        return entry[0], entry[2]
+
+
+def serve():
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    # spider 的 print 输出转到 stderr，不混入响应帧
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    stdin = sys.stdin.buffer
+    spiders = {}
+    spiders_lock = threading.Lock()
+    create_locks = {}
+    write_lock = threading.Lock()
+    # 请求 id -> 取消信号；Node 端超时后发 {"id", "cancel": true}
+    cancels = {}
+    cancels_lock = threading.Lock()
+
+    def _reply(obj):
+        with write_lock:
+            _write_frame(out, obj)
+
+    def _handle(req, cancel_event):
+        req_id = req.get('id')
+        try:
+            if cancel_event.is_set():
+                # 排队期间已被取消：不再执行
+                raise ConnectionAbortedError('call cancelled')
+            spider, call_lock = _cached_spider(spiders, spiders_lock, req['script_path'], req.get('env') or '',
+                                               create_locks)
+            with call_lock:
+                if cancel_event.is_set():
+                    raise ConnectionAbortedError('call cancelled')
+                set_ctx = getattr(spider, 'setCallContext', None)
+                if set_ctx is not None:
+                    # fetch/post 据此提前中止已被取消的调用
+                    set_ctx(None, cancel_event)
+                try:
+                    result = invoke_spider_method(spider, req['method_name'], req.get('env') or '',
+                                                  req.get('args') or [])
+                    result = _join_iterators(result)
+                finally:
+                    if set_ctx is not None:
+                        set_ctx(None, None)
+            _reply({'id': req_id, 'result': result})
+        except Exception as e:
+            _reply({'id': req_id, 'error': str(e), 'traceback': traceback.format_exc()})
+        finally:
+            with cancels_lock:
+                cancels.pop(req_id, None)
+
+    pool = ThreadPoolExecutor(max_workers=SERVE_THREADS, thread_name_prefix='t4-bridge')
+    while True:
+        req = _read_frame(stdin)
+        if req is None:
+            break
+        if req.get('ping'):
+            # 在读线程直接应答，线程池占满时也能证明进程仍在响应
+            _reply({'id': req.get('id'), 'result': 'pong'})
+            continue
+        if req.get('cancel'):
+            with cancels_lock:
+                event = cancels.get(req.get('id'))
+            if event is not None:
+                event.set()
+            continue
+        event = threading.Event()
+        with cancels_lock:
+            cancels[req.get('id')] = event
+        pool.submit(_handle, req, event)
+    pool.shutdown(wait=True)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve()
+        return
     if len(sys.argv) < 3:
         print("Usage: python bridge.py <script_path> <method_name> [args...]")
         return
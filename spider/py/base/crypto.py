@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File  : crypto.py
+# Desc  : spider 共用的加解密工具：缓存密钥/解密器对象，hex 走 bytes.hex/binascii，提供批量接口
+"""
+用法示例::
+
+    from base import crypto
+
+    text = crypto.aes_decrypt(base64.b64decode(data), key, iv).decode('utf-8')
+    texts = crypto.aes_cbc_decrypt_batch(payloads, key, iv)
+    plain = crypto.rsa_decrypt(ciphertext, private_key)
+
+key/iv 可传 str(按 utf-8 编码) 或 bytes；RSA 密钥可传带或不带 PEM 头尾的字符串，
+同一密钥只导入一次(RSA.importKey 开销远大于单块解密)。
+"""
+import base64
+import binascii
+import time
+from functools import lru_cache
+
+from Crypto.Util.Padding import pad, unpad
+
+# AES 与 RSA/PKCS1 模块都只在首次用到时导入：base.spider 在模块级导入本文件，
+# 而 Crypto.Cipher.AES 导入时会加载 ctypes/platform 探测 CPU 特性，不用加解密的 spider 不必承担
+
+BLOCK = 16  # AES 分组长度
+
+
+def _aes():
+    from Crypto.Cipher import AES
+    return AES
+
+
+def to_bytes(data, encoding='utf-8') -> bytes:
+    if isinstance(data, str):
+        return data.encode(encoding)
+    if isinstance(data, (bytearray, memoryview)):
+        return bytes(data)
+    return data
+
+
+def bytes_to_hex(data, upper=False, sep='') -> str:
+    """bytes 转 hex 字符串(C 实现，替代逐字节 '%02X' 拼接)"""
+    text = data.hex(sep) if sep else binascii.hexlify(data).decode('ascii')
+    return text.upper() if upper else text
+
+
+def hex_to_bytes(text) -> bytes:
+    """hex 字符串转 bytes，忽略空白"""
+    return bytes.fromhex(text) if isinstance(text, str) else binascii.unhexlify(text)
+
+
+# ==================== AES ======================
+@lru_cache(maxsize=64)
+def _ecb(key: bytes):
+    # ECB 解密器无链式状态，可跨调用复用
+    AES = _aes()
+    return AES.new(key, AES.MODE_ECB)
+
+
+def _mode(mode):
+    return getattr(_aes(), f'MODE_{mode.upper()}') if isinstance(mode, str) else mode
+
+
+def aes_encrypt(data, key, iv=None, mode='CBC', padding=True) -> bytes:
+    """
+    AES 加密
+    @param data: 明文 str/bytes
+    @param key: 密钥 str/bytes
+    @param iv: 偏移量，ECB 模式不需要
+    @param mode: 'CBC' / 'ECB' 或 AES.MODE_*
+    @param padding: 是否 PKCS7 填充
+    @return: 密文 bytes
+    """
+    AES = _aes()
+    data, key = to_bytes(data), to_bytes(key)
+    if padding:
+        data = pad(data, BLOCK)
+    mode = _mode(mode)
+    if mode == AES.MODE_ECB:
+        return _ecb(key).encrypt(data)
+    return AES.new(key, mode, to_bytes(iv)).encrypt(data)
+
+
+def aes_decrypt(data, key, iv=None, mode='CBC', padding=True, strict=True) -> bytes:
+    """
+    AES 解密
+    @param data: 密文 bytes
+    @param padding: 是否去除 PKCS7 填充
+    @param strict: 填充不正确时是否抛出异常；False 时原样返回
+    @return: 明文 bytes
+    """
+    AES = _aes()
+    key = to_bytes(key)
+    mode = _mode(mode)
+    if mode == AES.MODE_ECB:
+        plain = _ecb(key).decrypt(data)
+    else:
+        plain = AES.new(key, mode, to_bytes(iv)).decrypt(data)
+    return _unpad(plain, strict) if padding else plain
+
+
+def _unpad(plain, strict=True):
+    try:
+        return unpad(plain, BLOCK)
+    except ValueError:
+        if strict:
+            raise
+        return plain
+
+
+def aes_cbc_decrypt_batch(payloads, key, iv, padding=True, strict=True) -> list:
+    """
+    批量 AES-CBC 解密：所有密文拼接后只做一次 ECB 解密，再与前一密文块(首块为 iv)整体异或。
+    @param payloads: 密文 bytes 列表(长度须为 16 的倍数)
+    @param iv: 所有密文共用的 iv，或与 payloads 等长的 iv 列表
+    @return: 明文 bytes 列表
+    """
+    payloads = [to_bytes(p) if isinstance(p, str) else p for p in payloads]  # memoryview 切片无需复制
+    if not payloads:
+        return []
+    ivs = [to_bytes(iv)] * len(payloads) if isinstance(iv, (str, bytes, bytearray, memoryview)) else [to_bytes(i) for i in iv]
+    joined = b''.join(payloads)
+    if len(joined) % BLOCK:
+        raise ValueError('Data must be padded to 16 byte boundary in CBC mode')
+    decrypted = _ecb(to_bytes(key)).decrypt(joined)
+    chain = b''.join(i + p[:-BLOCK] for p, i in zip(payloads, ivs) if p)
+    plain = (int.from_bytes(decrypted, 'big') ^ int.from_bytes(chain, 'big')).to_bytes(len(joined), 'big')
+    result, offset = [], 0
+    for p in payloads:
+        chunk = plain[offset:offset + len(p)]
+        offset += len(p)
+        result.append(_unpad(chunk, strict) if padding and chunk else chunk)
+    return result
+
+
+# ==================== RSA ======================
+@lru_cache(maxsize=32)
+def rsa_key(key: str, private=True):
+    """导入 RSA 密钥(结果缓存)；不带 PEM 头尾时自动补全"""
+    from Crypto.PublicKey import RSA
+    if not key.lstrip().startswith('-----'):
+        kind = 'RSA PRIVATE KEY' if private else 'PUBLIC KEY'
+        key = f'-----BEGIN {kind}-----\n{key}\n-----END {kind}-----'
+    return RSA.importKey(key)
+
+
+@lru_cache(maxsize=32)
+def _pkcs1(key: str, private=True):
+    from Crypto.Cipher import PKCS1_v1_5
+    return PKCS1_v1_5.new(rsa_key(key, private))
+
+
+def rsa_decrypt(data, private_key, sentinel=b' ') -> bytes:
+    """
+    RSA(PKCS1 v1.5) 私钥解密，密文按密钥长度分段
+    @param data: 密文 bytes
+    @param sentinel: 单段解密失败时的返回值；为 None 时抛出 ValueError
+    """
+    cipher = _pkcs1(private_key, True)
+    size = rsa_key(private_key, True).size_in_bytes()
+    parts = []
+    for offset in range(0, len(data), size):
+        part = cipher.decrypt(data[offset:offset + size], sentinel)
+        if part is None:
+            raise ValueError('RSA解密失败，可能是数据损坏或密钥不匹配')
+        parts.append(part)
+    return b''.join(parts)
+
+
+def rsa_encrypt(data, public_key, block=None) -> bytes:
+    """
+    RSA(PKCS1 v1.5) 公钥加密，明文按 block(默认密钥长度-11) 分段
+    @return: 密文 bytes
+    """
+    cipher = _pkcs1(public_key, False)
+    limit = rsa_key(public_key, False).size_in_bytes() - 11
+    block = min(block or limit, limit)
+    data = to_bytes(data)
+    return b''.join(cipher.encrypt(data[offset:offset + block]) for offset in range(0, len(data), block))
+
+
+def rsa_decrypt_batch(payloads, private_key, sentinel=b' ') -> list:
+    """批量 RSA 私钥解密，共用同一个已导入的密钥"""
+    return [rsa_decrypt(to_bytes(p), private_key, sentinel) for p in payloads]
+
+
+# ==================== 基准 ======================
+def benchmark(n=2000) -> dict:
+    """
+    与 BaseSpider 原有实现(每次新建解密器/导入密钥、逐字节拼 hex)对比的微基准
+    @return: {用例: {'legacy_us': 原实现单次耗时, 'new_us': 当前实现单次耗时}}
+    """
+    from Crypto.Cipher import AES, PKCS1_v1_5
+    from Crypto.PublicKey import RSA
+
+    def timeit(fn, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            fn()
+        return round((time.perf_counter() - start) / count * 1e6, 2)
+
+    key, iv = '1234567890abcdef', 'abcdef1234567890'
+    payloads = [aes_encrypt(('{"vod_name":"测试%d"}' % i) * 8, key, iv) for i in range(32)]
+    b64 = base64.b64encode(payloads[0]).decode()
+    private = RSA.generate(2048)
+    private_pem = private.export_key().decode()
+    rsa_cipher = PKCS1_v1_5.new(private.publickey()).encrypt(b'x' * 200)
+    raw = bytes(range(256)) * 16
+
+    def legacy_aes():
+        unpad(AES.new(key.encode(), AES.MODE_CBC, iv.encode()).decrypt(base64.b64decode(b64)), BLOCK).decode()
+
+    def legacy_rsa():
+        PKCS1_v1_5.new(RSA.importKey(private_pem)).decrypt(rsa_cipher, b' ')
+
+    rsa_count = max(n // 20, 10)
+    return {
+        'aes_cbc_decode': {'legacy_us': timeit(legacy_aes, n),
+                           'new_us': timeit(lambda: aes_decrypt(base64.b64decode(b64), key, iv).decode(), n)},
+        'aes_cbc_batch_32': {'legacy_us': timeit(lambda: [unpad(AES.new(key.encode(), AES.MODE_CBC, iv.encode())
+                                                                .decrypt(p), BLOCK) for p in payloads], n // 10),
+                             'new_us': timeit(lambda: aes_cbc_decrypt_batch(payloads, key, iv), n // 10)},
+        'rsa_private_decode': {'legacy_us': timeit(legacy_rsa, rsa_count),
+                               'new_us': timeit(lambda: rsa_decrypt(rsa_cipher, private_pem), rsa_count)},
+        'bytes_to_hex_4k': {'legacy_us': timeit(lambda: ''.join(['%02X ' % b for b in raw]).replace(' ', ''), n // 10),
+                            'new_us': timeit(lambda: bytes_to_hex(raw, upper=True), n // 10)},
+    }
+
+
+if __name__ == '__main__':
+    for case, result in benchmark().items():
+        print(f"{case:<20} legacy {result['legacy_us']:>10}us  new {result['new_us']:>10}us")
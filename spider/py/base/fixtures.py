@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File  : fixtures.py
+# Desc  : HTTP 录制/回放：在 requests 传输层记录请求与响应，离线时按原样回放，用于无网络环境下的基准与剖析
+"""
+环境变量(在 base.spider 导入时自动生效)::
+
+    T4_HTTP_FIXTURES=record|replay   模式；不设置则不启用
+    T4_HTTP_ARCHIVE=/path/to/dir     归档目录，默认 ./http_fixtures
+    T4_HTTP_LATENCY=0.05|recorded    回放时每个响应注入的延迟：秒数，或 recorded 按录制时的耗时
+    T4_HTTP_IGNORE_PARAMS=wts,w_rid  计算 key 时忽略的查询参数(时间戳/签名等每次都变的参数)
+
+也可在代码中调用::
+
+    from base import fixtures
+    fixtures.install('replay', 'data/fixtures', latency=0.02)
+
+归档格式：index.jsonl 每行一条 {key, method, url, status, headers, body, elapsed}，
+key = sha256(METHOD + 规范化 URL + 请求体 sha256)；响应体按内容 sha256 存为 objects/xx/xxxx(zlib 压缩)，相同响应只存一份。
+钩子装在 HTTPAdapter.send 上，BaseSpider.fetch/post 与各 spider 自建的 requests.Session 都会经过；
+重定向逐跳录制/回放。录制模式会读完整个响应体(流式响应也是)。
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# 响应体已按解码后的内容保存，这些头回放时不能再带
+_DROP_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection'}
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _body_bytes(body) -> bytes:
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return bytes(body)
+    return repr(body).encode('utf-8')  # 生成器等流式请求体无法稳定复现，只按类型区分
+
+
+class FixtureArchive:
+    """内容寻址的录制归档"""
+
+    def __init__(self, root, ignore_params=()):
+        self.root = root
+        self.ignore_params = {p.lower() for p in ignore_params}
+        self._lock = threading.Lock()
+        self._index = {}
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        index_path = os.path.join(root, 'index.jsonl')
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index[entry['key']] = entry  # 同一 key 以最后一次录制为准
+
+    def canonical_url(self, url) -> str:
+        """查询参数排序并去掉 ignore_params，片段丢弃"""
+        parts = urlsplit(url)
+        query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                       if k.lower() not in self.ignore_params)
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+    def key(self, method, url, body) -> str:
+        return _sha256(f'{method.upper()} {self.canonical_url(url)}\n{_sha256(_body_bytes(body))}'.encode('utf-8'))
+
+    def _object_path(self, digest) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def get(self, key):
+        """@return: (索引条目, 响应体 bytes)，未录制时返回 None"""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        with open(self._object_path(entry['body']), 'rb') as f:
+            return entry, zlib.decompress(f.read())
+
+    def put(self, key, method, url, status, headers, body: bytes, elapsed: float):
+        digest = _sha256(body)
+        path = self._object_path(digest)
+        entry = {'key': key, 'method': method.upper(), 'url': url, 'status': status,
+                 'headers': {k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS},
+                 'body': digest, 'elapsed': round(elapsed, 4)}
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(zlib.compress(body, 6))
+            with open(os.path.join(self.root, 'index.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._index[key] = entry
+
+    def __len__(self):
+        return len(self._index)
+
+
+_state = {'mode': None, 'archive': None, 'latency': 0.0, 'hits': 0, 'misses': 0, 'recorded': 0}
+_original_send = HTTPAdapter.send
+
+
+def _build_response(request, entry, body: bytes) -> Response:
+    rsp = Response()
+    rsp.status_code = entry['status']
+    rsp.headers = CaseInsensitiveDict(entry['headers'])
+    rsp.encoding = get_encoding_from_headers(rsp.headers)
+    rsp._content = body
+    rsp._content_consumed = True
+    rsp.raw = io.BytesIO(body)  # 兼容按 raw.read/readinto 流式读取的 spider
+    rsp.url = request.url
+    rsp.request = request
+    rsp.reason = 'OK' if rsp.status_code < 400 else 'Replayed'
+    return rsp
+
+
+def _replay_send(adapter, request, **kwargs):
+    archive = _state['archive']
+    found = archive.get(archive.key(request.method, request.url, request.body))
+    if found is None:
+        _state['misses'] += 1
+        raise RequestsConnectionError(f'no recorded response: {request.method} {request.url}', request=request)
+    entry, body = found
+    _state['hits'] += 1
+    latency = entry.get('elapsed', 0) if _state['latency'] == 'recorded' else _state['latency']
+    if latency:
+        time.sleep(latency)
+    return _build_response(request, entry, body)
+
+
+def _record_send(adapter, request, **kwargs):
+    started = time.time()
+    rsp = _original_send(adapter, request, **kwargs)
+    body = rsp.content  # 读完整个响应体(含解压)，之后 raw 换成内存副本供流式读取
+    rsp.raw = io.BytesIO(body)
+    archive = _state['archive']
+    archive.put(archive.key(request.method, request.url, request.body), request.method, request.url,
+                rsp.status_code, dict(rsp.headers), body, time.time() - started)
+    _state['recorded'] += 1
+    return rsp
+
+
+def install(mode, root='http_fixtures', latency=0.0, ignore_params=()):
+    """
+    开启录制/回放
+    @param mode: 'record' / 'replay'；None 或 '' 关闭
+    @param root: 归档目录
+    @param latency: 回放延迟秒数，或 'recorded' 按录制耗时
+    @param ignore_params: 计算 key 时忽略的查询参数名
+    """
+    if not mode:
+        uninstall()
+        return
+    if mode not in ('record', 'replay'):
+        raise ValueError(f'unknown fixtures mode: {mode}')
+    _state.update(mode=mode, archive=FixtureArchive(root, ignore_params), latency=latency,
+                  hits=0, misses=0, recorded=0)
+    HTTPAdapter.send = _record_send if mode == 'record' else _replay_send
+
+
+def uninstall():
+    HTTPAdapter.send = _original_send
+    _state.update(mode=None, archive=None)
+
+
+def stats() -> dict:
+    archive = _state['archive']
+    return {'mode': _state['mode'], 'entries': len(archive) if archive else 0, 'hits': _state['hits'],
+            'misses': _state['misses'], 'recorded': _state['recorded']}
+
+
+def install_from_env():
+    mode = os.environ.get('T4_HTTP_FIXTURES', '').strip().lower()
+    if not mode or _state['mode'] == mode:
+        return
+    latency = os.environ.get('T4_HTTP_LATENCY', '0').strip().lower()
+    params = [p.strip() for p in os.environ.get('T4_HTTP_IGNORE_PARAMS', '').split(',') if p.strip()]
+    install(mode, os.environ.get('T4_HTTP_ARCHIVE') or 'http_fixtures',
+            latency if latency == 'recorded' else float(latency or 0), params)
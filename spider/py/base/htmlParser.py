@@ -8,10 +8,8 @@
 # upDate  : 2024/05/16 支持:not,even,odd,has,contans,matches,empty 新特性，pdfh取属性支持||
 
 import ujson
-from pyquery import PyQuery as pq
 from urllib.parse import urljoin
 import re
-from jsonpath import jsonpath
 # 处理html转义和反转义问题
 from html import escape, unescape
 
@@ -21,6 +19,12 @@ URLJOIN_ATTR = '(url|src|href|-original|-src|-play|-url|style)$|^(data-|url-|src
 SPECIAL_URL = '^(ftp|magnet|thunder|ws):'  # 过滤特殊链接,不走urlJoin
 
 
+def pq(*args, **kwargs):
+    """pyquery(连带 lxml/cssselect)导入较重，首次解析 HTML 时才加载"""
+    from pyquery import PyQuery
+    return PyQuery(*args, **kwargs)
+
+
 class jsoup:
     def __init__(self, MY_URL=''):
         self.MY_URL = MY_URL
@@ -266,6 +270,7 @@ class jsoup:
                 return ''
         if not parse.startswith('$.'):
             parse = f'$.{parse}'
+        from jsonpath import jsonpath
         ret = ''
         for ps in parse.split('||'):
             ret = jsonpath(html, ps)
@@ -295,6 +300,7 @@ class jsoup:
             parse = f'$.{parse}'
         # print(html)
         # print(parse)
+        from jsonpath import jsonpath
         ret = jsonpath(html, parse)
         # print(ret)
         # print(type(ret))
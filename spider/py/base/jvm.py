@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File  : jvm.py
+# Desc  : T4 下 jar 类 spider 共用的 JVM 宿主：进程内只启动一次 JVM，缓存 JClass/方法句柄，线程按需附着，字节数组整块转换
+"""
+用法示例::
+
+    from base.jvm import jvm_host
+
+    jar = jvm_host.load_jar('./bdys.jar')
+    plain = jvm_host.call('com.example.Api', 'decode', jvm_host.to_java_bytes(data), jar=jar)
+    data = jvm_host.from_java_bytes(plain)
+
+状态保存在 base.jvm 模块中(随 base 包只导入一次)，与 JVM 本身一样是进程级的：
+守护进程以新的模块名重新导入 spider 脚本或 base_java_loader 时不会再次 startJVM，已解析的类和方法句柄继续复用。
+JVM 启动时的首个 jar 进入 classpath；之后加入的 jar 各用一个 URLClassLoader 加载(jpype 不支持启动后追加 classpath)。
+依赖 jpype1(可选安装)，仅在首次 load_jar 时导入。
+"""
+import os
+import threading
+
+
+class JvmHost:
+    """进程级 JVM 宿主，可多线程并发调用"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._jpype = None
+        self._jars = {}  # jar 绝对路径 -> ClassLoader；None 表示在启动 classpath 中
+        self._classes = {}  # (jar, 类名) -> JClass
+        self._methods = {}  # (jar, 类名, 方法名) -> 方法句柄
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {'class_loads': 0, 'method_resolves': 0, 'calls': 0, 'attaches': 0}
+
+    @property
+    def started(self) -> bool:
+        return self._jpype is not None and self._jpype.isJVMStarted()
+
+    def _require(self):
+        """已启动 JVM 的 jpype 模块；未经 load_jar 启动时报错，避免在 None 上调用"""
+        jpype = self._jpype
+        if jpype is None:
+            raise RuntimeError('JVM not started')
+        return jpype
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def load_jar(self, jar_path: str) -> str:
+        """
+        确保 jar 可用(JVM 未启动则以该 jar 为 classpath 启动)
+        @return: jar 绝对路径，作为 jclass/call 的 jar 参数
+        """
+        jar = os.path.abspath(jar_path)
+        if jar in self._jars:
+            return jar
+        with self._lock:
+            if jar in self._jars:
+                return jar
+            if not os.path.exists(jar):
+                raise FileNotFoundError(jar)
+            import jpype
+            self._jpype = jpype
+            if not jpype.isJVMStarted():
+                jpype.startJVM(classpath=[jar], convertStrings=False)
+                self._jars[jar] = None
+            else:
+                self.attach()
+                url_cls = jpype.JClass('java.net.URL')
+                url = jpype.JClass('java.io.File')(jar).toURI().toURL()
+                parent = jpype.JClass('java.lang.ClassLoader').getSystemClassLoader()
+                self._jars[jar] = jpype.JClass('java.net.URLClassLoader')(jpype.JArray(url_cls)([url]), parent)
+        return jar
+
+    def attach(self):
+        """当前线程附着到 JVM(守护方式，不阻止进程退出)；每个线程只检查一次"""
+        if getattr(self._local, 'attached', False):
+            return
+        jpype = self._require()
+        if not jpype.isThreadAttachedToJVM():
+            thread_cls = jpype.JClass('java.lang.Thread')
+            if hasattr(thread_cls, 'attachAsDaemon'):
+                thread_cls.attachAsDaemon()
+            else:
+                jpype.attachThreadToJVM()
+            self._count('attaches')
+        self._local.attached = True
+
+    def jclass(self, class_name: str, jar: str | None = None):
+        """按类名解析 JClass(结果缓存)；jar 为 load_jar 的返回值，启动 classpath 中的类可不传"""
+        key = (jar, class_name)
+        cls = self._classes.get(key)
+        if cls is None:
+            with self._lock:
+                cls = self._classes.get(key)
+                if cls is None:
+                    self.attach()
+                    jpype = self._jpype
+                    loader = self._jars.get(jar) if jar else None
+                    cls = jpype.JClass(class_name, loader=loader) if loader is not None \
+                        else jpype.JClass(class_name)
+                    self._classes[key] = cls
+                    self._count('class_loads')
+        return cls
+
+    def method(self, class_name: str, method_name: str, jar: str | None = None):
+        """静态方法句柄(结果缓存)；重载由 jpype 在调用时按参数分派"""
+        key = (jar, class_name, method_name)
+        fn = self._methods.get(key)
+        if fn is None:
+            fn = getattr(self.jclass(class_name, jar), method_name)
+            if self._methods.setdefault(key, fn) is fn:
+                self._count('method_resolves')
+        return fn
+
+    def call(self, class_name: str, method_name: str, *args, jar: str | None = None):
+        self.attach()
+        self._count('calls')
+        return self.method(class_name, method_name, jar)(*args)
+
+    # ==================== 字节数组 ======================
+    def to_java_bytes(self, data):
+        """bytes/bytearray/memoryview → Java byte[]，经缓冲区协议整块复制(不逐元素转换)"""
+        jpype = self._require()
+        return jpype.JArray(jpype.JByte)(data)
+
+    @staticmethod
+    def from_java_bytes(array) -> bytes:
+        """Java byte[] → bytes，经缓冲区协议整块复制"""
+        return bytes(memoryview(array))
+
+    def direct_buffer(self, data):
+        """
+        可写缓冲区(bytearray/memoryview) → java.nio.ByteBuffer，Java 侧直接读写同一块内存，不复制
+        @param data: 调用期间须保持存活，且不能改变长度
+        """
+        from jpype import nio
+        return nio.convertToDirectBuffer(data)
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {'started': self.started, 'jars': len(self._jars), 'classes': len(self._classes),
+                'methods': len(self._methods), **stats}
+
+
+jvm_host = JvmHost()
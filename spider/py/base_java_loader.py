@@ -7,65 +7,64 @@
 
 import os
 import sys
+from functools import partial
 
 sys.path.append('..')
 try:
     # from base.spider import Spider as BaseSpider
     from base.spider import BaseSpider
+    from base.jvm import jvm_host
+except ImportError:
+    from t4.base.spider import BaseSpider
+    from t4.base.jvm import jvm_host
+try:
     from com.github.tvbox.osc.util import PyUtil
     from java import jbyte, jarray
     # https://chaquo.com/chaquopy/doc/current/python.html#java.jbyte
 except ImportError:
-    from t4.base.spider import BaseSpider
-
-# 全局变量
-gParam = {
-    # JVM已经启用过某个jar文件
-    "JVM": {'xx.jar': False},
-}
+    jarray = None  # T4：经 jpype 由 base.jvm.jvm_host 托管 JVM
 
 
 class Spider(BaseSpider):  # 元类 默认的元类 type
     jar_path: str = ''
     jClass = None
 
-    def _prepare_env(self, jpype):
-        global gParam
-        if gParam['JVM'].get(self.jar_path):
-            return
-        try:
-            jpype.startJVM(classpath=[self.jar_path], convertStrings=False)
-            gParam['JVM'][self.jar_path] = True
-        except Exception as e:
-            self.log(f'jpype.startJVM发生了错误:{e}')
-
     def init_jar(self, jar_path="./bdys.jar"):
         self.log(f'base_java_loader 初始化jar文件:{jar_path}')
         if not os.path.exists(jar_path):
             raise FileNotFoundError
         self.jar_path = jar_path
         if self.ENV.lower() == 't4':
-            import jpype
-            self._prepare_env(jpype)
-            self.jClass = jpype.JClass
+            # JVM 进程内只启动一次，模块被重新导入也不会重复 startJVM
+            try:
+                self.jar_path = jvm_host.load_jar(jar_path)
+            except Exception as e:
+                # 不吞掉：否则 jClass 仍被设置，之后的调用才在未启动的 JVM 上失败
+                self.log(f'jpype.startJVM发生了错误:{e}')
+                raise
+            self.jClass = partial(jvm_host.jclass, jar=self.jar_path)
         elif self.ENV.lower() == 't3':
             PyUtil.load(jar_path)
             self.jClass = None
 
     def call_java(self, class_name, method_name, *args):
         if self.ENV.lower() == 't4':
-            class1 = self.jClass(class_name)
-            method = getattr(class1, method_name)
-            # method = eval(f'class1.{method_name}', {'class1': class1})
-            # print(method)
-            return method(*args)
+            # 类与方法句柄由 jvm_host 缓存，调用线程自动附着到 JVM
+            return jvm_host.call(class_name, method_name, *args, jar=self.jar_path)
         elif self.ENV.lower() == 't3':
             return PyUtil.call(class_name, method_name, *args)
 
     @staticmethod
     def jarBytes(some_bytes: bytes):
+        if jarray is None:
+            return jvm_host.to_java_bytes(some_bytes)
         return jarray(jbyte)(some_bytes)
 
+    @staticmethod
+    def pyBytes(java_bytes) -> bytes:
+        """Java byte[] 转 bytes"""
+        return jvm_host.from_java_bytes(java_bytes) if jarray is None else bytes(java_bytes)
+
     def init(self, extend=""):
         pass
 
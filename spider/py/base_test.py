@@ -1,4 +1,6 @@
 import json
+import subprocess
+import threading
 import time
 import unittest
 import os
@@ -7,8 +9,10 @@ import sys
 # 添加必要的路径以便导入模块
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from core.t4_daemon import _manager
-from base.spider import BaseSpider
+from core.t4_daemon import _manager, _watcher, CallScheduler, SearchBudget, normalize_vod_name
+from base.spider import BaseSpider, ExpiringLRU
+from base import crypto, fixtures
+import requests
 from cachetools import cached, TTLCache
 
 # 每次测试完自动清理可能存在的类共享变量问题(0关闭 1启用)
@@ -317,5 +321,868 @@ class TestDemoFunctions(unittest.TestCase):
                     del sys.modules[module_name]
 
 
+class TestCallScheduler(unittest.TestCase):
+
+    def test_instance_limit_and_deadline(self):
+        scheduler = CallScheduler(max_workers=4)
+        t1 = scheduler.acquire('k1', 'a.py', 1)
+        # 单实例并发为1时，第二个调用只能排队直到 deadline
+        with self.assertRaises(TimeoutError):
+            scheduler.acquire('k1', 'a.py', 1, deadline=time.time() + 0.05)
+        # 其它实例不受影响
+        t2 = scheduler.acquire('k2', 'b.py', 1, deadline=time.time() + 0.05)
+        snap = scheduler.snapshot()
+        self.assertEqual(snap['running'], 2)
+        self.assertEqual(snap['instances']['k1']['rejected'], 1)
+        scheduler.release(t1)
+        scheduler.release(t2)
+        self.assertEqual(scheduler.snapshot()['running'], 0)
+
+    def test_fair_across_scripts(self):
+        scheduler = CallScheduler(max_workers=1)
+        first = scheduler.acquire('slow', 'slow.py', 4)
+        order = []
+
+        def worker(key, script):
+            ticket = scheduler.acquire(key, script, 4, deadline=time.time() + 5)
+            order.append(script)
+            scheduler.release(ticket)
+
+        threads = [threading.Thread(target=worker, args=('slow', 'slow.py')) for _ in range(3)]
+        threads.append(threading.Thread(target=worker, args=('fast', 'fast.py')))
+        for t in threads:
+            t.start()
+            time.sleep(0.01)
+        scheduler.release(first)
+        for t in threads:
+            t.join()
+        # fast.py 不必等 slow.py 的全部排队调用执行完
+        self.assertLess(order.index('fast.py'), 3)
+
+
+# 守护进程调用测试用的 spider 脚本：searchContent 等待 key 秒(客户端断开时提前返回)，单实例并发为 1
+TEST_SPIDER = '''
+import time
+from base.spider import BaseSpider
+
+VERSION = {version}
+
+
+class Spider(BaseSpider):
+    closed = False
+
+    def init(self, extend=''):
+        return {{'version': VERSION}}
+
+    def getConcurrency(self):
+        return 1
+
+    def homeContent(self, filter):
+        return {{'version': VERSION, 'extend': self.extend}}
+
+    def homeVideoContent(self):
+        pass
+
+    def categoryContent(self, tid, pg, filter, extend):
+        pass
+
+    def detailContent(self, ids):
+        pass
+
+    def searchContent(self, key, quick, pg=1):
+        end = time.time() + float(key)
+        while time.time() < end and not self.callCancelled():
+            time.sleep(0.01)
+        return {{'version': VERSION, 'closed': self.closed, 'cancelled': self.callCancelled(),
+                 'remaining': self.callRemaining()}}
+
+    def playerContent(self, flag, id, vipFlags=None):
+        pass
+
+    def localProxy(self, params):
+        pass
+
+    def isVideoFormat(self, url):
+        pass
+
+    def manualVideoCheck(self):
+        pass
+
+    def close(self):
+        self.closed = True
+'''
+
+
+def write_test_spider(root, name='t4_test_spider', version=1, extra=''):
+    """extra 追加在类定义之后，用于改写个别方法"""
+    path = os.path.join(root, f'{name}.py')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(TEST_SPIDER.format(version=version) + extra)
+    return path
+
+
+class TestCallDeadline(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = write_test_spider(self.tmp.name)
+        self.env = json.dumps({'ext': 'deadline'})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_deadline_reaches_spider_and_bounds_queue(self):
+        result = json.loads(_manager.call(self.path, 'search', self.env, ['0', 0, 1], time.time() + 5))
+        self.assertTrue(0 < result['remaining'] <= 5)
+        # 单实例并发为 1：前一个调用占着执行槽，排队超过 deadline 的调用被丢弃
+        slow = threading.Thread(target=_manager.call, args=(self.path, 'search', self.env, ['0.5', 0, 1]))
+        slow.start()
+        time.sleep(0.1)
+        dropped = _manager.call(self.path, 'search', self.env, ['0', 0, 1], time.time() + 0.1)
+        slow.join()
+        self.assertFalse(dropped['success'])
+        self.assertIn('queued', dropped['error'])
+
+    def test_cancel_event_stops_running_call(self):
+        cancel = threading.Event()
+        threading.Timer(0.1, cancel.set).start()
+        started = time.time()
+        result = json.loads(_manager.call(self.path, 'search', self.env, ['5', 0, 1], time.time() + 10, cancel))
+        self.assertTrue(result['cancelled'])
+        self.assertLess(time.time() - started, 2)
+
+    def test_watcher_flags_closed_client(self):
+        import socket
+        server, client = socket.socketpair()
+        try:
+            event = _watcher.watch(server)
+            self.assertFalse(event.wait(0.3))
+            client.close()
+            self.assertTrue(event.wait(2))
+        finally:
+            _watcher.unwatch(server)
+            server.close()
+
+
+class TestHotReload(unittest.TestCase):
+
+    def test_reload_waits_for_call_started_on_cache_miss(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            path = write_test_spider(root, 't4_reload_spider')
+            env = json.dumps({'ext': 'reload'})
+            key = _manager._instance_key(path, env)
+            results = []
+            # 首次调用走未命中缓存路径：后台 init 后直接执行 searchContent
+            call = threading.Thread(target=lambda: results.append(
+                json.loads(_manager.call(path, 'search', env, ['0.6', 0, 1]))))
+            call.start()
+            deadline = time.time() + 5
+            while key not in _manager._instances and time.time() < deadline:
+                time.sleep(0.02)
+            old = _manager._instances[key]
+            time.sleep(0.1)
+            self.assertEqual(old.active, 1)
+            write_test_spider(root, 't4_reload_spider', version=2)
+            os.utime(path, (time.time() + 10, time.time() + 10))
+            _manager.check_reload()
+            self.assertIsNot(_manager._instances[key], old)
+            call.join()
+            # 换下的旧实例等在途调用结束后才关闭
+            self.assertEqual(results[0]['version'], 1)
+            self.assertFalse(results[0]['closed'])
+            while not old.spider.closed and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertTrue(old.spider.closed)
+            self.assertEqual(json.loads(_manager.call(path, 'home', env, [1]))['version'], 2)
+
+    def test_dependency_change_rebuilds_holders(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            dep = write_test_spider(root, 't4_reload_dep')
+            top = write_test_spider(root, 't4_reload_top', extra=(
+                "Spider.getDependence = lambda self: ['t4_reload_dep']\n\n\n"
+                "def _init(self, extend=''):\n    self.deps = extend\n\n\n"
+                "def _home(self, filter):\n"
+                "    return {'version': VERSION, 'dep': self.deps[0].homeContent(filter)['version']}\n\n\n"
+                "Spider.init = _init\nSpider.homeContent = _home\n"))
+            env = json.dumps({'ext': 'reloaddep'})
+            self.assertEqual(json.loads(_manager.call(top, 'home', env, [1]))['dep'], 1)
+            dep_key = _manager._dependency_key('t4_reload_dep', 'reloaddep')
+            old_dep = _manager._instances[dep_key]
+            self.assertEqual(old_dep.refs, 1)
+            write_test_spider(root, 't4_reload_dep', version=2)
+            os.utime(dep, (time.time() + 10, time.time() + 10))
+            self.assertEqual(_manager.check_reload(), 1)
+            self.assertEqual(json.loads(_manager.call(top, 'home', env, [1]))['dep'], 2)
+            new_dep = _manager._instances[dep_key]
+            self.assertIsNot(new_dep, old_dep)
+            self.assertEqual(new_dep.refs, 1)
+            # 旧实例退役后归还旧依赖，旧依赖随之关闭
+            deadline = time.time() + 5
+            while not old_dep.spider.closed and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertTrue(old_dep.spider.closed)
+            self.assertEqual(old_dep.refs, 0)
+            self.assertEqual(new_dep.refs, 1)
+
+
+ISOLATED_SPIDER_EXTRA = """
+
+def _search(self, key, quick, pg='1'):
+    import os
+    if key == 'crash':
+        os._exit(3)
+    if key == 'hang':
+        time.sleep(30)  # 不理会取消
+    if key == 'wait':
+        end = time.time() + 5
+        while time.time() < end and not self.callCancelled():
+            time.sleep(0.01)
+        return {'pid': os.getpid(), 'cancelled': self.callCancelled()}
+    if key == 'burn':
+        started = time.process_time()
+        while time.process_time() - started < 1.7:
+            pass
+    return {'pid': os.getpid()}
+
+
+Spider.searchContent = _search
+"""
+
+
+class TestIsolatedWorkers(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from core import t4_daemon
+        self.t4_daemon = t4_daemon
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = write_test_spider(self.tmp.name, 't4_isolated_spider', extra=ISOLATED_SPIDER_EXTRA)
+        self.workers = t4_daemon.IsolatedWorkers(['t4_isolated_*'], t4_daemon.logger, t4_daemon.DaemonMetrics())
+
+    def tearDown(self):
+        self.workers.stop()
+        self.tmp.cleanup()
+
+    def search(self, key, timeout=20):
+        result = self.workers.call(self.path, 'search', '', [key, 0, 1], time.time() + timeout)
+        return json.loads(result) if isinstance(result, str) else result
+
+    def test_crash_fails_inflight_call_and_restarts(self):
+        pid = self.search('ok')['pid']
+        crashed = self.search('crash')
+        self.assertFalse(crashed['success'])
+        self.assertIn('isolated worker terminated', crashed['error'])
+        self.assertNotEqual(self.search('ok')['pid'], pid)
+        self.assertEqual(self.workers.snapshot()[self.path]['restarts'], 1)
+
+    def test_hung_call_is_killed(self):
+        from unittest import mock
+        pid = self.search('ok')['pid']
+        started = time.time()
+        with mock.patch.object(self.t4_daemon, 'WORKER_HANG_GRACE', 0.2):
+            hung = self.search('hang', timeout=0.3)
+        self.assertLess(time.time() - started, 5)
+        self.assertIn('call overrun', hung['error'])
+        self.assertNotEqual(self.search('ok')['pid'], pid)
+
+    def test_rss_limit_recycles_worker(self):
+        from unittest import mock
+        with mock.patch.object(self.t4_daemon, 'ISOLATED_RSS_LIMIT', 1):
+            pid = self.search('ok')['pid']
+        self.assertNotEqual(self.search('ok')['pid'], pid)
+
+    def test_call_retries_when_worker_drained_after_lookup(self):
+        pid = self.search('ok')['pid']
+        lookup = self.workers._worker
+
+        def drained_after_lookup(script_path):
+            # 模拟：本线程取到 worker 后、提交前，另一线程因超限把它回收
+            worker = lookup(script_path)
+            if worker.proc.pid == pid:
+                worker.drain()
+            return worker
+
+        self.workers._worker = drained_after_lookup
+        result = self.search('ok')
+        self.assertIn('pid', result, result)
+        self.assertNotEqual(result['pid'], pid)
+
+    def test_cancel_reaches_draining_worker(self):
+        cancel = threading.Event()
+        results = []
+        call = threading.Thread(target=lambda: results.append(
+            self.workers.call(self.path, 'search', '', ['wait', 0, 1], time.time() + 20, cancel)))
+        call.start()
+        time.sleep(0.5)
+        self.workers._worker(self.path).drain()
+        started = time.time()
+        cancel.set()
+        call.join()
+        self.assertLess(time.time() - started, 3)
+        self.assertTrue(json.loads(results[0])['cancelled'])
+
+    def test_recycle_is_invisible_to_concurrent_calls(self):
+        from unittest import mock
+        results = []
+
+        def worker():
+            for _ in range(5):
+                results.append(self.search('ok'))
+
+        # 每次调用后都回收：回收与其它线程的提交交错，调用方不应看到错误
+        with mock.patch.object(self.t4_daemon, 'ISOLATED_RSS_LIMIT', 1):
+            threads = [threading.Thread(target=worker) for _ in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(results), 30)
+        self.assertTrue(all('pid' in r for r in results), [r for r in results if 'pid' not in r][:3])
+
+    def test_cpu_time_recycles_before_rlimit(self):
+        from unittest import mock
+        # 上限 2 秒、回收比例 0.8：一次约 1.7 秒 CPU 的调用后应在到达上限前回收
+        with mock.patch.object(self.t4_daemon, 'ISOLATED_CPU_LIMIT', 2):
+            pid = self.search('ok')['pid']
+            self.assertEqual(self.search('ok')['pid'], pid)
+            self.search('burn')
+            self.assertNotEqual(self.search('ok')['pid'], pid)
+
+
+class TestBridgeServe(unittest.TestCase):
+    """_bridge.py --serve：4 字节大端长度 + JSON 帧，按 id 对应请求与响应"""
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        extra = ("\n\ndef _proxy(self, params):\n"
+                 "    return [200, 'text/plain', iter([b'ab', b'c'])]\n\n\n"
+                 "Spider.localProxy = _proxy\n")
+        self.slow = write_test_spider(self.tmp.name, 't4_bridge_slow', extra=extra)
+        self.fast = write_test_spider(self.tmp.name, 't4_bridge_fast')
+        bridge = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_bridge.py')
+        self.proc = subprocess.Popen([sys.executable, bridge, '--serve'], cwd=os.path.dirname(bridge),
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def tearDown(self):
+        self.proc.stdin.close()
+        self.proc.wait(10)
+        self.proc.stdout.close()
+        self.tmp.cleanup()
+
+    def send(self, req_id, script_path, method_name, args, ext=''):
+        payload = json.dumps({'id': req_id, 'script_path': script_path, 'method_name': method_name,
+                              'env': {'ext': ext}, 'args': args}).encode('utf-8')
+        self.proc.stdin.write(len(payload).to_bytes(4, 'big') + payload)
+        self.proc.stdin.flush()
+
+    def recv(self):
+        size = int.from_bytes(self.proc.stdout.read(4), 'big')
+        return json.loads(self.proc.stdout.read(size).decode('utf-8'))
+
+    def test_spiders_run_concurrently(self):
+        self.send(1, self.slow, 'search', ['0.5', 0, 1])
+        self.send(2, self.fast, 'home', [1])
+        first, second = self.recv(), self.recv()
+        # 慢源不阻塞其它源：后发的请求先返回
+        self.assertEqual([first['id'], second['id']], [2, 1])
+        self.assertEqual(json.loads(first['result'])['version'], 1)
+
+    def test_each_env_gets_own_instance(self):
+        self.send(1, self.fast, 'home', [1], ext='a')
+        first = json.loads(self.recv()['result'])
+        self.send(2, self.fast, 'home', [1], ext='b')
+        second = json.loads(self.recv()['result'])
+        self.assertEqual((first['extend'], second['extend']), ('a', 'b'))
+
+    def test_stream_proxy_is_joined_and_bytes_marked(self):
+        self.send(1, self.slow, 'proxy', [{}])
+        resp = self.recv()
+        self.assertEqual(resp['result'][:2], [200, 'text/plain'])
+        self.assertEqual(resp['result'][2], {'$b64': 'YWJj'})
+
+    def test_error_frame(self):
+        self.send(7, self.fast, 'noSuchMethod', [])
+        resp = self.recv()
+        self.assertEqual(resp['id'], 7)
+        self.assertIn('noSuchMethod', resp['error'])
+
+    def write_frame(self, frame):
+        payload = json.dumps(frame).encode('utf-8')
+        self.proc.stdin.write(len(payload).to_bytes(4, 'big') + payload)
+        self.proc.stdin.flush()
+
+    def test_slow_import_does_not_block_other_scripts(self):
+        heavy = write_test_spider(self.tmp.name, 't4_bridge_heavy', extra='\ntime.sleep(1)\n')
+        self.send(1, heavy, 'home', [1])
+        time.sleep(0.2)
+        sent = time.time()
+        self.send(2, self.fast, 'home', [1])
+        self.assertEqual(self.recv()['id'], 2)
+        # 导入在按脚本的创建锁内进行，不占全局锁
+        self.assertLess(time.time() - sent, 0.6)
+        self.assertEqual(self.recv()['id'], 1)
+
+    def test_cancel_frame_aborts_running_call(self):
+        started = time.time()
+        self.send(1, self.slow, 'search', ['10', 0, 1])
+        time.sleep(0.5)
+        self.write_frame({'id': 1, 'cancel': True})
+        resp = self.recv()
+        self.assertLess(time.time() - started, 5)
+        self.assertTrue(json.loads(resp['result'])['cancelled'])
+        # 取消未知 id 无响应，进程照常服务
+        self.write_frame({'id': 99, 'cancel': True})
+        self.write_frame({'id': 3, 'ping': True})
+        self.assertEqual(self.recv(), {'id': 3, 'result': 'pong'})
+
+    def test_ping_answered_while_pool_busy(self):
+        self.send(1, self.slow, 'search', ['1', 0, 1])
+        time.sleep(0.2)
+        self.write_frame({'id': 2, 'ping': True})
+        self.assertEqual(self.recv()['id'], 2)
+        self.assertEqual(self.recv()['id'], 1)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.slow = write_test_spider(self.tmp.name, 't4_batch_slow')
+        self.fast = write_test_spider(self.tmp.name, 't4_batch_fast')
+        self.env = json.dumps({'ext': 'batch'})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def read_packets(data):
+        import pickle
+        packets = []
+        while data:
+            size = int.from_bytes(data[:4], 'big')
+            packets.append(pickle.loads(data[4:4 + size]))
+            data = data[4 + size:]
+        return packets
+
+    def run_batch(self, entries, timeout):
+        import io
+        from core.t4_daemon import run_batch
+        wfile = io.BytesIO()
+        summary = run_batch(wfile, entries, time.time() + timeout, threading.Event())
+        return summary, self.read_packets(wfile.getvalue())
+
+    def test_results_stream_in_completion_order(self):
+        summary, packets = self.run_batch([
+            {'script_path': self.slow, 'method_name': 'search', 'env': self.env, 'args': ['0.3', 0, 1]},
+            {'script_path': self.fast, 'method_name': 'home', 'env': self.env, 'args': [1]},
+        ], 5)
+        # 先完成的条目先回传，index 对应请求中的位置
+        self.assertEqual([p.get('index') for p in packets[:2]], [1, 0])
+        self.assertTrue(all(p['success'] for p in packets[:2]))
+        self.assertEqual(json.loads(packets[0]['result'])['version'], 1)
+        self.assertEqual(packets[-1], summary)
+        self.assertEqual(summary, {'batch_done': True, 'count': 2, 'completed': 2, 'timed_out': []})
+
+    def test_deadline_reports_unfinished_entries(self):
+        started = time.time()
+        summary, packets = self.run_batch([
+            {'script_path': self.fast, 'method_name': 'home', 'env': self.env, 'args': [1]},
+            {'script_path': self.slow, 'method_name': 'search', 'env': self.env, 'args': ['5', 0, 1]},
+        ], 0.5)
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual([p.get('index') for p in packets[:2]], [0, 1])
+        self.assertFalse(packets[1]['success'])
+        self.assertEqual(packets[1]['error'], 'batch deadline exceeded')
+        self.assertTrue(packets[-1]['batch_done'])
+        self.assertEqual(summary['timed_out'], [1])
+
+
+class TestShmHandoff(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from core import t4_daemon
+        self.t4_daemon = t4_daemon
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [mock.patch.object(t4_daemon, 'SHM_DIR', self.tmp.name),
+                        mock.patch.object(t4_daemon, 'SHM_THRESHOLD', 1024)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp.cleanup()
+
+    def send(self, obj, shm=True):
+        import io
+        wfile = io.BytesIO()
+        sent, shm_bytes = self.t4_daemon.send_response(wfile, obj, shm=shm)
+        packets = TestBatch.read_packets(wfile.getvalue())
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(sent, len(wfile.getvalue()))
+        return packets[0], shm_bytes
+
+    def test_large_response_goes_through_shm_file(self):
+        import pickle
+        obj = {'success': True, 'result': 'x' * 4096}
+        handle, shm_bytes = self.send(obj)
+        # socket 上只有文件路径；客户端读取后删除
+        self.assertNotIn('success', handle)
+        self.assertTrue(os.path.basename(handle['shm']).startswith(self.t4_daemon.SHM_PREFIX))
+        self.assertEqual(os.path.getsize(handle['shm']), handle['size'])
+        self.assertEqual(shm_bytes, handle['size'])
+        with open(handle['shm'], 'rb') as f:
+            self.assertEqual(pickle.load(f), obj)
+        os.unlink(handle['shm'])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_small_or_unsupported_response_stays_inline(self):
+        obj = {'success': True, 'result': 'x' * 4096}
+        self.assertEqual(self.send({'success': True, 'result': 'small'}), ({'success': True, 'result': 'small'}, 0))
+        self.assertEqual(self.send(obj, shm=False), (obj, 0))
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_sweep_removes_only_old_orphans(self):
+        handle, _ = self.send({'success': True, 'result': b'y' * 4096})
+        old = time.time() - self.t4_daemon.SHM_ORPHAN_AGE - 10
+        os.utime(handle['shm'], (old, old))
+        fresh, _ = self.send({'success': True, 'result': b'z' * 4096})
+        other = os.path.join(self.tmp.name, 'unrelated')
+        open(other, 'wb').close()
+        os.utime(other, (old, old))
+        self.assertEqual(self.t4_daemon.sweep_shm(), 1)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), sorted([os.path.basename(fresh['shm']), 'unrelated']))
+
+
+class TestBenchStats(unittest.TestCase):
+
+    def test_percentile_nearest_rank(self):
+        from core.t4_bench import percentile
+        self.assertEqual(percentile([1, 2, 3, 4], 0.75), 3)
+        self.assertEqual(percentile([1, 2], 0.5), 1)
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.51), 51)
+        self.assertEqual(percentile(values, 0.07), 7)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 1), 100)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_overlapping_cprofile_calls_are_skipped(self):
+        import tempfile
+        from unittest import mock
+        from core import t4_daemon
+        with tempfile.TemporaryDirectory() as root, mock.patch.object(t4_daemon, '_CPROFILE_EXCLUSIVE', True):
+            profiler = t4_daemon.CallProfiler(root)
+            profiler.start('cprofile')
+            first = profiler.profile('a.py', 'search', 'searchContent')
+            second = profiler.profile('a.py', 'search', 'searchContent')
+            with first:
+                with second:  # 3.12+ 上第二个 Profile.enable() 会抛 ValueError，这里应跳过而不是让调用失败
+                    sum(range(100))
+            result = profiler.stop()
+            self.assertEqual((result['calls'], result['skipped']), (1, 1))
+            self.assertTrue(os.path.exists(result['file']))
+
+
+class TestDependencies(unittest.TestCase):
+
+    def test_failed_dependency_releases_nested(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            write_test_spider(root, 't4_dep_leaf')
+            write_test_spider(root, 't4_dep_mid', extra=(
+                "Spider.getDependence = lambda self: ['t4_dep_leaf']\n\n\n"
+                "def _init(self, extend=''):\n    raise RuntimeError('mid init failed')\n\n\n"
+                "Spider.init = _init\n"))
+            top = write_test_spider(root, 't4_dep_top', extra="Spider.getDependence = lambda self: ['t4_dep_mid']\n")
+            result = json.loads(_manager.call(top, 'home', json.dumps({'ext': 'deps'}), [1]))
+            self.assertEqual(result['version'], 1)
+            # t4_dep_mid init 失败后，它已持有的 t4_dep_leaf 必须归还，引用归零才能参与淘汰
+            leaf = _manager._instances.get(_manager._dependency_key('t4_dep_leaf', 'deps'))
+            self.assertIsNotNone(leaf)
+            self.assertEqual(leaf.refs, 0)
+
+
+class TestMultiSearch(unittest.TestCase):
+
+    def test_normalize_and_budget(self):
+        self.assertEqual(normalize_vod_name('凡人修仙传 （２０２０）'), normalize_vod_name('凡人修仙传(2020)'))
+        budget = SearchBudget()
+        for _ in range(3):
+            budget.observe('slow.py', 5.0, ok=False)
+            budget.observe('fast.py', 0.2)
+        self.assertFalse(budget.should_skip('fast.py', 1.0))
+        # 通常慢于剩余预算的源被跳过，但周期性放行一次重新探测
+        skips = [budget.should_skip('slow.py', 1.0) for _ in range(5)]
+        self.assertEqual(skips.count(False), 1)
+
+
+class TestExpiringLRU(unittest.TestCase):
+
+    def test_capacity_and_expiry(self):
+        from concurrent.futures import Future
+        cache = ExpiringLRU(maxsize=2, ttl=60)
+        pending = Future()
+        cache['a'] = {'reply': pending}
+        cache['b'] = {}
+        cache.get('a')  # a 变为最近使用
+        cache['c'] = {}
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        # 按条目设置的过期时间到达后移除，并释放未执行的 Future
+        cache.expire_at('a', time.time() - 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(pending.cancelled())
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['evictions'], stats['expirations']), (1, 1, 1))
+
+
+class TestCrypto(unittest.TestCase):
+
+    def test_aes_batch_matches_single(self):
+        key, iv = '1234567890abcdef', 'abcdef1234567890'
+        texts = ['测试%d' % i * i for i in range(1, 10)]
+        payloads = [crypto.aes_encrypt(t, key, iv) for t in texts]
+        self.assertEqual([p.decode() for p in crypto.aes_cbc_decrypt_batch(payloads, key, iv)], texts)
+        self.assertEqual(crypto.aes_decrypt(payloads[3], key, iv).decode(), texts[3])
+
+    def test_aes_batch_accepts_memoryview(self):
+        key, iv = b'1234567890abcdef', b'abcdef1234567890'
+        payload = crypto.aes_encrypt('memoryview', key, iv)
+        buf = memoryview(payload + payload)
+        plain = crypto.aes_cbc_decrypt_batch([buf[:len(payload)], buf[len(payload):]], key, memoryview(iv))
+        self.assertEqual(plain, [b'memoryview', b'memoryview'])
+        self.assertEqual(crypto.aes_cbc_decrypt_batch([payload], key, [memoryview(iv)]), [b'memoryview'])
+
+    def test_rsa_roundtrip_with_bare_keys(self):
+        from Crypto.PublicKey import RSA
+        key = RSA.generate(1024)
+        private = ''.join(key.export_key().decode().splitlines()[1:-1])
+        public = ''.join(key.publickey().export_key().decode().splitlines()[1:-1])
+        text = 'hello' * 60  # 超过单段上限，需要分段
+        self.assertEqual(BaseSpider.rsa_private_decode(BaseSpider.rsa_public_encode(text, public), private), text)
+
+
+class TestQimaoPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        import base64
+        import importlib.util
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '七猫小说[书].py')
+        spec = importlib.util.spec_from_file_location('t4_qimao_test', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.spider = module.Spider()
+        self.spider.init()
+        key = module.Spider.content_key
+        self.texts = {'c2': '第二章 正文', 'c3': '第三章 正文', 'c4': None}
+        self.payloads = {}
+        for cid, text in self.texts.items():
+            iv = bytes(range(16))
+            # c4 为非 utf-8 的明文：strict=False 解密后 decode 失败
+            body = crypto.aes_encrypt(text.encode('utf-8') if text else b'\xff\xfe\xfd', key, iv)
+            self.payloads[cid] = base64.b64encode(iv + body).decode()
+        self.spider.get_chapter_ids = lambda book_id: ['c1', 'c2', 'c3', 'c4']
+        self.spider.fetch_chapter = lambda book_id, cid: self.payloads[cid]
+
+    def test_decode_content_memoryview_path(self):
+        self.assertEqual(self.spider.decode_content(self.payloads['c2']), '第二章 正文')
+
+    def test_prefetch_resolves_every_chapter(self):
+        self.spider.prefetch('b1', 'c1')
+        futures = {cid: self.spider.chapter_cache.get(('b1', cid)) for cid in self.texts}
+        self.assertTrue(all(f is not None and f.done() for f in futures.values()))
+        self.assertEqual(futures['c2'].result(), '第二章 正文')
+        self.assertEqual(futures['c3'].result(), '第三章 正文')
+        self.assertIsInstance(futures['c4'].exception(), UnicodeDecodeError)
+        # 再次预取不会替换已有占位
+        self.spider.prefetch('b1', 'c1')
+        self.assertIs(self.spider.chapter_cache.get(('b1', 'c2')), futures['c2'])
+
+    def test_concurrent_prefetch_shares_futures(self):
+        from concurrent.futures import Future
+        placed = []
+        original = self.spider.chapter_cache.setdefault
+
+        def setdefault(key, default=None):
+            value = original(key, default)
+            placed.append(value is default)
+            return value
+
+        self.spider.chapter_cache.setdefault = setdefault
+        threads = [threading.Thread(target=self.spider.prefetch, args=('b1', 'c1')) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 3 章各只占位一次
+        self.assertEqual(placed.count(True), 3)
+        self.assertIsInstance(self.spider.chapter_cache.get(('b1', 'c3')), Future)
+
+
+class TestJvmHost(unittest.TestCase):
+    """以桩 jpype 验证 base.jvm 的进程级复用，无需真实 JVM"""
+
+    def setUp(self):
+        import tempfile
+        import types
+        from unittest import mock
+        from base import jvm
+        self.tmp = tempfile.TemporaryDirectory()
+        self.jar = os.path.join(self.tmp.name, 'demo.jar')
+        open(self.jar, 'wb').close()
+        self.calls = {'startJVM': 0, 'JClass': 0, 'attachAsDaemon': 0}
+        calls, state, local = self.calls, {'started': False}, threading.local()
+
+        class JavaThread:
+            @staticmethod
+            def attachAsDaemon():
+                calls['attachAsDaemon'] += 1
+                local.attached = True
+
+        class Api:
+            @staticmethod
+            def echo(value):
+                return value
+
+        def JClass(name, loader=None):
+            calls['JClass'] += 1
+            return JavaThread if name == 'java.lang.Thread' else Api
+
+        def startJVM(**kwargs):
+            calls['startJVM'] += 1
+            state['started'] = True
+
+        stub = types.ModuleType('jpype')
+        stub.JClass = JClass
+        stub.startJVM = startJVM
+        stub.isJVMStarted = lambda: state['started']
+        stub.isThreadAttachedToJVM = lambda: getattr(local, 'attached', False)
+        self.host = jvm.JvmHost()
+        self.patches = [mock.patch.dict(sys.modules, {'jpype': stub}), mock.patch.object(jvm, 'jvm_host', self.host)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        self.tmp.cleanup()
+
+    def load_loader(self, name):
+        import importlib.util
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'base_java_loader.py')
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def test_start_once_across_reimport(self):
+        for name in ('t4_java_loader_a', 't4_java_loader_b'):
+            spider = self.load_loader(name).Spider()
+            spider.init_jar(self.jar)
+            self.assertEqual(spider.call_java('com.example.Api', 'echo', 'x'), 'x')
+        self.assertEqual(self.calls['startJVM'], 1)
+        self.assertEqual(self.host.snapshot()['jars'], 1)
+
+    def test_handles_cached(self):
+        jar = self.host.load_jar(self.jar)
+        for _ in range(3):
+            self.host.call('com.example.Api', 'echo', 1, jar=jar)
+        stats = self.host.snapshot()
+        self.assertEqual((stats['class_loads'], stats['method_resolves'], stats['calls']), (1, 1, 3))
+        # Thread 类一次 + Api 类一次
+        self.assertEqual(self.calls['JClass'], 2)
+
+    def test_attach_once_per_thread(self):
+        jar = self.host.load_jar(self.jar)
+
+        def work():
+            for _ in range(5):
+                self.host.call('com.example.Api', 'echo', 1, jar=jar)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.calls['attachAsDaemon'], 4)
+        self.assertEqual(self.host.snapshot()['attaches'], 4)
+        self.assertEqual(self.host.snapshot()['calls'], 20)
+
+    def test_not_started(self):
+        with self.assertRaisesRegex(RuntimeError, 'JVM not started'):
+            self.host.call('com.example.Api', 'echo', 1)
+        from unittest import mock
+        spider = self.load_loader('t4_java_loader_c').Spider()
+        # 未安装 jpype：init_jar 直接抛出，不留下指向未启动 JVM 的 jClass
+        with mock.patch.dict(sys.modules, {'jpype': None}):
+            with self.assertRaises(ImportError):
+                spider.init_jar(self.jar)
+        self.assertIsNone(spider.jClass)
+
+
+class TestHttpFixtures(unittest.TestCase):
+
+    def test_record_then_replay_offline(self):
+        import tempfile
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps({'path': self.path}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/list?pg=1'
+        spider = type('FixtureSpider', (BaseSpider,), dict.fromkeys(BaseSpider.__abstractmethods__, None))()
+        with tempfile.TemporaryDirectory() as root:
+            try:
+                fixtures.install('record', root, ignore_params=['t'])
+                spider.fetch(url + '&t=1')
+                # t 被忽略，两次请求同一 key：索引以后一次为准；响应体内容不同，对象各存一份
+                spider.fetch(url + '&t=2')
+                server.shutdown()
+                server.server_close()
+                fixtures.install('replay', root, latency=0.01, ignore_params=['t'])
+                rsp = spider.fetch(url + '&t=3')
+                self.assertEqual(rsp.json(), {'path': '/list?pg=1&t=2'})
+                self.assertEqual(fixtures.stats()['entries'], 1)
+                self.assertEqual(sum(len(files) for _, _, files in os.walk(os.path.join(root, 'objects'))), 2)
+                with self.assertRaises(requests.ConnectionError):
+                    spider.fetch(url.replace('pg=1', 'pg=2'))
+                self.assertEqual(fixtures.stats()['misses'], 1)
+            finally:
+                fixtures.uninstall()
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_base_spider_defers_heavy_imports(self):
+        # lxml/pycryptodome/pyquery 只在用到时导入(预算见 core/t4_bench.py startup)
+        code = ("import sys, base.spider, base.htmlParser; print([m for m in ('lxml.etree', 'Crypto.Cipher.AES', "
+                "'Crypto.PublicKey.RSA', 'pyquery', 'jsonpath') if m in sys.modules])")
+        out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, timeout=60)
+        self.assertEqual(out.stdout.strip().splitlines()[-1], '[]', out.stderr)
+
+
 if __name__ == '__main__':
     unittest.main()
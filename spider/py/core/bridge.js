@@ -1,35 +1,140 @@
+import fs from "fs";
 import net from "net";
+import {PassThrough} from "stream";
 import {Parser} from 'pickleparser';
 
 const HOST = "127.0.0.1";
-const PORT = 57570;
-const MAX_MSG_SIZE = 10 * 1024 * 1024;
+const PORT = Number(process.env.T4_PORT) || 57570;
+// 单包上限，与 Python 守护进程读取同一环境变量
+const MAX_MSG_SIZE = Number(process.env.T4_MAX_MSG_SIZE) || 60 * 1024 * 1024;
 const TIMEOUT = 30_000; // 30秒超时
+// 守护进程开启 Unix 域套接字监听时优先使用（同机传输，不依赖 TCP 端口）
+const UNIX_SOCKET = process.env.T4_UNIX_SOCKET || "";
 
 /**
  * Node.js -> Python 请求包（保持 JSON 格式，Python 端需要 json.loads）
+ * 长度头写在同一块缓冲区的前 4 字节，避免再拼接一次
  */
 function encodePacket(obj) {
     const jsonStr = JSON.stringify(obj);
-    const payload = Buffer.from(jsonStr, "utf-8");
-    const header = Buffer.alloc(4);
-    header.writeUInt32BE(payload.length, 0);
-    return Buffer.concat([header, payload]);
+    const size = Buffer.byteLength(jsonStr, "utf-8");
+    if (size > MAX_MSG_SIZE) {
+        throw new Error(`payload too large:${size} > ${MAX_MSG_SIZE} (T4_MAX_MSG_SIZE)`);
+    }
+    const packet = Buffer.allocUnsafe(size + 4);
+    packet.writeUInt32BE(size, 0);
+    packet.write(jsonStr, 4, "utf-8");
+    return packet;
 }
 
 /**
  * Python -> Node.js 响应包（pickle 解码）
  */
 function decodePacket(buffer) {
-    const parser = new Parser();
-    return parser.parse(buffer);
+    return new Parser().parse(buffer);
+}
+
+/**
+ * 大包经共享内存文件传递，socket 上只有 {shm: 路径, size}
+ */
+function isShmRef(resp) {
+    return !!(resp && typeof resp === "object" && resp.shm && !("success" in resp));
+}
+
+/**
+ * 异步读取共享内存文件中的完整响应（不阻塞事件循环），读取后删除
+ */
+async function readShm(resp) {
+    try {
+        return new Parser().parse(await fs.promises.readFile(resp.shm));
+    } finally {
+        fs.promises.unlink(resp.shm).catch(() => {});
+    }
+}
+
+// Unix 域套接字是否可用：首次连接时检查一次并缓存，连接失败后下次重新检查（守护进程可能晚于 Node 启动或已重启）
+let unixSocketReady = null;
+
+function connectOptions() {
+    if (unixSocketReady === null) unixSocketReady = !!UNIX_SOCKET && fs.existsSync(UNIX_SOCKET);
+    return unixSocketReady ? {path: UNIX_SOCKET} : {host: HOST, port: PORT};
+}
+
+function connectFailed() {
+    unixSocketReady = null;
+}
+
+/**
+ * 流式响应（如 localProxy 媒体分段）：头包之后的每帧为裸字节，长度为 0 的帧表示结束。
+ * 以 PassThrough 替换 result[2] 并立即返回，数据边收边写，按消费速度暂停/恢复 socket。
+ */
+function openStream(client, result) {
+    const stream = new PassThrough();
+    let ended = false;
+    stream.on("drain", () => client.resume());
+    // 下游提前关闭（播放器跳转/断开）时断开守护进程连接，Python 端随即停止读取上游
+    stream.on("close", () => {
+        if (!ended) client.destroy();
+    });
+    client.on("close", () => {
+        if (!ended) stream.destroy(new Error("Python守护进程流式响应中断"));
+    });
+    return {
+        write(chunk) {
+            if (!stream.write(chunk)) client.pause();
+        },
+        end() {
+            ended = true;
+            stream.end();
+            client.end();
+        },
+        fail(err) {
+            ended = true;
+            stream.destroy(err);
+        },
+        result: [result[0], result[1], stream, ...result.slice(3)],
+    };
+}
+
+/**
+ * 接收缓冲：已收到的分片先挂在数组里，凑够一帧时才合并一次（避免每个分片都 concat 导致大响应二次方拷贝）
+ */
+export class FrameBuffer {
+    constructor() {
+        this.pending = [];
+        this.length = 0;
+    }
+
+    push(chunk) {
+        this.pending.push(chunk);
+        this.length += chunk.length;
+    }
+
+    take(n) {
+        const all = this.pending.length === 1 ? this.pending[0] : Buffer.concat(this.pending, this.length);
+        const rest = all.subarray(n);
+        this.pending = rest.length ? [rest] : [];
+        this.length = rest.length;
+        return all.subarray(0, n);
+    }
+}
+
+function settleResponse(resp, resolve, reject) {
+    if (resp && typeof resp === "object" && resp.error) {
+        reject(new Error(`Python错误: ${resp.error}\n${resp.traceback || ""}`));
+    } else if (resp && typeof resp === "object" && "result" in resp) {
+        resolve(resp.result);
+    } else {
+        resolve(resp);
+    }
 }
 
 export async function netCallPythonMethod(script_path, methodName, env, ...args) {
     return new Promise((resolve, reject) => {
         const client = new net.Socket();
-        let recvBuffer = Buffer.alloc(0);
+        const frames = new FrameBuffer();
         let expectedLength = null;
+        let stream = null;
 
         // 超时处理
         const timer = setTimeout(() => {
@@ -37,26 +142,42 @@ export async function netCallPythonMethod(script_path, methodName, env, ...args)
             reject(new Error("Python守护进程响应超时"));
         }, TIMEOUT);
 
-        client.connect(PORT, HOST, () => {
+        let connected = false;
+        client.connect(connectOptions(), () => {
+            connected = true;
             const req = {
                 script_path,
                 method_name: methodName,
                 env,
                 args,
+                // 截止时间(unix秒)：守护进程据此丢弃过期排队、收紧 spider 内部请求超时
+                deadline: (Date.now() + TIMEOUT) / 1000,
+                // 声明支持流式帧
+                stream: true,
+                // 同机客户端：大响应允许走共享内存文件
+                shm: true,
             };
             const packet = encodePacket(req);
             client.write(packet);
         });
 
         client.on("data", (chunk) => {
-            recvBuffer = Buffer.concat([recvBuffer, chunk]);
+            frames.push(chunk);
 
             while (true) {
                 if (expectedLength === null) {
-                    if (recvBuffer.length >= 4) {
-                        expectedLength = recvBuffer.readUInt32BE(0);
-                        recvBuffer = recvBuffer.slice(4);
+                    if (frames.length >= 4) {
+                        expectedLength = frames.take(4).readUInt32BE(0);
+                        if (stream && expectedLength === 0) {
+                            expectedLength = null;
+                            stream.end();
+                            return;
+                        }
                         if (expectedLength <= 0 || expectedLength > MAX_MSG_SIZE) {
+                            if (stream) {
+                                client.destroy();
+                                return stream.fail(new Error("Invalid packet length"));
+                            }
                             clearTimeout(timer);
                             client.destroy();
                             return reject(new Error("Invalid packet length"));
@@ -66,23 +187,32 @@ export async function netCallPythonMethod(script_path, methodName, env, ...args)
                     }
                 }
 
-                if (expectedLength !== null && recvBuffer.length >= expectedLength) {
-                    const payload = recvBuffer.slice(0, expectedLength);
-                    recvBuffer = recvBuffer.slice(expectedLength);
+                if (expectedLength !== null && frames.length >= expectedLength) {
+                    const payload = frames.take(expectedLength);
                     expectedLength = null;
 
+                    if (stream) {
+                        stream.write(payload);
+                        continue;
+                    }
+
                     try {
                         const resp = decodePacket(payload);
                         clearTimeout(timer);
+
+                        if (resp && resp.stream && Array.isArray(resp.result)) {
+                            stream = openStream(client, resp.result);
+                            resolve(stream.result);
+                            continue;
+                        }
                         client.destroy();
 
-                        if (resp && typeof resp === "object" && resp.error) {
-                            reject(new Error(`Python错误: ${resp.error}\n${resp.traceback || ""}`));
-                        } else if (resp && typeof resp === "object" && "result" in resp) {
-                            resolve(resp.result);
+                        if (isShmRef(resp)) {
+                            readShm(resp).then((full) => settleResponse(full, resolve, reject), reject);
                         } else {
-                            resolve(resp);
+                            settleResponse(resp, resolve, reject);
                         }
+                        return;
                     } catch (e) {
                         clearTimeout(timer);
                         client.destroy();
@@ -96,6 +226,8 @@ export async function netCallPythonMethod(script_path, methodName, env, ...args)
 
         client.on("error", (err) => {
             clearTimeout(timer);
+            if (!connected) connectFailed();
+            if (stream) return stream.fail(err);
             reject(err);
         });
 
@@ -104,3 +236,63 @@ export async function netCallPythonMethod(script_path, methodName, env, ...args)
         });
     });
 }
+
+/**
+ * 聚合搜索：守护进程对多个源并发 searchContent，按片名去重排序后一次返回。
+ * @param {{wd: string, sources: Array<{script_path, env?, name?}>, quick?, pg?, parallel?, max_hits?, soft_deadline?}} spec
+ *        soft_deadline（秒）到期或匹配命中数达到 max_hits 时返回已有结果（partial=true）
+ * @returns {Promise<{list: Array, total: number, partial: boolean, elapsed: number, sources: object}>}
+ */
+export async function netMultiSearch(spec, {timeout = TIMEOUT} = {}) {
+    return new Promise((resolve, reject) => {
+        const client = new net.Socket();
+        const frames = new FrameBuffer();
+        let expectedLength = null;
+
+        const timer = setTimeout(() => {
+            client.destroy();
+            reject(new Error("Python守护进程响应超时"));
+        }, timeout);
+        const finish = (err, value) => {
+            clearTimeout(timer);
+            client.destroy();
+            err ? reject(err) : resolve(value);
+        };
+
+        let connected = false;
+        client.connect(connectOptions(), () => {
+            connected = true;
+            client.write(encodePacket({
+                multi_search: spec,
+                deadline: (Date.now() + timeout) / 1000,
+                shm: true,
+            }));
+        });
+
+        client.on("data", (chunk) => {
+            frames.push(chunk);
+            if (expectedLength === null) {
+                if (frames.length < 4) return;
+                expectedLength = frames.take(4).readUInt32BE(0);
+                if (expectedLength <= 0 || expectedLength > MAX_MSG_SIZE) {
+                    return finish(new Error("Invalid packet length"));
+                }
+            }
+            if (frames.length < expectedLength) return;
+            try {
+                const resp = decodePacket(frames.take(expectedLength));
+                (isShmRef(resp) ? readShm(resp) : Promise.resolve(resp)).then((full) => {
+                    if (full && full.error) return finish(new Error(`Python错误: ${full.error}`));
+                    finish(null, full.result);
+                }, finish);
+            } catch (e) {
+                finish(e);
+            }
+        });
+
+        client.on("error", (err) => {
+            if (!connected) connectFailed();
+            finish(err);
+        });
+    });
+}
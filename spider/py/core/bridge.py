@@ -3,31 +3,49 @@
 
 import argparse
 import json
+import os
 import pickle
 import socket
 import struct
 import sys
+import time
 
 HOST = "127.0.0.1"
-PORT = 57570
-MAX_MSG_SIZE = 10 * 1024 * 1024
+PORT = int(os.environ.get("T4_PORT") or 57570)
+MAX_MSG_SIZE = int(os.environ.get("T4_MAX_MSG_SIZE") or 60 * 1024 * 1024)  # 与守护进程一致
 TIMEOUT = 30
+UNIX_SOCKET = os.environ.get("T4_UNIX_SOCKET", "")
 
 def send_packet(sock, obj: dict):
     payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
     if len(payload) > MAX_MSG_SIZE:
-        raise ValueError("payload too large")
-    sock.sendall(struct.pack(">I", len(payload)))
-    sock.sendall(payload)
+        raise ValueError(f"payload too large:{len(payload)} > {MAX_MSG_SIZE} (T4_MAX_MSG_SIZE)")
+    header = struct.pack(">I", len(payload))
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(header + payload)
+        return
+    # 长度头与数据一次聚合写出，部分发送时从断点继续
+    views = [memoryview(header), memoryview(payload)]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
 
-def recv_exact(sock, n: int) -> bytes:
-    data = b""
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
+def recv_exact(sock, n: int) -> bytearray:
+    # 预分配缓冲区 + recv_into，大响应线性时间且只拷贝一次
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        got = sock.recv_into(view[pos:], n - pos)
+        if not got:
             raise ConnectionError("peer closed")
-        data += chunk
-    return data
+        pos += got
+    return buf
 
 def recv_packet(sock) -> dict:
     header = recv_exact(sock, 4)
@@ -35,7 +53,24 @@ def recv_packet(sock) -> dict:
     if length <= 0 or length > MAX_MSG_SIZE:
         raise ValueError("invalid length")
     payload = recv_exact(sock, length)
-    return pickle.loads(payload)
+    resp = pickle.loads(payload)
+    if isinstance(resp, dict) and "shm" in resp and "success" not in resp:
+        # 大包经共享内存文件传递：读取后删除
+        path = resp["shm"]
+        try:
+            with open(path, "rb") as f:
+                return pickle.loads(f.read())
+        finally:
+            os.unlink(path)
+    return resp
+
+def connect(args):
+    if args.unix_socket and hasattr(socket, "AF_UNIX") and os.path.exists(args.unix_socket):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(args.timeout)
+        s.connect(args.unix_socket)
+        return s
+    return socket.create_connection((args.host, args.port), timeout=args.timeout)
 
 def main():
     p = argparse.ArgumentParser(description="T4 CLI bridge")
@@ -45,6 +80,7 @@ def main():
     p.add_argument("--arg", action="append", default=[], help="方法参数；可多次传入。每个参数若可解析为JSON则按JSON，否则按字符串")
     p.add_argument("--host", default=HOST, help="守护进程主机（默认127.0.0.1）")
     p.add_argument("--port", type=int, default=PORT, help="守护进程端口（默认57570）")
+    p.add_argument("--unix-socket", default=UNIX_SOCKET, help="守护进程 Unix 域套接字路径（默认取 T4_UNIX_SOCKET，存在时优先于 TCP）")
     p.add_argument("--timeout", type=int, default=TIMEOUT, help="超时秒数（默认30）")
     args = p.parse_args()
 
@@ -53,10 +89,14 @@ def main():
         "method_name": args.method_name,
         "env": args.env,
         "args": args.arg,
+        # 截止时间(unix秒)：守护进程据此丢弃过期排队、收紧 spider 内部请求超时
+        "deadline": time.time() + args.timeout,
+        # 同机客户端：大响应允许走共享内存文件
+        "shm": True,
     }
 
     try:
-        with socket.create_connection((args.host, args.port), timeout=args.timeout) as s:
+        with connect(args) as s:
             s.settimeout(args.timeout)
             send_packet(s, req)
             resp = recv_packet(s)
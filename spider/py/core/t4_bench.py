@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# File  : t4_bench.py
+# Desc  : T4 守护进程基准/压测工具：按 trace 经真实 socket 协议并发回放，统计吞吐、延迟分位、RSS 与分阶段耗时
+"""
+用法示例::
+
+    # 1. 按 home → category → detail → play → search 走一遍脚本，生成 trace（JSONL，每行一个请求）
+    python t4_bench.py trace --script ../AppHs.py --ext '{"host": "http://127.0.0.1:58080"}' -o hs.jsonl
+
+    # 2. 启动录制响应的 HTTP 桩：trace 中 ext.host 指向它，或设 HTTP_PROXY 让 http:// 请求经它返回
+    python t4_bench.py stub --fixtures fixtures.json --port 58080 --latency 0.02
+
+    # 3. 回放：16 并发共 2000 个请求；--spawn 在独立端口拉起一个新守护进程，结束后关闭
+    python t4_bench.py run --trace hs.jsonl --concurrency 16 --requests 2000 --spawn --json result.json
+
+    # 离线：生成 trace 时拉起录制模式的守护进程，把脚本发出的真实 HTTP 请求录入归档；之后按归档回放(base/fixtures.py)
+    python t4_bench.py trace --script ../AppHs.py -o hs.jsonl --record hs_http
+    python t4_bench.py run --trace hs.jsonl --spawn --replay hs_http --replay-latency recorded
+
+    # 启动耗时：-X importtime 测 base.spider / base.htmlParser / t4_daemon 的导入耗时与守护进程冷启动，超出预算时退出码为 1
+    python t4_bench.py startup --budget base.spider=100 --startup-budget 1500
+
+trace 行格式: {"script_path": ..., "method_name": ..., "env": ..., "args": [...]}，与 bridge.js 发送的请求一致。
+fixtures 格式: {"GET /api/list?pg=1": {"status": 200, "headers": {...}, "body": "..."}, ...}，
+body 也可用 body_b64 给出二进制；键中的路径也可以是完整 URL（HTTP_PROXY 转发模式下按完整 URL 匹配）。
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import pickle
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+HOST = "127.0.0.1"
+PORT = int(os.environ.get("T4_PORT") or 57570)
+TIMEOUT = 30
+DAEMON_SCRIPT = Path(__file__).resolve().parent / "t4_daemon.py"
+PY_ROOT = DAEMON_SCRIPT.parents[1]  # spider/py，base 包所在目录
+# 导入耗时预算（毫秒，-X importtime 累计值，多次取最快）；守护进程冷启动预算（拉起到响应 __stats__）
+IMPORT_BUDGET_MS = {"base.spider": 150, "base.htmlParser": 150, "t4_daemon": 250}
+STARTUP_BUDGET_MS = 2000
+
+
+# ==================== 客户端 ======================
+def _recv_exact(sock, n: int) -> bytearray:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        got = sock.recv_into(view[pos:], n - pos)
+        if not got:
+            raise ConnectionError("peer closed")
+        pos += got
+    return buf
+
+
+def _recv_frame(sock) -> bytearray:
+    (length,) = struct.unpack(">I", _recv_exact(sock, 4))
+    return _recv_exact(sock, length) if length else bytearray()
+
+
+def call_daemon(req: dict, host: str = HOST, port: int = PORT, unix_socket: str = "",
+                timeout: float = TIMEOUT) -> tuple:
+    """
+    发送一个请求（JSON，与 bridge.js 相同）并读完整个响应；流式响应读到结束帧，共享内存响应读取后删除
+    @return: (响应 dict, 收到的字节数)
+    """
+    req = dict(req, deadline=time.time() + timeout, stream=True, shm=True)
+    payload = json.dumps(req, ensure_ascii=False).encode("utf-8")
+    if unix_socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(unix_socket)
+    else:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    with sock:
+        sock.sendall(struct.pack(">I", len(payload)) + payload)
+        frame = _recv_frame(sock)
+        received = len(frame) + 4
+        resp = pickle.loads(frame)
+        if isinstance(resp, dict) and "shm" in resp and "success" not in resp:
+            with open(resp["shm"], "rb") as f:
+                data = f.read()
+            os.unlink(resp["shm"])
+            received += len(data)
+            resp = pickle.loads(data)
+        if isinstance(resp, dict) and resp.get("stream"):
+            while True:
+                chunk = _recv_frame(sock)
+                received += len(chunk) + 4
+                if not chunk:
+                    break
+    return resp, received
+
+
+def daemon_stats(**conn) -> dict:
+    resp, _ = call_daemon({"script_path": "", "method_name": "__stats__", "args": []}, **conn)
+    return resp.get("result") or {}
+
+
+def wait_daemon(deadline: float, interval: float = 0.2, **conn):
+    while True:
+        try:
+            return daemon_stats(**conn)
+        except OSError:
+            if time.time() > deadline:
+                raise TimeoutError("daemon did not start in time")
+            time.sleep(interval)
+
+
+def _child_env(**extra) -> dict:
+    env = dict(os.environ, T4_LOG_LEVEL="WARNING", T4_HOT_RELOAD="0", **extra)
+    for name in ("T4_UNIX_SOCKET", "T4_PID_FILE", "T4_LOG_FILE", "T4_METRICS_PORT"):
+        env.pop(name, None)
+    return env
+
+
+def spawn_daemon(port: int, env: dict | None = None, poll: float = 0.2) -> subprocess.Popen:
+    """在指定端口拉起独立守护进程（日志降为 WARNING，避免日志 I/O 干扰测量）"""
+    proc = subprocess.Popen([sys.executable, str(DAEMON_SCRIPT)], env=_child_env(T4_PORT=str(port), **(env or {})),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_daemon(time.time() + 15, poll, port=port)
+    return proc
+
+
+def fixture_env(mode: str, archive: str, latency="0") -> dict:
+    """守护进程录制/回放 HTTP 的环境变量（见 base/fixtures.py）"""
+    return {"T4_HTTP_FIXTURES": mode, "T4_HTTP_ARCHIVE": os.path.abspath(archive), "T4_HTTP_LATENCY": str(latency)}
+
+
+# ==================== trace ======================
+def load_trace(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _result_obj(resp: dict):
+    result = resp.get("result") if isinstance(resp, dict) else None
+    if isinstance(result, str):
+        try:
+            return json.loads(result)
+        except ValueError:
+            return None
+    return result
+
+
+def record_trace(script_path: str, env: str, keyword: str = "测试", **conn) -> list:
+    """按 base_test._test_script_functionality 的顺序调用一遍，记下每个请求，作为回放用 trace"""
+    trace = []
+
+    def step(method, args):
+        req = {"script_path": script_path, "method_name": method, "env": env, "args": args}
+        trace.append(req)
+        resp, _ = call_daemon(req, **conn)
+        return _result_obj(resp) or {}
+
+    home = step("home", [1])
+    step("homeVod", [])
+    classes = home.get("class") if isinstance(home, dict) else None
+    if classes:
+        category = step("category", [classes[0]["type_id"], 1, 1, {}])
+        if category.get("list"):
+            detail = step("detail", [[category["list"][0]["vod_id"]]])
+            if detail.get("list"):
+                vod = detail["list"][0]
+                play_from = (vod.get("vod_play_from") or "").split("$$$")[0]
+                parts = (vod.get("vod_play_url") or "").split("#")[0].split("$")
+                if play_from and len(parts) > 1:
+                    step("play", [play_from, parts[1], []])
+    step("search", [keyword, 0, 1])
+    return trace
+
+
+# ==================== 统计 ======================
+def percentile(values: list, q: float) -> float:
+    """最近秩分位数，values 需已排序"""
+    if not values:
+        return 0.0
+    # 秩 = ceil(q·n)；先舍入掉浮点误差，避免 0.07 * 100 = 7.000000000000001 进位到下一名
+    rank = max(0, min(len(values) - 1, math.ceil(round(q * len(values), 9)) - 1))
+    return values[rank]
+
+
+def _latency_summary(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def phase_delta(before: dict, after: dict) -> dict:
+    """两次 __stats__ 之间各脚本分阶段耗时的增量：{script: {phase: {total_ms, count, avg_ms}}}"""
+    old = (before.get("metrics") or {}).get("phases") or {}
+    new = (after.get("metrics") or {}).get("phases") or {}
+    delta = {}
+    for script, phases in new.items():
+        for phase, acc in phases.items():
+            prev = old.get(script, {}).get(phase, {"total_ms": 0.0, "count": 0})
+            count = acc["count"] - prev["count"]
+            if count <= 0:
+                continue
+            total = acc["total_ms"] - prev["total_ms"]
+            delta.setdefault(script, {})[phase] = {"total_ms": round(total, 2), "count": count,
+                                                  "avg_ms": round(total / count, 3)}
+    return delta
+
+
+# ==================== 回放 ======================
+def run_bench(trace: list, concurrency: int = 8, requests: int = 0, duration: float = 0.0, warmup: int = 0,
+              **conn) -> dict:
+    """
+    concurrency 个线程循环回放 trace，直到完成 requests 个请求或持续 duration 秒（二者都为 0 时回放一遍）。
+    warmup 个请求先串行执行且不计入统计（实例创建/init 的冷启动单独看 phases.init）。
+    """
+    if not trace:
+        raise ValueError("empty trace")
+    for i in range(warmup):
+        call_daemon(trace[i % len(trace)], **conn)
+    total = requests or (0 if duration else len(trace))
+    before = daemon_stats(**conn)
+    lock = threading.Lock()
+    counter = [0]
+    latencies = []
+    by_method = defaultdict(list)
+    errors = defaultdict(int)
+    received = [0]
+    started = time.time()
+    stop_at = started + duration if duration else None
+
+    def next_index():
+        with lock:
+            if (total and counter[0] >= total) or (stop_at and time.time() >= stop_at):
+                return None
+            counter[0] += 1
+            return counter[0] - 1
+
+    def worker():
+        while (index := next_index()) is not None:
+            req = trace[index % len(trace)]
+            t0 = time.perf_counter()
+            try:
+                resp, size = call_daemon(req, **conn)
+                ok = isinstance(resp, dict) and resp.get("success", True) is not False
+                error = None if ok else str(resp.get("error"))[:120]
+            except Exception as e:
+                size, error = 0, f"{type(e).__name__}: {e}"[:120]
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                by_method[req.get("method_name", "")].append(elapsed)
+                received[0] += size
+                if error is not None:
+                    errors[error] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, concurrency))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - started
+    after = daemon_stats(**conn)
+    rss_before = (before.get("process") or {}).get("rss_bytes", 0)
+    rss_after = (after.get("process") or {}).get("rss_bytes", 0)
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_samples": dict(sorted(errors.items(), key=lambda kv: -kv[1])[:5]),
+        "concurrency": concurrency,
+        "elapsed_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "received_bytes": received[0],
+        "latency": _latency_summary(latencies),
+        "methods": {method: _latency_summary(values) for method, values in sorted(by_method.items())},
+        "rss": {"before_bytes": rss_before, "after_bytes": rss_after,
+                "max_bytes": (after.get("process") or {}).get("max_rss_bytes", 0)},
+        "phases": phase_delta(before, after),
+        "http_fixtures": after.get("http_fixtures"),
+    }
+
+
+def _mib(n: int) -> str:
+    return f"{n / 1048576:.1f}MiB"
+
+
+def print_report(report: dict):
+    lat = report["latency"]
+    print(f"requests {report['requests']}  errors {report['errors']}  concurrency {report['concurrency']}  "
+          f"elapsed {report['elapsed_s']}s  throughput {report['throughput_rps']} req/s")
+    print(f"latency  p50 {lat['p50_ms']}ms  p95 {lat['p95_ms']}ms  p99 {lat['p99_ms']}ms  max {lat['max_ms']}ms")
+    rss = report["rss"]
+    print(f"rss      before {_mib(rss['before_bytes'])}  after {_mib(rss['after_bytes'])}  "
+          f"peak {_mib(rss['max_bytes'])}")
+    print(f"{'method':<12}{'count':>8}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}")
+    for method, st in report["methods"].items():
+        print(f"{method:<12}{st['count']:>8}{st['p50_ms']:>10}{st['p95_ms']:>10}{st['p99_ms']:>10}")
+    if report["phases"]:
+        print(f"{'script':<20}{'phase':<12}{'count':>8}{'avg_ms':>10}{'total_ms':>12}")
+        for script, phases in report["phases"].items():
+            for phase, st in phases.items():
+                print(f"{script[:19]:<20}{phase:<12}{st['count']:>8}{st['avg_ms']:>10}{st['total_ms']:>12}")
+    if report.get("http_fixtures"):
+        fx = report["http_fixtures"]
+        print(f"http fixtures [{fx['mode']}] entries {fx['entries']}  hits {fx['hits']}  misses {fx['misses']}")
+    for error, count in report["error_samples"].items():
+        print(f"error x{count}: {error}")
+
+
+# ==================== 启动耗时 ======================
+def measure_import(module: str, runs: int = 3) -> dict:
+    """
+    在新解释器中以 -X importtime 导入 module（多次取最快，排除磁盘缓存等抖动）
+    @return: {"total_ms": 累计耗时, "top": [[模块, 自身ms, 累计ms], ...] 按自身耗时取前 10}
+    """
+    cwd = str(DAEMON_SCRIPT.parent if module == DAEMON_SCRIPT.stem else PY_ROOT)
+    best = None
+    for _ in range(max(1, runs)):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd,
+                              env=_child_env(), capture_output=True, text=True, timeout=120)
+        rows = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append([name.strip(), round(int(self_us) / 1000, 2), round(int(cumulative_us) / 1000, 2)])
+        total = next((row[2] for row in reversed(rows) if row[0] == module), None)
+        if total is None:
+            raise RuntimeError(f"import {module} failed: {proc.stderr.strip()[-500:]}")
+        if best is None or total < best["total_ms"]:
+            best = {"total_ms": total, "top": sorted(rows, key=lambda row: -row[1])[:10]}
+    return best
+
+
+def measure_startup(port: int, runs: int = 3) -> float:
+    """守护进程冷启动耗时（毫秒）：拉起进程到首次响应 __stats__，多次取最快"""
+    best = None
+    for _ in range(max(1, runs)):
+        started = time.time()
+        proc = spawn_daemon(port, poll=0.01)
+        elapsed = (time.time() - started) * 1000
+        proc.terminate()
+        proc.wait(timeout=10)
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 1)
+
+
+def run_startup(budgets: dict, startup_budget: float, port: int, runs: int = 3) -> dict:
+    """@return: {"imports": {模块: {...}}, "startup_ms", "over_budget": [超出预算的项]}"""
+    report = {"imports": {}, "over_budget": []}
+    for module, budget in budgets.items():
+        result = measure_import(module, runs)
+        result["budget_ms"] = budget
+        report["imports"][module] = result
+        if budget and result["total_ms"] > budget:
+            report["over_budget"].append(f"import {module}: {result['total_ms']}ms > {budget}ms")
+    report["startup_ms"] = measure_startup(port, runs)
+    report["startup_budget_ms"] = startup_budget
+    if startup_budget and report["startup_ms"] > startup_budget:
+        report["over_budget"].append(f"daemon startup: {report['startup_ms']}ms > {startup_budget}ms")
+    return report
+
+
+def print_startup_report(report: dict):
+    for module, result in report["imports"].items():
+        print(f"import {module:<18} {result['total_ms']:>8}ms  budget {result['budget_ms']}ms")
+        for name, self_ms, cumulative_ms in result["top"][:5]:
+            print(f"    {name.strip():<40}{self_ms:>8}ms self{cumulative_ms:>10}ms cumulative")
+    print(f"daemon startup        {report['startup_ms']:>8}ms  budget {report['startup_budget_ms']}ms")
+    for item in report["over_budget"]:
+        print(f"OVER BUDGET: {item}")
+
+
+# ==================== 录制响应 HTTP 桩 ======================
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    按 "METHOD 完整URL" / "METHOD 路径?查询" / "METHOD 路径" 依次查找录制的响应；
+    作为 HTTP_PROXY 使用时请求行是完整 URL，直接命中第一种。
+    """
+    protocol_version = "HTTP/1.1"
+    fixtures: dict = {}
+    latency = 0.0
+    misses = defaultdict(int)
+
+    def _lookup(self):
+        parts = urlsplit(self.path)
+        path_query = parts.path + (f"?{parts.query}" if parts.query else "")
+        for target in (self.path, path_query, parts.path):
+            fixture = self.fixtures.get(f"{self.command} {target}")
+            if fixture is not None:
+                return fixture
+        return None
+
+    def _serve(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        fixture = self._lookup()
+        if self.latency:
+            time.sleep(self.latency)
+        if fixture is None:
+            self.misses[f"{self.command} {self.path}"] += 1
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if "body_b64" in fixture:
+            body = base64.b64decode(fixture["body_b64"])
+        else:
+            body = fixture.get("body", "")
+            body = (json.dumps(body, ensure_ascii=False) if not isinstance(body, str) else body).encode("utf-8")
+        self.send_response(int(fixture.get("status", 200)))
+        for name, value in (fixture.get("headers") or {}).items():
+            if name.lower() not in ("content-length", "transfer-encoding", "content-encoding", "connection"):
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_HEAD = do_PUT = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(fixtures: dict, host: str = HOST, port: int = 0, latency: float = 0.0) -> ThreadingHTTPServer:
+    """在后台线程启动 HTTP 桩，返回 server（server.server_address[1] 为实际端口）"""
+    handler = type("BoundStubHandler", (StubHandler,), {"fixtures": fixtures, "latency": latency,
+                                                        "misses": defaultdict(int)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="t4-bench-stub", daemon=True).start()
+    return server
+
+
+def _load_fixtures(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ==================== 命令行 ======================
+def main():
+    p = argparse.ArgumentParser(description="T4 daemon benchmark")
+    p.add_argument("--host", default=HOST)
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--unix-socket", default="", help="经 Unix 域套接字连接守护进程")
+    p.add_argument("--timeout", type=float, default=TIMEOUT, help="单个请求超时（秒）")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    t = sub.add_parser("trace", help="走一遍脚本生成 trace")
+    t.add_argument("--script", required=True)
+    t.add_argument("--ext", default="", help="ext（JSON 或字符串）")
+    t.add_argument("--keyword", default="测试")
+    t.add_argument("-o", "--output", required=True)
+    t.add_argument("--record", default="", help="拉起录制模式的守护进程，HTTP 响应录入该归档目录")
+
+    s = sub.add_parser("stub", help="启动录制响应 HTTP 桩")
+    s.add_argument("--fixtures", required=True)
+    s.add_argument("--port", dest="stub_port", type=int, default=58080)
+    s.add_argument("--latency", type=float, default=0.0, help="每个响应注入的延迟（秒）")
+
+    r = sub.add_parser("run", help="并发回放 trace")
+    r.add_argument("--trace", required=True)
+    r.add_argument("--concurrency", type=int, default=8)
+    r.add_argument("--requests", type=int, default=0, help="总请求数（默认回放一遍）")
+    r.add_argument("--duration", type=float, default=0.0, help="持续秒数，优先于 --requests")
+    r.add_argument("--warmup", type=int, default=0, help="预热请求数（不计入统计）")
+    r.add_argument("--spawn", action="store_true", help="在独立端口拉起新守护进程并在结束后关闭")
+    r.add_argument("--stub", default="", help="同时在后台启动 HTTP 桩，值为 fixtures 文件")
+    r.add_argument("--stub-port", type=int, default=58080)
+    r.add_argument("--stub-latency", type=float, default=0.0)
+    r.add_argument("--replay", default="", help="HTTP 归档目录；守护进程按归档回放响应（需 --spawn）")
+    r.add_argument("--replay-latency", default="0", help="回放延迟秒数，或 recorded 按录制耗时")
+    r.add_argument("--json", default="", help="把结果写入 JSON 文件，便于前后对比")
+    b = sub.add_parser("startup", help="-X importtime 导入耗时与守护进程冷启动，按预算检查")
+    b.add_argument("--budget", action="append", default=[],
+                   help="模块=毫秒，覆盖/新增导入预算（可多次），毫秒为 0 表示只测量")
+    b.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, help="冷启动预算（毫秒）")
+    b.add_argument("--runs", type=int, default=3)
+    b.add_argument("--json", default="")
+    args = p.parse_args()
+
+    conn = {"host": args.host, "port": args.port, "unix_socket": args.unix_socket, "timeout": args.timeout}
+    if args.command == "stub":
+        server = start_stub(_load_fixtures(args.fixtures), port=args.stub_port, latency=args.latency)
+        print(f"stub listening on http://{HOST}:{server.server_address[1]}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    if args.command == "startup":
+        budgets = dict(IMPORT_BUDGET_MS)
+        for item in args.budget:
+            module, _, ms = item.partition("=")
+            budgets[module.strip()] = float(ms or 0)
+        report = run_startup(budgets, args.startup_budget, args.port + 1, args.runs)
+        print_startup_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        sys.exit(1 if report["over_budget"] else 0)
+
+    if args.command == "trace":
+        env = json.dumps({"proxyUrl": "", "ext": args.ext}, ensure_ascii=False)
+        proc = None
+        if args.record:
+            conn.update(port=args.port + 1, unix_socket="")
+            proc = spawn_daemon(conn["port"], fixture_env("record", args.record))
+        try:
+            trace = record_trace(args.script, env, args.keyword, **conn)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=10)
+        with open(args.output, "w", encoding="utf-8") as f:
+            for req in trace:
+                f.write(json.dumps(req, ensure_ascii=False) + "\n")
+        print(f"{len(trace)} requests written to {args.output}")
+        return
+
+    stub = start_stub(_load_fixtures(args.stub), port=args.stub_port, latency=args.stub_latency) if args.stub else None
+    if args.replay and not args.spawn:
+        p.error("--replay 需要 --spawn")
+    proc = None
+    if args.spawn:
+        conn.update(port=args.port + 1, unix_socket="")
+        proc = spawn_daemon(conn["port"], fixture_env("replay", args.replay, args.replay_latency) if args.replay else None)
+    try:
+        report = run_bench(load_trace(args.trace), args.concurrency, args.requests, args.duration, args.warmup,
+                           **conn)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if stub is not None:
+            stub.shutdown()
+    if stub is not None:
+        report["stub_misses"] = dict(stub.RequestHandlerClass.misses)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
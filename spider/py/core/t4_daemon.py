@@ -8,22 +8,38 @@
 其他设计点请参见之前说明。
 """
 
+import bisect
+import fnmatch
 import hashlib
 import importlib
 import importlib.util
 import ujson
+import atexit
 import logging
+import logging.handlers
 import os
 import pickle
+import queue
+import random
+import re
+import reprlib
+import selectors
 import signal
+import socket
 import struct
+import subprocess
+import tempfile
 import threading
 import time
 import traceback
-from collections import OrderedDict
+import unicodedata
+from collections import OrderedDict, deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import nullcontext
 from pathlib import Path
 from urllib.parse import quote
-from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler
+from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler, UnixStreamServer
 import sys
 
 # =========================
@@ -46,35 +62,134 @@ except Exception:
 # 配置常量（可按需调整）
 # =========================
 HOST = "127.0.0.1"
-PORT = 57570
-
-MAX_MSG_SIZE = 60 * 1024 * 1024  # 60MB
+PORT = int(os.environ.get("T4_PORT") or 57570)
+
+# 单包上限，bridge.py / bridge.js 读取同一环境变量，保持两端一致
+MAX_MSG_SIZE = int(os.environ.get("T4_MAX_MSG_SIZE") or 60 * 1024 * 1024)  # 60MB
+# 同机传输：可选 Unix 域套接字监听；设置后可用 T4_TCP_LISTEN=0 关闭 TCP 端口
+UNIX_SOCKET = os.environ.get("T4_UNIX_SOCKET", "")
+TCP_LISTEN = os.environ.get("T4_TCP_LISTEN", "1") != "0"
+# 响应包达到阈值且客户端声明 shm 时，包体写入共享内存文件，socket 上只传文件路径；阈值为 0 关闭
+SHM_DIR = os.environ.get("T4_SHM_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else "")
+SHM_THRESHOLD = int(os.environ.get("T4_SHM_THRESHOLD") or 1024 * 1024)  # 1MB
+SHM_PREFIX = "t4-shm-"
+SHM_ORPHAN_AGE = 120  # 客户端未取走的共享内存文件保留时间（秒），由清理线程删除
 MAX_CACHED_INSTANCES = 100  # 最大缓存实例数
 INIT_TIMEOUT = 100  # init 超时（秒）
 REQUEST_TIMEOUT = 30  # 单次请求 socket 超时（秒）
 IDLE_EXPIRE = 30 * 60  # 实例空闲过期（秒）
 CLEAN_INTERVAL = 5 * 60  # 清理间隔（秒）
+HOT_RELOAD_INTERVAL = float(os.environ.get("T4_HOT_RELOAD", 2))  # 脚本文件 mtime 轮询间隔（秒），0 关闭热重载
+RETIRE_TIMEOUT = 2 * REQUEST_TIMEOUT  # 热重载换下的旧实例最多等待在途调用这么久再释放
 MAX_CONCURRENT_INITS = 8  # 并发初始化上限（可按需调大/调小）
+MAX_CONCURRENT_CALLS = int(os.environ.get("T4_MAX_WORKERS", 32))  # 全局同时执行的 spider 调用上限
+DEFAULT_INSTANCE_CONCURRENCY = 4  # spider 未声明 getConcurrency() 时单实例并发上限
+CANCEL_POLL_INTERVAL = 0.2  # 检测客户端断开的间隔（秒）
+DEADLINE_MARGIN = 0.25  # 预留给错误响应回传的时间（秒），spider 预算 = 客户端 deadline - margin
+BATCH_MAX_ENTRIES = 256  # 单个 batch 请求最多条目数
+BATCH_WORKERS = int(os.environ.get("T4_BATCH_WORKERS", 64))  # batch 条目执行线程数（实际执行仍受调度器并发上限约束）
+SEARCH_PARALLEL = 8  # multi_search 默认同时搜索的源数
+SEARCH_WORKERS = int(os.environ.get("T4_SEARCH_WORKERS", 32))  # multi_search 扇出线程数（与 batch 线程池分开）
+SEARCH_SOFT_DEADLINE = 3.0  # multi_search 默认软截止（秒），到期返回已有结果
+SEARCH_MIN_SAMPLES = 3  # 源至少有这么多次历史耗时后才会因“通常很慢”被跳过
+SEARCH_PROBE_EVERY = 5  # 被跳过的源每跳过这么多次放行一次，重新学习耗时
+
+# 进程隔离：匹配的脚本（逗号分隔的文件名/路径通配符，如 "*Java*.py,七猫*"）在独立 worker 子进程中执行
+ISOLATED_SCRIPTS = [p.strip() for p in os.environ.get("T4_ISOLATED_SCRIPTS", "").split(",") if p.strip()]
+ISOLATED_RSS_LIMIT = int(os.environ.get("T4_ISOLATED_RSS_MB") or 1024) * 1024 * 1024  # worker RSS 超过后回收重启
+ISOLATED_CPU_LIMIT = int(os.environ.get("T4_ISOLATED_CPU_SECONDS") or 0)  # worker 累计 CPU 秒数上限（RLIMIT_CPU），0 不限
+ISOLATED_CPU_RECYCLE = 0.8  # 累计 CPU 达到上限的该比例时提前回收 worker，RLIMIT_CPU 只作兜底
+ISOLATED_AS_LIMIT = int(os.environ.get("T4_ISOLATED_AS_MB") or 0) * 1024 * 1024  # 虚拟内存硬上限（RLIMIT_AS），0 不限
+WORKER_HANG_GRACE = 10  # 调用超过 deadline 这么久仍未返回，视为 worker 卡死，杀掉重启（秒）
+
+METRICS_PORT = int(os.environ.get("T4_METRICS_PORT") or 0)  # 若设置则开启 Prometheus 文本格式的 /metrics 监听
+# __profile__ 输出目录，默认项目根目录 logs/
+PROFILE_DIR = os.environ.get("T4_PROFILE_DIR") or str(Path(__file__).resolve().parents[3] / "logs")
+PROFILE_MAX_DURATION = 10 * 60  # 单次采样最长持续时间（秒），到期自动停止
+PROFILE_MAX_STACKS = 20000  # stack 模式最多保留的不同调用栈数
+# 3.12+ 的 cProfile 基于 sys.monitoring，进程内同时只能有一个 Profile 启用，重叠的调用跳过不分析
+_CPROFILE_EXCLUSIVE = sys.version_info >= (3, 12)
 
 LOG_LEVEL = os.environ.get("T4_LOG_LEVEL", "INFO").upper()
 LOG_FILE = os.environ.get("T4_LOG_FILE")  # 若未设置则打到控制台
 PID_FILE = os.environ.get("T4_PID_FILE")  # 若设置则写入PID
+LOG_FIELD_LIMIT = int(os.environ.get("T4_LOG_FIELD_LIMIT", 200))  # 单个日志字段最大输出长度
+LOG_SAMPLE = os.environ.get("T4_LOG_SAMPLE", "")  # 按事件采样 INFO 日志，如 "call=0.1,request=0.05"
+
 
 # =========================
-# 日志配置
+# 日志配置：请求线程只把 LogRecord 放入队列，格式化与 I/O 由 QueueListener 线程完成
 # =========================
+class _Field:
+    """
+    日志字段包装：仅在监听线程真正输出时才生成文本，并截断到 limit 字符
+    （大 ext/args 在热路径上不会被 repr/拼接）
+    """
+    __slots__ = ("value", "limit")
+    _repr = reprlib.Repr()
+    _repr.maxstring = _repr.maxother = LOG_FIELD_LIMIT
+    _repr.maxlist = _repr.maxdict = _repr.maxtuple = 8
+
+    def __init__(self, value, limit: int = LOG_FIELD_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        value = self.value
+        text = value if isinstance(value, str) else self._repr.repr(value)
+        if len(text) > self.limit:
+            return f"{text[:self.limit]}...(+{len(text) - self.limit})"
+        return text
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """默认 QueueHandler.prepare 会在调用线程里格式化消息；这里原样入队，交给监听线程格式化"""
+
+    def prepare(self, record):
+        return record
+
+
+class _SamplingFilter(logging.Filter):
+    """按 record.event 采样；WARNING 及以上与未配置采样率的事件全部保留"""
+
+    def __init__(self, spec: str):
+        super().__init__()
+        self.rates = {}
+        for item in spec.split(","):
+            name, _, rate = item.partition("=")
+            try:
+                self.rates[name.strip()] = float(rate)
+            except ValueError:
+                continue
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
 logger = logging.getLogger("t4_daemon")
 logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
 fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
 
 sh = logging.StreamHandler()
 sh.setFormatter(fmt)
-logger.addHandler(sh)
+_log_handlers = [sh]
 
 if LOG_FILE:
     fh = logging.FileHandler(LOG_FILE, encoding="utf-8")
     fh.setFormatter(fmt)
-    logger.addHandler(fh)
+    _log_handlers.append(fh)
+
+_log_queue = queue.SimpleQueue()
+_queue_handler = _LazyQueueHandler(_log_queue)
+if LOG_SAMPLE:
+    _queue_handler.addFilter(_SamplingFilter(LOG_SAMPLE))
+logger.addHandler(_queue_handler)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 if PID_FILE:
     try:
@@ -102,40 +217,165 @@ METHOD_MAP = {
 # =========================
 # 工具：长度前缀协议（recv_exact/send_packet/recv_packet）
 # =========================
-def recv_exact(rfile, n: int) -> bytes:
-    """从 rfile 精确读取 n 字节，若对端关闭或超限则抛异常。"""
-    chunks = []
-    remaining = n
-    while remaining > 0:
-        chunk = rfile.read(remaining)
-        if not chunk:
+def recv_exact(rfile, n: int) -> bytearray:
+    """从 rfile 精确读取 n 字节到预分配缓冲区（readinto，无中间拼接），若对端关闭则抛异常。"""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        got = rfile.readinto(view[pos:])
+        if not got:
             raise ConnectionError("peer closed during read")
-        chunks.append(chunk)
-        remaining -= len(chunk)
-    return b"".join(chunks)
+        pos += got
+    return buf
 
 
-def send_packet(wfile, obj: dict):
-    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
-    if len(payload) > MAX_MSG_SIZE:
-        raise ValueError(f"payload too large:{len(payload)} > {MAX_MSG_SIZE}")
-    wfile.write(struct.pack(">I", len(payload)))
-    wfile.write(payload)
-    wfile.flush()
+def _frame(payload) -> list:
+    size = len(payload)
+    if size > MAX_MSG_SIZE:
+        raise ValueError(f"payload too large:{size} > {MAX_MSG_SIZE} (T4_MAX_MSG_SIZE)")
+    return [struct.pack(">I", size), payload]
 
 
-def recv_packet(rfile) -> dict:
+def write_frames(wfile, buffers) -> int:
+    """
+    聚合写：长度头与数据一次 sendmsg 发出（不拼接、不分两次系统调用），部分发送时从断点继续。
+    wfile 不是 socket 写端（无 sendmsg）时退化为 writelines。
+    """
+    sock = getattr(wfile, "_sock", None)
+    if sock is None or not hasattr(sock, "sendmsg"):
+        wfile.writelines(buffers)
+        wfile.flush()
+        return sum(len(b) for b in buffers)
+    views = [memoryview(b).cast("B") for b in buffers if len(b)]
+    total = sum(len(v) for v in views)
+    while views:
+        sent = sock.sendmsg(views)
+        while sent:
+            head = views[0]
+            if sent >= len(head):
+                sent -= len(head)
+                views.pop(0)
+            else:
+                views[0] = head[sent:]
+                sent = 0
+    return total
+
+
+def send_packet(wfile, obj: dict) -> int:
+    """发送一个包，返回写出的字节数（含 4 字节长度头）"""
+    return write_frames(wfile, _frame(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)))
+
+
+def _approx_payload_size(obj: dict) -> int:
+    """响应体大小的下限估计：只看 result 本身及其第一层的 str/bytes（json2str 结果或 localProxy 的 [code, mime, 内容]）"""
+    result = obj.get("result")
+    items = result if isinstance(result, (list, tuple)) else (result,)
+    return sum(len(item) for item in items if isinstance(item, (str, bytes, bytearray, memoryview)))
+
+
+def send_response(wfile, obj: dict, shm: bool = False) -> tuple:
+    """
+    发送响应包；客户端声明支持 shm 且包体达到 SHM_THRESHOLD 时，
+    直接 pickle 到 SHM_DIR 下的临时文件（不先在内存中生成完整包体），socket 上只发 {"shm": 路径, "size": 字节数}，
+    由客户端读取后删除。是否走 shm 按 result 中字符串/字节的总长度判断，无需先序列化。
+    @return: (socket 写出字节数, 共享内存字节数)
+    """
+    if not (shm and SHM_DIR and SHM_THRESHOLD) or _approx_payload_size(obj) < SHM_THRESHOLD:
+        return write_frames(wfile, _frame(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))), 0
+    fd, path = tempfile.mkstemp(prefix=SHM_PREFIX, dir=SHM_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        if size > MAX_MSG_SIZE:  # 与 socket 传输同样受 MAX_MSG_SIZE 限制
+            raise ValueError(f"payload too large:{size} > {MAX_MSG_SIZE} (T4_MAX_MSG_SIZE)")
+        handle = pickle.dumps({"shm": path, "size": size}, protocol=pickle.HIGHEST_PROTOCOL)
+        return write_frames(wfile, _frame(handle)), size
+    except Exception:
+        _unlink_quiet(path)
+        raise
+
+
+def _unlink_quiet(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def sweep_shm(max_age: float = SHM_ORPHAN_AGE) -> int:
+    """删除客户端未取走（如读取前断开）的共享内存文件，返回删除数量"""
+    if not SHM_DIR:
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(SHM_DIR))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.startswith(SHM_PREFIX) and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def recv_payload(rfile) -> bytearray:
     header = recv_exact(rfile, 4)
     (length,) = struct.unpack(">I", header)
     if length <= 0 or length > MAX_MSG_SIZE:
         raise ValueError("invalid length")
-    payload = recv_exact(rfile, length)
+    return recv_exact(rfile, length)
+
+
+def decode_payload(payload) -> dict:
     try:
         return ujson.loads(payload.decode("utf-8"))
     except Exception:
         return pickle.loads(payload)
 
 
+def is_stream_result(result) -> bool:
+    """localProxy 返回 [code, mime, 字节块迭代器, headers, ...] 时按流式帧转发，不在内存中拼接完整内容"""
+    return isinstance(result, (list, tuple)) and len(result) >= 3 and isinstance(result[2], Iterator)
+
+
+def send_stream(wfile, head: dict, chunks) -> int:
+    """
+    流式响应：先发一个 pickle 头包（stream=True，result[2] 为 None），
+    随后每个字节块作为一帧裸数据发送，长度为 0 的帧表示结束。
+    迭代器可以复用同一块缓冲区（memoryview），每帧写出后才会取下一块。
+    """
+    total = send_packet(wfile, head)
+    try:
+        for chunk in chunks:
+            if len(chunk):
+                total += write_frames(wfile, _frame(chunk))
+        return total + write_frames(wfile, [struct.pack(">I", 0)])
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()  # 归还上游连接
+
+
+def join_chunks(chunks) -> bytes:
+    """不支持流式帧的客户端：一次性读完（块可能复用缓冲区，需逐块拷贝）"""
+    try:
+        return b"".join(bytes(chunk) for chunk in chunks)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def recv_packet(rfile) -> dict:
+    return decode_payload(recv_payload(rfile))
+
+
 # =========================
 # 辅助：格式化字节大小
 # =========================
@@ -157,18 +397,32 @@ class SpiderInstance:
     - spider: 实例对象
     - module_name: 如果是从文件导入，则记录 module_name 用于卸载
     - estimated_size: 初始化时估算一次大小，后续通过加减维护全局估算
+    - key/script_path: 缓存 key 与脚本路径，调度器按此分配并发槽位
+    - concurrency: 单实例并发上限（取自 spider.getConcurrency()）
+    - refs: 作为依赖（getDependence）被多少个实例持有，大于 0 时不参与淘汰
+    - active: 在途调用数；env_str/init_ext/mtime: 热重载时按原配置重建实例，mtime 为导入时的文件修改时间
     """
-    __slots__ = ("spider", "module_name", "estimated_size", "initialized", "init_event", "last_used", "lock")
+    __slots__ = ("spider", "module_name", "estimated_size", "initialized", "init_event", "last_used", "lock",
+                 "key", "script_path", "concurrency", "refs", "active", "env_str", "init_ext", "mtime", "dependency")
 
-    def __init__(self, spider, module_name: str | None = None):
+    def __init__(self, spider, module_name: str | None = None, key: str = "", script_path: str = ""):
         self.spider = spider
         self.module_name = module_name
+        self.key = key
+        self.script_path = script_path
+        self.concurrency = _spider_concurrency(spider)
         self.estimated_size = 0
         self.initialized = True
         self.init_event = threading.Event()
         self.init_event.set()
         self.last_used = time.time()
         self.lock = threading.RLock()
+        self.refs = 0
+        self.active = 0
+        self.env_str = ""
+        self.init_ext = ""
+        self.mtime = None
+        self.dependency = ""  # 依赖实例：按此模块名经 importlib 导入（script_path 为其文件路径）
 
 
 class _InflightInit:
@@ -180,10 +434,11 @@ class _InflightInit:
     - start_ts: 初始化开始时间
     - timed_out: 若主线程等待超时并放弃该 inflight，则设置为 True，背景线程完成时会放弃 commit
     """
-    __slots__ = ("spider", "event", "error", "start_ts", "timed_out", "module_name")
+    __slots__ = ("spider", "event", "error", "start_ts", "timed_out", "module_name", "mtime")
 
-    def __init__(self, spider, module_name: str | None = None):
+    def __init__(self, spider, module_name: str | None = None, mtime: float | None = None):
         self.spider = spider
+        self.mtime = mtime
         self.event = threading.Event()
         self.error = None
         self.start_ts = time.time()
@@ -191,6 +446,856 @@ class _InflightInit:
         self.module_name = module_name
 
 
+def _script_mtime(script_path: str) -> float | None:
+    """脚本文件的修改时间；按模块名导入（非文件）时返回 None，不参与热重载"""
+    try:
+        return os.stat(script_path).st_mtime if script_path.endswith(".py") else None
+    except OSError:
+        return None
+
+
+def _spider_concurrency(spider) -> int:
+    """读取 spider 声明的单实例并发上限；未声明或非法时使用默认值"""
+    try:
+        n = int(spider.getConcurrency() or 0) if hasattr(spider, "getConcurrency") else 0
+    except Exception:
+        n = 0
+    return n if n > 0 else DEFAULT_INSTANCE_CONCURRENCY
+
+
+# =========================
+# 调用调度：实例级并发上限 + 全局工作槽 + 按脚本公平排队
+# =========================
+class _Ticket:
+    """一次等待执行的调用"""
+    __slots__ = ("key", "script", "event", "deadline", "enqueued_at", "granted_at", "granted")
+
+    def __init__(self, key: str, script: str, deadline: float | None):
+        self.key = key
+        self.script = script
+        self.event = threading.Event()
+        self.deadline = deadline
+        self.enqueued_at = time.time()
+        self.granted_at = 0.0
+        self.granted = False
+
+
+class _Lane:
+    """单个实例的调度状态与等待统计"""
+    __slots__ = ("script", "limit", "running", "queued", "served", "rejected", "wait_total", "wait_max")
+
+    def __init__(self, script: str, limit: int):
+        self.script = script
+        self.limit = limit
+        self.running = 0
+        self.queued = 0
+        self.served = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class CallScheduler:
+    """
+    spider 调用调度器
+    - 每个实例一条 lane，同时运行的调用数不超过 lane.limit（线程不安全的源声明为 1）
+    - 全局同时运行的调用数不超过 max_workers，慢源无法占满所有处理线程
+    - 等待中的调用按脚本轮转出队（同一脚本内 FIFO），保证各脚本之间公平
+    - 排队超过 deadline 的调用直接放弃，抛出 TimeoutError；客户端已断开的调用抛出 ConnectionAbortedError
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._running = 0
+        self._lanes: dict[str, _Lane] = {}
+        # script -> 等待队列；OrderedDict 的顺序即轮转顺序
+        self._waiting: "OrderedDict[str, deque[_Ticket]]" = OrderedDict()
+
+    def acquire(self, key: str, script: str, limit: int, deadline: float | None = None,
+                cancel_event: threading.Event | None = None) -> _Ticket:
+        ticket = _Ticket(key, script, deadline)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = _Lane(script, limit)
+            else:
+                lane.limit = limit
+            lane.queued += 1
+            self._waiting.setdefault(script, deque()).append(ticket)
+            self._dispatch()
+        while not ticket.event.is_set():
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            timeout = None if deadline is None else deadline - time.time()
+            if timeout is not None and timeout <= 0:
+                break
+            # 有取消信号时分片等待，以便及时响应客户端断开
+            if cancel_event is not None:
+                timeout = CANCEL_POLL_INTERVAL if timeout is None else min(timeout, CANCEL_POLL_INTERVAL)
+            ticket.event.wait(timeout)
+        with self._lock:
+            if not ticket.granted:
+                queue = self._waiting.get(script)
+                if queue is not None:
+                    try:
+                        queue.remove(ticket)
+                    except ValueError:
+                        pass
+                    if not queue:
+                        self._waiting.pop(script, None)
+                lane.queued -= 1
+                lane.rejected += 1
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ConnectionAbortedError("client disconnected while queued")
+                raise TimeoutError(f"queued {time.time() - ticket.enqueued_at:.2f}s without a free worker")
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        with self._lock:
+            lane = self._lanes.get(ticket.key)
+            if lane is not None:
+                lane.running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """在锁内调用：有空闲工作槽时按脚本轮转放行等待者"""
+        while self._running < self.max_workers and self._waiting:
+            for script, queue in self._waiting.items():
+                ticket = next((t for t in queue if self._lanes[t.key].running < self._lanes[t.key].limit), None)
+                if ticket is not None:
+                    break
+            else:
+                return
+            queue.remove(ticket)
+            if queue:
+                self._waiting.move_to_end(script)
+            else:
+                del self._waiting[script]
+            lane = self._lanes[ticket.key]
+            ticket.granted_at = time.time()
+            waited = ticket.granted_at - ticket.enqueued_at
+            lane.queued -= 1
+            lane.running += 1
+            lane.served += 1
+            lane.wait_total += waited
+            lane.wait_max = max(lane.wait_max, waited)
+            self._running += 1
+            ticket.granted = True
+            ticket.event.set()
+
+    def forget(self, key: str):
+        """实例被淘汰后清理其 lane（仍有运行/排队中的调用则保留）"""
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None and not lane.running and not lane.queued:
+                del self._lanes[key]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lanes = {
+                key[:16]: {
+                    "script": lane.script,
+                    "limit": lane.limit,
+                    "running": lane.running,
+                    "queued": lane.queued,
+                    "served": lane.served,
+                    "rejected": lane.rejected,
+                    "avg_wait_ms": round(lane.wait_total * 1000 / lane.served, 2) if lane.served else 0.0,
+                    "max_wait_ms": round(lane.wait_max * 1000, 2),
+                }
+                for key, lane in self._lanes.items()
+            }
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": sum(len(q) for q in self._waiting.values()),
+                "instances": lanes,
+            }
+
+
+# =========================
+# 运行指标：按脚本/方法的延迟直方图、分阶段耗时、流量与缓存命中
+# =========================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PHASES = ("queue", "init", "invoke", "serialize", "send")  # serialize: json2str；send: 响应打包并写出
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count", "errors")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # 最后一格为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, ok: bool = True):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if not ok:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数（秒）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+
+def _script_label(script_path: str) -> str:
+    return Path(script_path).stem if script_path else ""
+
+
+def _prom_escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class DaemonMetrics:
+    """
+    守护进程运行指标，热路径上只做加法（一把锁、无格式化），
+    导出时再统一计算：__stats__ 控制方法返回 dict，/metrics 返回 Prometheus 文本
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[tuple[str, str], _Histogram] = {}
+        self._phases: dict[tuple[str, str], list] = {}  # (script, phase) -> [sum, count]
+        self._counters = {
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_waits": 0,
+            "requests": 0,
+            "client_gone": 0,
+            "shm_bytes": 0,
+            "batch_entries": 0,
+            "worker_restarts": 0,
+            "worker_kills": 0,
+            "worker_recycles": 0,
+        }
+        self._gauges = {"connections": 0, "inflight_calls": 0}
+        self.started_at = time.time()
+
+    def observe_call(self, script_path: str, method: str, seconds: float, ok: bool = True):
+        key = (_script_label(script_path), method)
+        with self._lock:
+            hist = self._calls.get(key)
+            if hist is None:
+                hist = self._calls[key] = _Histogram()
+            hist.observe(seconds, ok)
+
+    def observe_phase(self, script_path: str, phase: str, seconds: float):
+        key = (_script_label(script_path), phase)
+        with self._lock:
+            acc = self._phases.get(key)
+            if acc is None:
+                acc = self._phases[key] = [0.0, 0]
+            acc[0] += seconds
+            acc[1] += 1
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def gauge_add(self, name: str, n: int):
+        with self._lock:
+            self._gauges[name] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = {
+                f"{script}.{method}": {
+                    "count": h.count,
+                    "errors": h.errors,
+                    "avg_ms": round(h.sum * 1000 / h.count, 2) if h.count else 0.0,
+                    "p50_ms": h.quantile(0.5) * 1000,
+                    "p95_ms": h.quantile(0.95) * 1000,
+                    "p99_ms": h.quantile(0.99) * 1000,
+                }
+                for (script, method), h in self._calls.items()
+            }
+            phases = {}
+            for (script, phase), (total, count) in self._phases.items():
+                phases.setdefault(script, {})[phase] = {"total_ms": round(total * 1000, 2), "count": count}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        lookups = counters["cache_hits"] + counters["cache_misses"] + counters["cache_waits"]
+        return {
+            "uptime": round(time.time() - self.started_at, 1),
+            "calls": calls,
+            "phases": phases,
+            "counters": counters,
+            "gauges": gauges,
+            "cache_hit_rate": round(counters["cache_hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    def render_prometheus(self, manager_stats: dict) -> str:
+        lines = []
+        with self._lock:
+            calls = [(k, list(h.buckets), h.sum, h.count, h.errors) for k, h in self._calls.items()]
+            phases = [(k, v[0], v[1]) for k, v in self._phases.items()]
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        lines.append("# TYPE t4_call_duration_seconds histogram")
+        for (script, method), buckets, total, count, _ in calls:
+            labels = f'script="{_prom_escape(script)}",method="{_prom_escape(method)}"'
+            cumulative = 0
+            for le, n in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                cumulative += n
+                lines.append(f't4_call_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"t4_call_duration_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"t4_call_duration_seconds_count{{{labels}}} {count}")
+        lines.append("# TYPE t4_call_errors_total counter")
+        for (script, method), _, _, _, errors in calls:
+            lines.append(
+                f't4_call_errors_total{{script="{_prom_escape(script)}",method="{_prom_escape(method)}"}} {errors}')
+        lines.append("# TYPE t4_phase_seconds_total counter")
+        lines.append("# TYPE t4_phase_count_total counter")
+        for (script, phase), total, count in phases:
+            labels = f'script="{_prom_escape(script)}",phase="{phase}"'
+            lines.append(f"t4_phase_seconds_total{{{labels}}} {total:.6f}")
+            lines.append(f"t4_phase_count_total{{{labels}}} {count}")
+        lines.append("# TYPE t4_bytes_total counter")
+        lines.append(f't4_bytes_total{{direction="in"}} {counters["bytes_in"]}')
+        lines.append(f't4_bytes_total{{direction="out"}} {counters["bytes_out"]}')
+        lines.append(f't4_bytes_total{{direction="shm"}} {counters["shm_bytes"]}')
+        lines.append("# TYPE t4_instance_cache_lookups_total counter")
+        for result in ("hits", "misses", "waits"):
+            lines.append(f't4_instance_cache_lookups_total{{result="{result}"}} {counters["cache_" + result]}')
+        lines.append("# TYPE t4_requests_total counter")
+        lines.append(f"t4_requests_total {counters['requests']}")
+        lines.append("# TYPE t4_client_gone_total counter")
+        lines.append(f"t4_client_gone_total {counters['client_gone']}")
+        lines.append("# TYPE t4_batch_entries_total counter")
+        lines.append(f"t4_batch_entries_total {counters['batch_entries']}")
+
+        scheduler = manager_stats.get("scheduler", {})
+        max_workers = scheduler.get("max_workers") or 1
+        gauge_values = {
+            "t4_connections": gauges["connections"],
+            "t4_inflight_calls": gauges["inflight_calls"],
+            "t4_workers_busy": scheduler.get("running", 0),
+            "t4_workers_max": max_workers,
+            "t4_workers_saturation": round(scheduler.get("running", 0) / max_workers, 4),
+            "t4_queue_depth": scheduler.get("queued", 0),
+            "t4_instances_cached": manager_stats.get("cache_count", 0),
+            "t4_instances_initializing": manager_stats.get("inflight_count", 0),
+            "t4_instances_estimated_bytes": manager_stats.get("estimated_bytes", 0),
+        }
+        for name, value in gauge_values.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        for name in ("commits", "evictions", "init_failures"):
+            lines.append(f"# TYPE t4_instance_{name}_total counter")
+            lines.append(f"t4_instance_{name}_total {manager_stats.get(name, 0)}")
+        lines.append("# TYPE t4_instance_queue_depth gauge")
+        lines.append("# TYPE t4_instance_running gauge")
+        for key, lane in scheduler.get("instances", {}).items():
+            labels = f'script="{_prom_escape(_script_label(lane["script"]))}",instance="{key}"'
+            lines.append(f"t4_instance_queue_depth{{{labels}}} {lane['queued']}")
+            lines.append(f"t4_instance_running{{{labels}}} {lane['running']}")
+        lines.append("# TYPE t4_spider_state_entries gauge")
+        lines.append("# TYPE t4_spider_state_bytes gauge")
+        for key, inst in manager_stats.get("instances", {}).items():
+            for name, state in inst["state"].items():
+                if not isinstance(state, dict):
+                    continue
+                labels = (f'script="{_prom_escape(_script_label(inst["script"]))}",instance="{key}",'
+                          f'state="{_prom_escape(name)}"')
+                lines.append(f"t4_spider_state_entries{{{labels}}} {state.get('entries', 0)}")
+                lines.append(f"t4_spider_state_bytes{{{labels}}} {state.get('approx_bytes', 0)}")
+        return "\n".join(lines) + "\n"
+
+
+# =========================
+# 采样分析：按脚本/方法/比例对线上调用开启 cProfile 或栈采样
+# =========================
+class _ProfileSession:
+    __slots__ = ("mode", "script", "method", "percent", "interval", "started_at", "expires_at",
+                 "calls", "stats", "active", "skipped", "stacks", "samples", "threads", "sampler")
+
+    def __init__(self, mode: str, script: str, method: str, percent: float, interval: float, duration: float):
+        self.mode = mode
+        self.script = script
+        self.method = method
+        self.percent = percent
+        self.interval = interval
+        self.started_at = time.time()
+        self.expires_at = self.started_at + duration
+        self.calls = 0
+        self.stats: "pstats.Stats | None" = None
+        self.active = 0  # 正在 cProfile 的调用数
+        self.skipped = 0  # 因已有 cProfile 在运行而未分析的调用数
+        self.stacks: dict[str, int] = {}
+        self.samples = 0
+        self.threads: dict[int, str] = {}  # thread ident -> "script.method"
+        self.sampler: threading.Thread | None = None
+
+    def matches(self, script_path: str, method_name: str, invoke: str) -> bool:
+        if self.script and self.script not in (script_path, _script_label(script_path)):
+            return False
+        if self.method and self.method not in (method_name, invoke):
+            return False
+        return self.percent >= 100 or random.random() * 100 < self.percent
+
+
+class CallProfiler:
+    """
+    线上调用采样分析，由 __profile__ 控制方法开关，无需重启：
+    - cprofile：对命中的调用在其线程内启用 cProfile，停止时合并写出 .pstats（3.12+ 同一时刻只分析一个调用）
+    - stack：后台线程按 interval 采样命中调用所在线程的栈，停止时写出 flamegraph 可用的 .collapsed
+    未开启时热路径只有一次属性判断；开启后通过 percent、最长持续时间与栈数上限控制开销
+    """
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self._lock = threading.Lock()
+        self._session: _ProfileSession | None = None
+
+    def start(self, mode: str = "cprofile", script: str = "", method: str = "", percent: float = 100,
+              interval: float = 0.005, duration: float = PROFILE_MAX_DURATION) -> dict:
+        if mode not in ("cprofile", "stack"):
+            raise ValueError(f"unknown profile mode: {mode}")
+        duration = min(float(duration), PROFILE_MAX_DURATION)
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("profiler already running, stop it first")
+            session = _ProfileSession(mode, script, method, float(percent), max(float(interval), 0.001), duration)
+            self._session = session
+        if mode == "stack":
+            session.sampler = threading.Thread(target=self._sample_loop, args=(session,), name="t4-profiler",
+                                               daemon=True)
+            session.sampler.start()
+        logger.info("Profiler started mode=%s script=%s method=%s percent=%s", mode, script, method, percent)
+        return self.status()
+
+    def stop(self) -> dict:
+        with self._lock:
+            session, self._session = self._session, None
+        if session is None:
+            return {"running": False}
+        if session.sampler is not None:
+            session.sampler.join(session.interval * 2 + 1)
+        return self._dump(session)
+
+    def status(self) -> dict:
+        session = self._session
+        if session is None:
+            return {"running": False}
+        return {
+            "running": True,
+            "mode": session.mode,
+            "script": session.script,
+            "method": session.method,
+            "percent": session.percent,
+            "calls": session.calls,
+            "skipped": session.skipped,
+            "samples": session.samples,
+            "elapsed": round(time.time() - session.started_at, 1),
+            "expires_in": round(session.expires_at - time.time(), 1),
+        }
+
+    def profile(self, script_path: str, method_name: str, invoke: str):
+        """供 _invoke 使用的上下文管理器；未命中时返回 nullcontext"""
+        session = self._session
+        if session is None:
+            return nullcontext()
+        if time.time() > session.expires_at:
+            threading.Thread(target=self.stop, daemon=True).start()
+            return nullcontext()
+        if not session.matches(script_path, method_name, invoke):
+            return nullcontext()
+        return self._profiled_call(session, f"{_script_label(script_path)}.{invoke}")
+
+    def _profiled_call(self, session: _ProfileSession, label: str):
+        profiler = self
+
+        class _Ctx:
+            def __enter__(self):
+                self.ident = threading.get_ident()
+                self.prof = None
+                if session.mode == "cprofile":
+                    with profiler._lock:
+                        if session.active and _CPROFILE_EXCLUSIVE:
+                            session.skipped += 1
+                            return
+                        session.active += 1
+                    import cProfile
+                    prof = cProfile.Profile()
+                    try:
+                        prof.enable()
+                    except ValueError:
+                        # 其它分析/调试工具已占用（3.12+ sys.monitoring 只允许一个），本次调用不分析
+                        with profiler._lock:
+                            session.active -= 1
+                            session.skipped += 1
+                        return
+                    self.prof = prof
+                else:
+                    with profiler._lock:
+                        session.threads[self.ident] = label
+
+            def __exit__(self, *exc):
+                if session.mode == "cprofile":
+                    if self.prof is None:
+                        return False
+                    self.prof.disable()
+                    with profiler._lock:
+                        session.active -= 1
+                        if session.stats is None:
+                            import pstats
+                            session.stats = pstats.Stats(self.prof)
+                        else:
+                            session.stats.add(self.prof)
+                        session.calls += 1
+                else:
+                    with profiler._lock:
+                        session.threads.pop(self.ident, None)
+                        session.calls += 1
+                return False
+
+        return _Ctx()
+
+    def _sample_loop(self, session: _ProfileSession):
+        while self._session is session and time.time() < session.expires_at:
+            time.sleep(session.interval)
+            with self._lock:
+                threads = dict(session.threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, label in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(label)
+                collapsed = ";".join(reversed(stack))
+                with self._lock:
+                    if collapsed in session.stacks or len(session.stacks) < PROFILE_MAX_STACKS:
+                        session.stacks[collapsed] = session.stacks.get(collapsed, 0) + 1
+                    session.samples += 1
+
+    def _dump(self, session: _ProfileSession) -> dict:
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = f"t4_profile_{_script_label(session.script) or 'all'}_{time.strftime('%Y%m%d_%H%M%S')}"
+        result = {"running": False, "mode": session.mode, "calls": session.calls, "skipped": session.skipped,
+                  "samples": session.samples}
+        if session.mode == "cprofile":
+            if session.stats is None:
+                result["file"] = None
+                return result
+            path = os.path.join(self.out_dir, name + ".pstats")
+            session.stats.dump_stats(path)
+            # 按累计耗时列出前 10 个函数，便于不打开文件快速判断
+            top = sorted(session.stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:10]
+            result["top"] = [
+                {"func": f"{Path(f[0]).name}:{f[1]}:{f[2]}", "calls": v[1], "cum_ms": round(v[3] * 1000, 2)}
+                for f, v in top
+            ]
+        else:
+            path = os.path.join(self.out_dir, name + ".collapsed")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(session.stacks.items(), key=lambda kv: kv[1], reverse=True):
+                    f.write(f"{stack} {count}\n")
+        result["file"] = path
+        logger.info("Profiler stopped, %d calls written to %s", session.calls, path)
+        return result
+
+
+# =========================
+# 客户端断开检测：单线程监视所有处理中的连接
+# =========================
+class DisconnectWatcher:
+    """
+    请求读取完毕后，客户端在收到响应前不会再发送数据；
+    此时连接变为可读只意味着对端关闭（EOF）或出错，据此设置对应调用的取消信号。
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="t4-disconnect-watcher", daemon=True)
+        self._thread.start()
+
+    def watch(self, sock) -> threading.Event:
+        event = threading.Event()
+        try:
+            with self._lock:
+                self._selector.register(sock, selectors.EVENT_READ, event)
+        except (ValueError, KeyError, OSError):
+            pass
+        return event
+
+    def unwatch(self, sock):
+        try:
+            with self._lock:
+                self._selector.unregister(sock)
+        except (ValueError, KeyError, OSError):
+            pass
+
+    def _loop(self):
+        while True:
+            if not self._selector.get_map():
+                time.sleep(CANCEL_POLL_INTERVAL)
+                continue
+            try:
+                ready = self._selector.select(CANCEL_POLL_INTERVAL)
+            except (OSError, ValueError, KeyError):
+                time.sleep(CANCEL_POLL_INTERVAL)
+                continue
+            for key, _ in ready:
+                sock, event = key.fileobj, key.data
+                try:
+                    closed = sock.recv(1, socket.MSG_PEEK) == b""
+                except BlockingIOError:
+                    closed = False
+                except OSError:
+                    closed = True
+                if closed:
+                    event.set()
+                # 无论是否断开都不再监视，避免对端多发数据时反复唤醒
+                self.unwatch(sock)
+
+
+# =========================
+# 进程隔离：标记的脚本在独立 worker 子进程中执行（同一管道上按 id 多路复用并发调用）
+# =========================
+def _pid_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _pid_cpu_seconds(pid: int) -> float:
+    """进程累计 CPU 秒数（utime + stime），即 RLIMIT_CPU 计量的值"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # comm 字段可能含空格，从最后一个 ")" 之后开始数：utime/stime 为其后第 12、13 个字段
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+class _WorkerProcess:
+    """一个 worker 子进程及其在途调用；进程退出时所有在途调用以错误结束"""
+
+    def __init__(self, script_path: str, logger):
+        env = dict(os.environ, T4_ISOLATED_SCRIPTS="", T4_METRICS_PORT="", T4_TCP_LISTEN="0")
+        for name in ("T4_PID_FILE", "T4_UNIX_SOCKET"):
+            env.pop(name, None)
+        self.logger = logger
+        self.script_path = script_path
+        # 以模块方式导入而非直接运行脚本：可复用 __pycache__ 中的字节码，重启 worker 不必重新编译本文件
+        bootstrap = (f"import sys; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); "
+                     "import t4_daemon; t4_daemon.run_worker()")
+        self.proc = subprocess.Popen([sys.executable, "-c", bootstrap], env=env,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        self.started_at = time.time()
+        self.calls = 0
+        self.killed = ""  # 主动杀掉的原因；为空表示意外退出
+        self._pending: dict[int, Future] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._reader, name=f"t4-worker-{self.proc.pid}", daemon=True).start()
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def submit(self, req: dict) -> tuple:
+        fut = Future()
+        with self._lock:
+            if self.killed:
+                raise ConnectionError(f"isolated worker unavailable: {self.killed}")
+            self._next_id += 1
+            call_id = self._next_id
+            self._pending[call_id] = fut
+            self.calls += 1
+            try:
+                send_packet(self.proc.stdin, {"id": call_id, **req})
+            except (OSError, ValueError) as e:
+                self._pending.pop(call_id, None)
+                raise ConnectionError(f"isolated worker unavailable: {e}")
+        return call_id, fut
+
+    def cancel(self, call_id: int):
+        with self._lock:
+            try:
+                send_packet(self.proc.stdin, {"id": call_id, "cancel": True})
+            except (OSError, ValueError):
+                pass
+
+    def _reader(self):
+        try:
+            while True:
+                resp = pickle.loads(recv_payload(self.proc.stdout))
+                with self._lock:
+                    fut = self._pending.pop(resp.get("id"), None)
+                    self._close_if_drained()
+                if fut is not None:
+                    fut.set_result(resp)
+        except Exception:
+            pass
+        code = self.proc.wait()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        reason = self.killed or f"exit code {code}"
+        if not self.killed:
+            self.logger.warning("Isolated worker for %s exited unexpectedly (%s), %d calls failed",
+                                self.script_path, reason, len(pending))
+        for fut in pending.values():
+            fut.set_result({"result": {"success": False, "error": f"isolated worker terminated: {reason}"}})
+
+    def drain(self):
+        """
+        不再接收新调用；在途调用全部返回后关闭 stdin，worker 随即自行退出。
+        排空期间 stdin 保持打开，取消帧仍能送达。
+        """
+        with self._lock:
+            self.killed = self.killed or "recycled"
+            self._close_if_drained()
+
+    def _close_if_drained(self):
+        # 调用方持有 self._lock：与 submit/cancel 的写入互斥，不会截断正在写出的帧
+        if self.killed and not self._pending:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+
+    def kill(self, reason: str):
+        self.killed = reason
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {"pid": self.proc.pid, "alive": self.alive, "uptime": round(time.time() - self.started_at, 1),
+                "calls": self.calls, "pending": pending, "rss_bytes": _pid_rss(self.proc.pid),
+                "cpu_seconds": round(_pid_cpu_seconds(self.proc.pid), 2)}
+
+
+class IsolatedWorkers:
+    """
+    每个匹配 ISOLATED_SCRIPTS 的脚本独占一个 worker 子进程，调用接口与 SpiderManager.call 相同。
+    - 崩溃/被 RLIMIT_CPU 杀死：在途调用返回错误，下一次调用自动拉起新进程
+    - 调用超过 deadline + WORKER_HANG_GRACE 未返回：视为卡死，杀掉重启
+    - RSS 超过 ISOLATED_RSS_LIMIT，或累计 CPU 接近 ISOLATED_CPU_LIMIT（RLIMIT_CPU 按进程生命周期累计，
+      不回收的话长期运行的 worker 迟早被 SIGXCPU 杀掉并连带在途调用）：新调用转到新进程，旧进程执行完在途调用后退出
+    """
+
+    def __init__(self, patterns: list, logger, telemetry: "DaemonMetrics"):
+        self.patterns = patterns
+        self.logger = logger
+        self.telemetry = telemetry
+        self._workers: dict[str, _WorkerProcess] = {}
+        self._restarts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def matches(self, script_path: str) -> bool:
+        name = os.path.basename(script_path)
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(script_path, p) for p in self.patterns)
+
+    def _worker(self, script_path: str) -> _WorkerProcess:
+        with self._lock:
+            worker = self._workers.get(script_path)
+            if worker is not None and worker.alive and not worker.killed:
+                return worker
+            if worker is not None:
+                self._restarts[script_path] = self._restarts.get(script_path, 0) + 1
+                self.telemetry.incr("worker_restarts")
+            worker = self._workers[script_path] = _WorkerProcess(script_path, self.logger)
+            self.logger.info("Started isolated worker pid=%d for %s", worker.proc.pid, script_path)
+            return worker
+
+    def call(self, script_path: str, method_name: str, env_str: str, args_list, deadline: float | None = None,
+             cancel_event: threading.Event | None = None):
+        req = {"script_path": script_path, "method_name": method_name, "env": env_str, "args": args_list,
+               "deadline": deadline}
+        worker = self._worker(script_path)
+        try:
+            call_id, fut = worker.submit(req)
+        except ConnectionError as e:
+            if worker.alive and not worker.killed:
+                return {"success": False, "error": str(e)}
+            # 取到 worker 后它恰好被回收/杀掉：换新进程重试一次，回收对调用方不可见
+            worker = self._worker(script_path)
+            try:
+                call_id, fut = worker.submit(req)
+            except ConnectionError as e:
+                return {"success": False, "error": str(e)}
+        cancelled = False
+        while True:
+            try:
+                resp = fut.result(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except FutureTimeout:
+                pass
+            if cancel_event is not None and cancel_event.is_set() and not cancelled:
+                cancelled = True
+                worker.cancel(call_id)
+            if deadline is not None and time.time() > deadline + WORKER_HANG_GRACE:
+                self.logger.warning("Isolated worker pid=%d hung on %s.%s, killing", worker.proc.pid,
+                                    script_path, method_name)
+                self.telemetry.incr("worker_kills")
+                worker.kill("call overrun")
+                resp = fut.result()  # 读线程在进程退出后以错误结束所有在途调用
+                break
+        if worker.alive and not worker.killed:
+            reason = self._recycle_reason(worker)
+            if reason:
+                self.logger.warning("Isolated worker pid=%d for %s %s, recycling", worker.proc.pid, script_path,
+                                    reason)
+                self.telemetry.incr("worker_recycles")
+                worker.drain()
+        result = resp.get("result")
+        if resp.get("stream"):
+            result[2] = iter([result[2]])  # worker 已拼接 localProxy 流，恢复为迭代器交给流式回包
+        return result
+
+    @staticmethod
+    def _recycle_reason(worker: _WorkerProcess) -> str:
+        if _pid_rss(worker.proc.pid) > ISOLATED_RSS_LIMIT:
+            return "exceeded RSS limit"
+        if ISOLATED_CPU_LIMIT and _pid_cpu_seconds(worker.proc.pid) >= ISOLATED_CPU_LIMIT * ISOLATED_CPU_RECYCLE:
+            return "is close to CPU time limit"
+        return ""
+
+    def stop(self):
+        with self._lock:
+            workers, self._workers = list(self._workers.values()), {}
+        for worker in workers:
+            worker.kill("daemon stopping")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            workers = dict(self._workers)
+            restarts = dict(self._restarts)
+        return {script: {**w.snapshot(), "restarts": restarts.get(script, 0)} for script, w in workers.items()}
+
+
 # =========================
 # SpiderManager（核心）
 # =========================
@@ -200,22 +1305,37 @@ class SpiderManager:
         # 使用 OrderedDict 实现 LRU：最近使用的移动到末尾，淘汰时 popitem(last=False)
         self._instances: "OrderedDict[str, SpiderInstance]" = OrderedDict()
         self._inflight: dict[str, _InflightInit] = {}
+        # 依赖实例：id(spider) -> 其持有的依赖实例（热重载换下的依赖不在缓存中，仍需按对象归还）；依赖 key -> 创建锁
+        self._held_deps: dict[int, list] = {}
+        self._dep_create_locks: dict[str, threading.Lock] = {}
         # 可重入锁保护此二表与全局统计
         self._lock = threading.RLock()
         # 并发初始化信号量
         self._init_semaphore = threading.Semaphore(MAX_CONCURRENT_INITS)
+        # 调用调度器：实例并发上限 + 全局工作槽 + 公平排队
+        self._scheduler = CallScheduler(MAX_CONCURRENT_CALLS)
+        # 运行指标（延迟直方图/分阶段耗时/命中率等）
+        self.telemetry = DaemonMetrics()
+        # 采样分析（__profile__ 控制）
+        self.profiler = CallProfiler(PROFILE_DIR)
+        # 进程隔离的脚本（T4_ISOLATED_SCRIPTS）转发给各自的 worker 子进程
+        self.isolated = IsolatedWorkers(ISOLATED_SCRIPTS, logger, self.telemetry) if ISOLATED_SCRIPTS else None
         # 估算缓存内存（仅采用 commit 时估算并累加，不做全量深度扫描）
         self._estimated_total_bytes = 0
         # 统计计数（简单）
         self.metrics = {
             "commits": 0,
             "evictions": 0,
+            "reloads": 0,
+            "reload_failures": 0,
             "init_failures": 0,
             "inflight_count": 0,
         }
         self._running = True
         self._cleaner = threading.Thread(target=self._cleanup_loop, daemon=True)
         self._cleaner.start()
+        if HOT_RELOAD_INTERVAL > 0:
+            threading.Thread(target=self._reload_loop, name="t4-hot-reload", daemon=True).start()
 
     # ---------- 后台清理线程：过期实例 ----------
     def _cleanup_loop(self):
@@ -225,17 +1345,132 @@ class SpiderManager:
             to_evict = []
             with self._lock:
                 for k, inst in list(self._instances.items()):
-                    if (now - inst.last_used) > IDLE_EXPIRE:
+                    if (now - inst.last_used) > IDLE_EXPIRE and not inst.refs:
                         to_evict.append(k)
                 for k in to_evict:
                     inst = self._instances.pop(k, None)
                     if inst:
                         self.logger.info("Cleaned idle instance: %s", k[:16])
                         self._evict_instance_resources(k, inst)
+            removed = sweep_shm()
+            if removed:
+                self.logger.info("Removed %d orphaned shm payloads", removed)
+
+    # ---------- 热重载：轮询已缓存脚本的 mtime，后台重建实例后原子替换 ----------
+    def _reload_loop(self):
+        while self._running:
+            time.sleep(HOT_RELOAD_INTERVAL)
+            try:
+                self.check_reload()
+            except Exception as e:
+                self.logger.warning("Hot reload scan failed: %s", e)
+
+    def check_reload(self) -> int:
+        """
+        只 stat 已缓存实例对应的脚本文件（同一文件只 stat 一次），返回本轮重载的实例数。
+        编译、实例化与 init 都在本线程进行，不占用请求路径。
+        """
+        with self._lock:
+            candidates = [(k, inst) for k, inst in self._instances.items() if inst.mtime is not None]
+        mtimes = {}
+        reloaded = 0
+        for key, inst in candidates:
+            path = inst.script_path
+            if path not in mtimes:
+                mtimes[path] = _script_mtime(path)
+            mtime = mtimes[path]
+            if mtime is None or mtime == inst.mtime:
+                continue
+            if inst.dependency:
+                reloaded += self._reload_dependency(key, inst, mtime)
+            elif self._reload_instance(key, inst, mtime):
+                reloaded += 1
+        return reloaded
+
+    def _reload_dependency(self, key: str, old: SpiderInstance, mtime: float | None) -> int:
+        """
+        依赖脚本修改：移出缓存并卸载其模块，随后重建持有它的实例（init 时重新导入依赖）；
+        依赖的依赖方本身也是依赖时递归处理。换下的旧依赖在持有者全部归还后释放。
+        @return: 重建的实例数
+        """
+        with self._lock:
+            if self._instances.get(key) is not old:
+                return 0
+            self._instances.pop(key)
+            self._estimated_total_bytes -= old.estimated_size or 0
+            old.estimated_size = 0
+            old.mtime = mtime
+            sys.modules.pop(old.dependency, None)
+            holders = [(k, inst) for k, inst in self._instances.items()
+                       if any(dep is old for dep in self._held_deps.get(id(inst.spider), ()))]
+            orphan = not old.refs
+        self.logger.info("Dependence changed, reloading: %s (%d holders)", old.dependency, len(holders))
+        importlib.invalidate_caches()
+        if orphan:
+            self._evict_instance_resources(key, old, retired=True)
+        reloaded = 0
+        for holder_key, holder in holders:
+            if holder.dependency:
+                reloaded += self._reload_dependency(holder_key, holder, holder.mtime)
+            elif self._reload_instance(holder_key, holder, _script_mtime(holder.script_path) or holder.mtime):
+                reloaded += 1
+        return reloaded
+
+    def _reload_instance(self, key: str, old: SpiderInstance, mtime: float) -> bool:
+        self.logger.info("Script changed, reloading: %s (%s)", old.script_path, key[:16])
+        try:
+            spider, module_name = self._create_spider(old.script_path, old.env_str)
+        except Exception as e:
+            # 语法错误等：保留旧实例继续服务，记下 mtime 避免每轮重试，文件再次修改时重试
+            old.mtime = mtime
+            self.metrics["reload_failures"] += 1
+            self.logger.error("Hot reload compile failed, keeping old instance: %s", e)
+            return False
+        if not self._init_semaphore.acquire(timeout=INIT_TIMEOUT):
+            self.logger.warning("Hot reload postponed, init resource busy: %s", key[:16])
+            self._discard_spider(spider, module_name)
+            return False
+        try:
+            self._spider_init(spider, old.init_ext, old.script_path)
+        except Exception as e:
+            old.mtime = mtime
+            self.metrics["reload_failures"] += 1
+            self._discard_spider(spider, module_name)
+            self.logger.error("Hot reload init failed, keeping old instance: %s", e)
+            return False
+        finally:
+            self._init_semaphore.release()
+        with self._lock:
+            if self._instances.get(key) is not old:
+                # 重建期间旧实例已被淘汰，新实例不再入缓存
+                self._discard_spider(spider, module_name)
+                return False
+            # 同一 key 直接覆盖：之后的请求拿到新实例，已拿到旧实例的调用照常执行完
+            self._instances.pop(key)
+            self._estimated_total_bytes -= old.estimated_size or 0
+            self._commit_instance(key, spider, module_name, old.script_path, env_str=old.env_str,
+                                  init_ext=old.init_ext, mtime=mtime)
+            self.metrics["reloads"] += 1
+        threading.Thread(target=self._retire_instance, args=(key, old), name="t4-retire", daemon=True).start()
+        return True
+
+    def _retire_instance(self, key: str, inst: SpiderInstance):
+        """等旧实例在途调用结束（最多 RETIRE_TIMEOUT）后释放其资源"""
+        give_up = time.time() + RETIRE_TIMEOUT
+        while inst.active and time.time() < give_up:
+            time.sleep(0.1)
+        if inst.active:
+            self.logger.warning("Retiring %s with %d calls still running", key[:16], inst.active)
+        # 估算字节已在替换时扣除
+        inst.estimated_size = 0
+        self._evict_instance_resources(key, inst, retired=True)
+        self.logger.info("Old instance retired after reload: %s", key[:16])
 
     def stop(self):
         """停止 manager：停止 cleaner，并尝试清理所有实例资源"""
         self._running = False
+        if self.isolated is not None:
+            self.isolated.stop()
         # 清理缓存实例的资源
         with self._lock:
             keys = list(self._instances.keys())
@@ -367,15 +1602,16 @@ class SpiderManager:
             if not hasattr(module, "Spider"):
                 raise AttributeError(f"{script_path} missing class 'Spider'")
             proxy_url, _ = self._parse_env(env_str)
-            self.logger.info(f'_create_spider with t4_api={proxy_url} module={module_name}')
+            self.logger.info("create spider t4_api=%s module=%s", _Field(proxy_url), module_name)
             spider = module.Spider(t4_api=proxy_url)
             return spider, module_name
         except Exception as e:
             self.logger.error("Create Spider failed: %s", e)
             raise
 
-    def _spider_init(self, spider, ext: str):
+    def _spider_init(self, spider, ext: str, script_path: str = "", _chain: tuple = ()):
         """执行 Spider 初始化：setExtendInfo / getDependence / init（耗时、放锁外运行）"""
+        started = time.time()
         try:
             if hasattr(spider, "setExtendInfo"):
                 spider.setExtendInfo(ext)
@@ -383,22 +1619,87 @@ class SpiderManager:
             if hasattr(spider, "getDependence"):
                 depends = spider.getDependence() or []
             modules = []
+            held = []
             for lib in depends:
                 try:
-                    m = importlib.import_module(lib)
-                    if hasattr(m, "Spider"):
-                        modules.append(m.Spider(t4_api=ext))
-                        self.logger.info("Loaded dependence: %s", lib)
+                    dep = self._acquire_dependency(lib, ext, _chain)
+                    held.append(dep)
+                    modules.append(dep.spider)
                 except Exception as e:
                     self.logger.warning("Dependence load failed %s: %s", lib, e)
+            # 先持有新依赖再释放旧依赖（显式 re-init 时），共用的依赖引用计数不会短暂归零
+            self._release_dependencies(spider)
+            if held:
+                with self._lock:
+                    self._held_deps[id(spider)] = held
             if hasattr(spider, "init"):
-                self.logger.info(f"[_spider_init] spider.extend: {getattr(spider, 'extend', None)}")
-                self.logger.info(f"[_spider_init] spider.init({modules})")
+                self.logger.info("spider init extend=%s depends=%d", _Field(getattr(spider, "extend", None)),
+                                 len(modules), extra={"event": "init"})
                 return spider.init(modules)
             return {"status": "no init"}
         except Exception as e:
             self.logger.error("Spider init failed: %s", e)
             raise
+        finally:
+            self.telemetry.observe_phase(script_path, "init", time.time() - started)
+
+    # ---------- 依赖 spider：与顶层实例共用缓存，按 模块名+ext 共享同一个已初始化实例 ----------
+    @staticmethod
+    def _dependency_key(lib: str, ext: str) -> str:
+        return hashlib.sha256(f"dependence|{lib}|{ext}".encode("utf-8")).hexdigest()
+
+    def _acquire_dependency(self, lib: str, ext: str, chain: tuple = ()) -> SpiderInstance:
+        """取得（必要时导入、实例化并 init）依赖实例，引用计数 +1；调用方用 _release_dependencies 归还"""
+        key = self._dependency_key(lib, ext)
+        with self._lock:
+            create_lock = self._dep_create_locks.setdefault(key, threading.Lock())
+        with create_lock:
+            with self._lock:
+                inst = self._instances.get(key)
+                if inst is not None:
+                    inst.refs += 1
+                    inst.last_used = time.time()
+                    self._instances.move_to_end(key, last=True)
+                    self.telemetry.incr("cache_hits")
+                    return inst
+            if lib in chain:
+                raise ImportError(f"circular dependence: {' -> '.join(chain + (lib,))}")
+            self.telemetry.incr("cache_misses")
+            module = importlib.import_module(lib)
+            if not hasattr(module, "Spider"):
+                raise AttributeError(f"{lib} missing class 'Spider'")
+            # 记录依赖脚本文件的 mtime，修改后由热重载重新导入并重建持有它的实例
+            source = getattr(module, "__file__", None) or ""
+            mtime = _script_mtime(source)
+            spider = module.Spider(t4_api=ext)
+            try:
+                self._spider_init(spider, ext, lib, chain + (lib,))
+            except Exception:
+                # 依赖自身 init 失败：归还它已持有的下层依赖，否则这些实例 refs 永不归零、无法淘汰
+                self._release_dependencies(spider)
+                raise
+            self.logger.info("Loaded dependence: %s", lib)
+            inst = self._commit_instance(key, spider, None, source if mtime is not None else lib, refs=1,
+                                         init_ext=ext, mtime=mtime)
+            inst.dependency = lib
+            return inst
+
+    def _release_dependencies(self, spider):
+        """
+        归还 spider 持有的依赖实例；引用归零后按普通实例参与 LRU/空闲淘汰。
+        热重载换下的依赖已不在缓存中，最后一个持有者归还时释放其资源。
+        """
+        retired = []
+        with self._lock:
+            for inst in self._held_deps.pop(id(spider), ()):
+                if inst.refs > 0:
+                    inst.refs -= 1
+                    inst.last_used = time.time()
+                    if not inst.refs and self._instances.get(inst.key) is not inst:
+                        retired.append(inst)
+        for inst in retired:
+            self._evict_instance_resources(inst.key, inst, retired=True)
+            self.logger.info("Old dependence retired after reload: %s", inst.dependency)
 
     # ---------- 内存估算（仅在 commit 时对单个实例计算一次） ----------
     def _estimate_instance_size(self, spider) -> int:
@@ -407,8 +1708,29 @@ class SpiderManager:
         except Exception:
             return int(sys.getsizeof(spider))
 
+    # ---------- 取消实例注册的周期任务（BaseSpider.schedulePeriodic），否则共享调度线程会一直持有该实例 ----------
+    def _cancel_periodic(self, spider, label: str = ""):
+        cancel_periodic = getattr(spider, "cancelPeriodic", None)
+        if cancel_periodic is not None:
+            try:
+                cancel_periodic()
+            except Exception as e:
+                self.logger.warning("Error cancelling periodic tasks for %s: %s", label, e)
+
+    # ---------- 丢弃未入缓存的 spider（init 失败/超时放弃/热重载作废）：归还依赖、取消周期任务、卸载模块 ----------
+    def _discard_spider(self, spider, module_name: str | None = None):
+        self._release_dependencies(spider)
+        self._cancel_periodic(spider, module_name or type(spider).__module__)
+        if module_name and module_name in sys.modules:
+            try:
+                del sys.modules[module_name]
+            except Exception:
+                pass
+
     # ---------- 淘汰单个实例资源（调用 close、卸载模块、调整估算） ----------
-    def _evict_instance_resources(self, key: str, inst: SpiderInstance):
+    def _evict_instance_resources(self, key: str, inst: SpiderInstance, retired: bool = False):
+        self._release_dependencies(inst.spider)
+        self._cancel_periodic(inst.spider, key[:16])
         # 调用 spider.close()（若有），并尝试从 sys.modules 卸载 module_name
         try:
             if hasattr(inst.spider, "close") and callable(inst.spider.close):
@@ -424,7 +1746,11 @@ class SpiderManager:
                 self._estimated_total_bytes -= getattr(inst, "estimated_size", 0) or 0
             except Exception:
                 pass
-            self.metrics["evictions"] += 1
+            if not retired:
+                self.metrics["evictions"] += 1
+        if not retired:
+            # 热重载换下的旧实例与新实例共用 key，调度器队列需保留
+            self._scheduler.forget(key)
         # 尝试卸载模块（若记录 module_name）
         module_name = getattr(inst, "module_name", None)
         if module_name:
@@ -438,20 +1764,29 @@ class SpiderManager:
     # ---------- LRU 淘汰若超过阈值（使用 OrderedDict） ----------
     def _evict_if_needed(self):
         with self._lock:
-            while len(self._instances) > MAX_CACHED_INSTANCES:
-                old_key, old_inst = self._instances.popitem(last=False)  # pop oldest
+            excess = len(self._instances) - MAX_CACHED_INSTANCES
+            if excess <= 0:
+                return
+            # 从最久未用开始淘汰，跳过仍被其它实例依赖的实例
+            victims = [k for k, inst in self._instances.items() if not inst.refs][:excess]
+            for old_key in victims:
+                old_inst = self._instances.pop(old_key)
                 self.logger.info("Evicting LRU instance: %s", old_key[:16])
                 # 清理资源（会做估算减法和 close）
                 self._evict_instance_resources(old_key, old_inst)
 
     # ---------- 将已成功初始化的 spider 放入缓存（统一入口） ----------
-    def _commit_instance(self, key: str, spider, module_name: str | None = None) -> SpiderInstance:
+    def _commit_instance(self, key: str, spider, module_name: str | None = None, script_path: str = "",
+                         refs: int = 0, env_str: str = "", init_ext: str = "",
+                         mtime: float | None = None) -> SpiderInstance:
         """
         commit 只在 init 成功且调用方确认未 timeout 的情况下执行
         - 估算实例大小一次并累加到 _estimated_total_bytes
         - 将实例放入 OrderedDict 的末尾（最近使用）
         """
-        inst = SpiderInstance(spider, module_name)
+        inst = SpiderInstance(spider, module_name, key, script_path)
+        inst.refs = refs
+        inst.env_str, inst.init_ext, inst.mtime = env_str, init_ext, mtime
         # estimate size once
         try:
             size = self._estimate_instance_size(spider)
@@ -474,12 +1809,58 @@ class SpiderManager:
             approx_mem = self._estimated_total_bytes
             self.logger.info(
                 "New Spider instance: %s | cache_count=%d | approx_cache_mem=%s | extend=%s",
-                key[:16], cache_count, _format_bytes(approx_mem), spider.extend
+                key[:16], cache_count, _format_bytes(approx_mem), _Field(getattr(spider, "extend", None))
             )
         return inst
 
     # ---------- 统一调用入口（核心逻辑） ----------
-    def call(self, script_path: str, method_name: str, env_str: str, args_list):
+    def call(self, script_path: str, method_name: str, env_str: str, args_list, deadline: float | None = None,
+             cancel_event: threading.Event | None = None):
+        """统一调用入口：执行调用并记录按脚本/方法的总耗时"""
+        started = time.time()
+        ok = False
+        try:
+            if self.isolated is not None and self.isolated.matches(script_path):
+                result = self.isolated.call(script_path, method_name, env_str, args_list, deadline, cancel_event)
+            else:
+                result = self._call(script_path, method_name, env_str, args_list, deadline, cancel_event)
+            ok = not (isinstance(result, dict) and result.get("success") is False)
+            return result
+        finally:
+            self.telemetry.observe_call(script_path, method_name, time.time() - started, ok)
+
+    def _call_cached(self, inst: SpiderInstance, key: str, method_name: str, env_str: str, ext: str, args_list,
+                     deadline: float | None, cancel_event: threading.Event | None):
+        """缓存命中：显式 init 在实例锁内重新初始化，其它方法经调度器调用"""
+        self.telemetry.incr("cache_hits")
+        inst.last_used = time.time()
+        # 显式 init：再次执行 init（实例级锁串行）
+        if method_name == "init":
+            try:
+                ticket = self._scheduler.acquire(key, inst.script_path, inst.concurrency, deadline, cancel_event)
+            except (TimeoutError, ConnectionAbortedError) as e:
+                return {"success": False, "error": str(e)}
+            try:
+                with inst.lock:
+                    try:
+                        init_ext = (args_list[0] if args_list else ext) or ""
+                        self.logger.info("re-init ext=%s env=%s", _Field(init_ext), _Field(env_str),
+                                         extra={"event": "init"})
+                        # init 由实例自身的 lock 串行保护（锁外 init 操作）
+                        ret = self._spider_init(inst.spider, init_ext, inst.script_path)
+                        inst.last_used = time.time()
+                        inst.init_ext = init_ext
+                        return ret
+                    except Exception as e:
+                        self.metrics["init_failures"] += 1
+                        return {"success": False, "error": str(e), "traceback": traceback.format_exc()}
+            finally:
+                self._scheduler.release(ticket)
+        # 其它方法：直接调用
+        return self._invoke(inst, method_name, args_list, deadline, cancel_event)
+
+    def _call(self, script_path: str, method_name: str, env_str: str, args_list, deadline: float | None = None,
+              cancel_event: threading.Event | None = None):
         """
         高级流程：
         1) 尝试缓存命中（key 级别）
@@ -488,9 +1869,11 @@ class SpiderManager:
            - 如果 method == "init": 当前线程同步执行 init（会受并发限制）
            - 否则：在后台线程执行 init（会受并发限制），当前线程等待 event（带超时）
         4) init 成功且未超时则 commit；否则返回错误。后台线程在完成后会清理 inflight 并 set event。
+        5) 对已缓存实例的调用经调度器排队，deadline 前拿不到执行槽或客户端已断开则放弃；
+           deadline/cancel_event 会传给 spider，fetch/post 据此收紧超时或提前中止
         """
         _, ext = self._parse_env(env_str)
-        self.logger.info(f'call method:{method_name} with args_list:{args_list}')
+        self.logger.info("call method=%s args=%s", method_name, _Field(args_list), extra={"event": "call"})
         key = self._instance_key(script_path, env_str)
 
         # -------- A. 尝试缓存命中（短临界区） --------
@@ -502,25 +1885,15 @@ class SpiderManager:
                     self._instances.move_to_end(key, last=True)
                 except Exception:
                     pass
+                # 在途计数：热重载换下旧实例后，等其归零再释放旧实例资源
+                inst.active += 1
 
         if inst:
-            inst.last_used = time.time()
-            # 显式 init：再次执行 init（实例级锁串行）
-            if method_name == "init":
-                with inst.lock:
-                    try:
-                        init_ext = (args_list[0] if args_list else ext) or ""
-                        self.logger.info(f'call init with ext:{init_ext}, env:{env_str}')
-                        # init 由实例自身的 lock 串行保护（锁外 init 操作）
-                        ret = self._spider_init(inst.spider, init_ext)
-                        print('self._spider_init: 482')
-                        inst.last_used = time.time()
-                        return ret
-                    except Exception as e:
-                        self.metrics["init_failures"] += 1
-                        return {"success": False, "error": str(e), "traceback": traceback.format_exc()}
-            # 其它方法：直接调用
-            return self._invoke(inst, method_name, args_list)
+            try:
+                return self._call_cached(inst, key, method_name, env_str, ext, args_list, deadline, cancel_event)
+            finally:
+                with self._lock:
+                    inst.active -= 1
 
         # -------- B. 未命中缓存：inflight 占位协调（短临界区） --------
         created_by_me = False
@@ -531,14 +1904,17 @@ class SpiderManager:
                 spider = None
                 module_name = None
                 try:
+                    # 先取 mtime 再导入：导入期间文件又被修改时，热重载仍能发现
+                    mtime = _script_mtime(script_path)
                     spider, module_name = self._create_spider(script_path, env_str)
                 except Exception as e:
                     self.logger.error("Failed to create spider object: %s", e)
                     return {"success": False, "error": str(e), "traceback": traceback.format_exc()}
-                inflight = _InflightInit(spider, module_name)
+                inflight = _InflightInit(spider, module_name, mtime)
                 self._inflight[key] = inflight
                 created_by_me = True
                 self.metrics["inflight_count"] = len(self._inflight)
+        self.telemetry.incr("cache_misses" if created_by_me else "cache_waits")
 
         # -------- C. 由创建者决定同步/异步 init（均在锁外运行） --------
         if created_by_me:
@@ -555,28 +1931,24 @@ class SpiderManager:
                         self.metrics["inflight_count"] = len(self._inflight)
                     inflight.error = "init resource busy"
                     inflight.event.set()
+                    self._discard_spider(spider, module_name)
                     self.metrics["init_failures"] += 1
                     return {"success": False, "error": "init resource busy"}
                 try:
                     try:
                         init_ext = (args_list[0] if args_list else ext) or ""
-                        self.logger.info(f'[created_by_me] sync init_ext:{init_ext}')
-                        ret = self._spider_init(spider, init_ext)
-                        print('self._spider_init: 531')
+                        self.logger.info("sync init ext=%s", _Field(init_ext), extra={"event": "init"})
+                        ret = self._spider_init(spider, init_ext, script_path)
                         # commit 成功（只要 inflight 未被主线程取消）
                         with self._lock:
                             # it's possible that inflight.timed_out was set by waiters; check it
                             if not inflight.timed_out:
-                                inst = self._commit_instance(key, spider, module_name)
+                                inst = self._commit_instance(key, spider, module_name, script_path, env_str=env_str,
+                                                             init_ext=init_ext, mtime=inflight.mtime)
                             else:
                                 # cancel commit and cleanup module if needed
                                 self.logger.info("Init finished but inflight was timed out; discarding instance")
-                                # attempt to unload module if any
-                                if module_name and module_name in sys.modules:
-                                    try:
-                                        del sys.modules[module_name]
-                                    except Exception:
-                                        pass
+                                self._discard_spider(spider, module_name)
                         # 清理 inflight 并通知等待者
                         with self._lock:
                             self._inflight.pop(key, None)
@@ -585,6 +1957,7 @@ class SpiderManager:
                         return ret
                     except Exception as e:
                         inflight.error = str(e)
+                        self._discard_spider(spider, module_name)
                         with self._lock:
                             self._inflight.pop(key, None)
                             self.metrics["inflight_count"] = len(self._inflight)
@@ -606,24 +1979,26 @@ class SpiderManager:
                         if not acquired:
                             inflight.error = "init resource busy"
                             self.logger.warning("bg init cannot acquire semaphore for key %s", key[:16])
+                            self._discard_spider(spider, module_name)
+                            with self._lock:
+                                self._inflight.pop(key, None)
+                                self.metrics["inflight_count"] = len(self._inflight)
+                            inflight.event.set()
                             return
                         try:
-                            self._spider_init(spider, ext)
-                            print('self._spider_init: 576')
+                            self._spider_init(spider, ext, script_path)
                             # commit only if not timed out/abandoned
                             with self._lock:
                                 if not inflight.timed_out:
-                                    self._commit_instance(key, spider, module_name)
+                                    self._commit_instance(key, spider, module_name, script_path, env_str=env_str,
+                                                          init_ext=ext, mtime=inflight.mtime)
                                 else:
                                     # timed out: discard module if any
                                     self.logger.info("bg init finished but inflight was timed out; discarding")
-                                    if module_name and module_name in sys.modules:
-                                        try:
-                                            del sys.modules[module_name]
-                                        except Exception:
-                                            pass
+                                    self._discard_spider(spider, module_name)
                         except Exception as e:
                             inflight.error = str(e)
+                            self._discard_spider(spider, module_name)
                             self.metrics["init_failures"] += 1
                         finally:
                             # ensure inflight is removed and event set (safe pop)
@@ -641,7 +2016,13 @@ class SpiderManager:
                 threading.Thread(target=_bg_init, daemon=True).start()
 
         # -------- D. 等待 init 完成或超时（对创建者与非创建者统一） --------
-        finished = inflight.event.wait(INIT_TIMEOUT)
+        # 请求 deadline 早于 INIT_TIMEOUT 时只放弃本次等待，init 继续在后台完成并入缓存
+        wait_timeout = INIT_TIMEOUT
+        if deadline is not None:
+            wait_timeout = min(INIT_TIMEOUT, max(0.0, deadline - time.time()))
+        finished = inflight.event.wait(wait_timeout)
+        if not finished and wait_timeout < INIT_TIMEOUT:
+            return {"success": False, "error": "call deadline exceeded while waiting for init"}
         if not finished:
             # 超时：标记 inflight 为 timed_out 并移除（防止 bg 后续 commit）
             with self._lock:
@@ -663,14 +2044,22 @@ class SpiderManager:
                     self._instances.move_to_end(key, last=True)
                 except Exception:
                     pass
+                if method_name != "init":
+                    # 与缓存命中路径相同：计入在途，热重载换下该实例时等待本次调用结束
+                    inst2.active += 1
         if not inst2:
             return {"success": False, "error": "init completed but instance missing"}
         if method_name == "init":
             return {"status": "already initialized"}
-        return self._invoke(inst2, method_name, args_list)
+        try:
+            return self._invoke(inst2, method_name, args_list, deadline, cancel_event)
+        finally:
+            with self._lock:
+                inst2.active -= 1
 
     # ---------- 调用 Spider 方法（对实例的真实调用入口） ----------
-    def _invoke(self, inst: SpiderInstance, method_name: str, args_list):
+    def _invoke(self, inst: SpiderInstance, method_name: str, args_list, deadline: float | None = None,
+                cancel_event: threading.Event | None = None):
         # 解析 args
         parsed_args = []
         for a in (args_list or []):
@@ -689,74 +2078,531 @@ class SpiderManager:
         if not hasattr(inst.spider, invoke):
             return {"success": False, "error": f"Spider missing method '{invoke}'"}
 
+        # 排队等待执行槽（实例并发上限 + 全局上限）
+        try:
+            ticket = self._scheduler.acquire(inst.key, inst.script_path, inst.concurrency, deadline, cancel_event)
+        except (TimeoutError, ConnectionAbortedError) as e:
+            self.logger.warning("Call '%s' dropped: %s", invoke, e)
+            return {"success": False, "error": str(e)}
+        self.telemetry.observe_phase(inst.script_path, "queue", ticket.granted_at - ticket.enqueued_at)
+        # 拿到执行槽时 deadline 已过，客户端不会再读取结果
+        if deadline is not None and time.time() >= deadline:
+            self._scheduler.release(ticket)
+            self.logger.warning("Call '%s' dropped: deadline exceeded before start", invoke)
+            return {"success": False, "error": "call deadline exceeded"}
+
+        set_ctx = getattr(inst.spider, "setCallContext", None)
+
         try:
             inst.last_used = time.time()
             # move to end (recently used)
             with self._lock:
-                try:
-                    # find key and move to end; using search since OrderedDict keyed by key externally
-                    for k, v in self._instances.items():
-                        if v is inst:
-                            self._instances.move_to_end(k, last=True)
-                            break
-                except Exception:
-                    pass
+                if self._instances.get(inst.key) is inst:
+                    self._instances.move_to_end(inst.key, last=True)
             # self.logger.info('invoke method %s with extend: %s' % (invoke, inst.spider.extend))
             # self.logger.info('invoke method %s with host: %s' % (invoke, inst.spider.host))
             # self.logger.info('invoke method %s with parsed_args: %s' % (invoke, parsed_args))
-            result = getattr(inst.spider, invoke)(*parsed_args)
+            if set_ctx is not None:
+                set_ctx(deadline, cancel_event)
+            started = time.time()
+            with self.profiler.profile(inst.script_path, method_name, invoke):
+                result = getattr(inst.spider, invoke)(*parsed_args)
+            finished = time.time()
+            self.telemetry.observe_phase(inst.script_path, "invoke", finished - started)
             # self.logger.info('result:%s' % result)
+            if is_stream_result(result):
+                return result
             if result is not None and hasattr(inst.spider, "json2str"):
                 try:
                     return inst.spider.json2str(result)
                 except Exception:
                     return result
+                finally:
+                    self.telemetry.observe_phase(inst.script_path, "serialize", time.time() - finished)
             return result
         except Exception as e:
             self.logger.error("Call '%s' failed: %s", invoke, e)
             return {"success": False, "error": str(e), "traceback": traceback.format_exc()}
+        finally:
+            if set_ctx is not None:
+                set_ctx(None, None)
+            self._scheduler.release(ticket)
 
     # ---------- 仅供监控/运维查看 ----------
     def stats(self):
         with self._lock:
-            return {
+            stats = {
                 "cache_count": len(self._instances),
                 "estimated_bytes": self._estimated_total_bytes,
                 "inflight_count": len(self._inflight),
                 **self.metrics
             }
+            instances = list(self._instances.items())
+        stats["scheduler"] = self._scheduler.snapshot()
+        # 各实例自行上报的内部状态内存（BaseSpider.getMemoryStats）
+        stats["instances"] = {
+            key[:16]: {
+                "script": inst.script_path,
+                "estimated_bytes": inst.estimated_size,
+                "refs": inst.refs,
+                "state": self._spider_memory_stats(inst.spider),
+            }
+            for key, inst in instances
+        }
+        if self.isolated is not None:
+            stats["isolated"] = self.isolated.snapshot()
+        return stats
+
+    def _spider_memory_stats(self, spider) -> dict:
+        fn = getattr(spider, "getMemoryStats", None)
+        if fn is None:
+            return {}
+        try:
+            return fn() or {}
+        except Exception as e:
+            self.logger.debug("getMemoryStats failed: %s", e)
+            return {}
 
 
 # =========================
 # Server RPC 层（保持协议兼容）
 # =========================
 _manager = SpiderManager(logger)
+_watcher = DisconnectWatcher()
+_batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="t4-batch")
+# multi_search 单独使用线程池：batch 占满 _batch_pool 时聚合搜索的扇出不会排在其后
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="t4-search")
+
+
+def _request_deadline(req: dict) -> float:
+    """
+    客户端在请求中携带 deadline（unix 秒）；未携带时按 REQUEST_TIMEOUT 推算。
+    客户端在 deadline 后会断开连接，超过该时间仍在排队或执行的调用没有意义；
+    预留 DEADLINE_MARGIN 以便超时错误能在客户端放弃前送达。
+    """
+    try:
+        deadline = float(req.get("deadline") or 0)
+    except (TypeError, ValueError):
+        deadline = 0
+    if deadline <= 0:
+        deadline = time.time() + REQUEST_TIMEOUT
+    return deadline - DEADLINE_MARGIN
+
+
+# =========================
+# 控制方法：不进入 spider，由守护进程自身处理（method_name 以双下划线包裹）
+# =========================
+def _ctl_stats(args):
+    """__stats__：默认返回 dict；args[0] == "prometheus" 时返回 Prometheus 文本"""
+    manager_stats = _manager.stats()
+    if args and str(args[0]).lower() == "prometheus":
+        return _manager.telemetry.render_prometheus(manager_stats)
+    stats = {"manager": manager_stats, "metrics": _manager.telemetry.snapshot(), "search": _search_budget.snapshot(),
+             "process": _process_stats()}
+    fixtures = sys.modules.get("base.fixtures")  # 由 spider 导入 base.spider 时加载
+    if fixtures is not None and fixtures.stats()["mode"]:
+        stats["http_fixtures"] = fixtures.stats()
+    jvm = sys.modules.get("base.jvm")  # jar 类 spider 经 base_java_loader 加载
+    if jvm is not None and jvm.jvm_host.started:
+        stats["jvm"] = jvm.jvm_host.snapshot()
+    return stats
+
+
+def _process_stats() -> dict:
+    """守护进程自身的 RSS/线程数（基准工具据此对比内存占用）"""
+    stats = {"pid": os.getpid(), "threads": threading.active_count()}
+    try:
+        with open("/proc/self/statm") as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Linux 上 ru_maxrss 单位为 KiB
+        stats["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    return stats
+
+
+def _ctl_profile(args):
+    """
+    __profile__：args[0] 为 start/stop/status；start 时 args[1] 为选项 dict：
+    mode(cprofile|stack) / script(脚本名或路径) / method / percent / interval / duration
+    """
+    action = str(args[0]).lower() if args else "status"
+    if action == "start":
+        options = args[1] if len(args) > 1 and isinstance(args[1], dict) else {}
+        return _manager.profiler.start(**options)
+    if action == "stop":
+        return _manager.profiler.stop()
+    return _manager.profiler.status()
+
+
+CONTROL_METHODS = {
+    "__stats__": _ctl_stats,
+    "__profile__": _ctl_profile,
+}
+
+
+def build_response(result) -> dict:
+    """统一外层返回格式：spider 返回 {"success": False, "error": ...} 时转为错误响应"""
+    failed = isinstance(result, dict) and result.get("success") is False
+    resp = {
+        "success": not (failed and "error" in result),
+        "result": None if failed else result,
+    }
+    if failed:
+        # 为避免泄露过多内部信息，默认只返回 error 字段；如果需要调试，可打开日志
+        resp["error"] = result.get("error")
+        if result.get("traceback"):
+            # 在非调试模式下，不把 traceback 返回给客户端（但保留日志）
+            resp["traceback"] = result.get("traceback")
+    return resp
+
+
+def run_batch(wfile, entries: list, deadline: float, cancel_event: threading.Event, shm: bool = False) -> dict:
+    """
+    batch 请求：各条目并发执行，哪个先完成就先回传哪个（每条一个包，带 index），
+    batch deadline 到达后取消未完成条目并逐条回错误，最后发送 {"batch_done": True, ...} 结束包。
+    条目内 localProxy 流式结果会拼接为完整 bytes（batch 不嵌套流式帧）。
+    """
+    telemetry = _manager.telemetry
+    done = queue.Queue()
+
+    def _run(index: int, entry: dict):
+        started = time.time()
+        try:
+            entry_deadline = min(deadline, _request_deadline(entry)) if entry.get("deadline") else deadline
+            result = _manager.call(entry.get("script_path", ""), entry.get("method_name", ""),
+                                   entry.get("env", "") or "", entry.get("args", []) or [],
+                                   entry_deadline, cancel_event)
+            if is_stream_result(result):
+                result = list(result)
+                result[2] = join_chunks(result[2])
+            resp = build_response(result)
+        except Exception as e:
+            resp = {"success": False, "result": None, "error": str(e)}
+        resp["index"] = index
+        resp["elapsed"] = round(time.time() - started, 4)
+        done.put(resp)
+
+    for index, entry in enumerate(entries):
+        _batch_pool.submit(_run, index, entry if isinstance(entry, dict) else {})
+    telemetry.incr("batch_entries", len(entries))
+
+    pending = set(range(len(entries)))
+    while pending and not cancel_event.is_set():
+        try:
+            resp = done.get(timeout=max(0.0, min(deadline - time.time(), CANCEL_POLL_INTERVAL * 5)))
+        except queue.Empty:
+            if time.time() >= deadline:
+                break
+            continue
+        pending.discard(resp["index"])
+        sent, shm_bytes = send_response(wfile, resp, shm=shm)
+        telemetry.incr("bytes_out", sent)
+        if shm_bytes:
+            telemetry.incr("shm_bytes", shm_bytes)
+    summary = {"batch_done": True, "count": len(entries), "completed": len(entries) - len(pending),
+               "timed_out": sorted(pending)}
+    if cancel_event.is_set():
+        # 客户端已断开，剩余条目由 cancel_event 中止，无需再回包
+        telemetry.incr("client_gone")
+        return summary
+    # 到期：通知仍在排队/执行的条目放弃（fetch/post 会提前中止）
+    cancel_event.set()
+    for index in sorted(pending):
+        telemetry.incr("bytes_out", send_packet(wfile, {"success": False, "result": None, "index": index,
+                                                         "error": "batch deadline exceeded"}))
+    telemetry.incr("bytes_out", send_packet(wfile, summary))
+    return summary
+
+
+# =========================
+# 聚合搜索：multi_search 请求（有界并发扇出 + 去重排序 + 软截止/命中数提前返回）
+# =========================
+class SearchBudget:
+    """
+    按源学习 searchContent 耗时（EWMA 均值与方差），超时按截止时刻的耗时计入（偏低的删失值）。
+    预估耗时（均值 + 2 倍标准差）超过本次剩余预算的源直接跳过，每跳过 SEARCH_PROBE_EVERY 次放行一次探测。
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict] = {}
+
+    def observe(self, script_path: str, seconds: float, ok: bool = True):
+        with self._lock:
+            st = self._stats.get(script_path)
+            if st is None:
+                self._stats[script_path] = {"mean": seconds, "var": 0.0, "samples": 1, "timeouts": int(not ok),
+                                            "skipped": 0}
+                return
+            diff = seconds - st["mean"]
+            st["mean"] += self.alpha * diff
+            st["var"] = (1 - self.alpha) * (st["var"] + self.alpha * diff * diff)
+            st["samples"] += 1
+            st["timeouts"] += int(not ok)
+
+    def expected(self, script_path: str) -> float | None:
+        st = self._stats.get(script_path)
+        if st is None or st["samples"] < SEARCH_MIN_SAMPLES:
+            return None
+        return st["mean"] + 2 * st["var"] ** 0.5
+
+    def should_skip(self, script_path: str, budget: float) -> bool:
+        expected = self.expected(script_path)
+        if expected is None or expected <= budget:
+            return False
+        with self._lock:
+            st = self._stats[script_path]
+            st["skipped"] += 1
+            return st["skipped"] % SEARCH_PROBE_EVERY != 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                _script_label(path): {"mean": round(st["mean"], 4), "std": round(st["var"] ** 0.5, 4),
+                                      "samples": st["samples"], "timeouts": st["timeouts"], "skipped": st["skipped"]}
+                for path, st in self._stats.items()
+            }
+
+
+_search_budget = SearchBudget()
+
+_NAME_STRIP = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_vod_name(name) -> str:
+    """去重用的片名归一化：全角转半角、小写、去掉空白与标点"""
+    return _NAME_STRIP.sub("", unicodedata.normalize("NFKC", str(name or "")).lower())
+
+
+def _match_rank(norm_name: str, norm_wd: str) -> int:
+    if not norm_wd:
+        return 0
+    if norm_name == norm_wd:
+        return 3
+    if norm_name.startswith(norm_wd):
+        return 2
+    return 1 if norm_wd in norm_name else 0
+
+
+def _search_list(result) -> list:
+    if isinstance(result, str):
+        try:
+            result = ujson.loads(result)
+        except Exception:
+            return []
+    items = result.get("list") if isinstance(result, dict) else None
+    return [it for it in items if isinstance(it, dict)] if isinstance(items, list) else []
+
+
+def multi_search(spec: dict, deadline: float, cancel_event: threading.Event) -> dict:
+    """
+    对 spec["sources"]（[{script_path, env}, ...]）并发调用 searchContent(wd, quick, pg)：
+    - 同时最多 parallel 个源在执行，完成一个补一个
+    - 按归一化 vod_name 去重，合并各源的 vod_id；按匹配程度、来源数、到达先后排序
+    - 到达软截止（soft_deadline 秒，且不超过请求 deadline）或匹配命中数达到 max_hits 时返回已有结果，取消其余源
+    - 历史上通常慢于剩余预算的源直接跳过（SearchBudget）
+    """
+    started = time.time()
+    wd = str(spec.get("wd") or "")
+    args = [wd, spec.get("quick", False), str(spec.get("pg") or "1")]
+    sources = [src for src in (spec.get("sources") or []) if isinstance(src, dict) and src.get("script_path")]
+    parallel = max(1, int(spec.get("parallel") or SEARCH_PARALLEL))
+    max_hits = int(spec.get("max_hits") or 0)
+    soft_deadline = min(deadline, started + float(spec.get("soft_deadline") or SEARCH_SOFT_DEADLINE))
+    norm_wd = normalize_vod_name(wd)
+
+    report: dict[str, dict] = {}
+    merged: "OrderedDict[str, dict]" = OrderedDict()
+    done = queue.Queue()
+
+    def _name(index: int) -> str:
+        src = sources[index]
+        return src.get("name") or _script_label(src["script_path"])
+
+    def _run(index: int):
+        src = sources[index]
+        t0 = time.time()
+        try:
+            result = _manager.call(src["script_path"], "search", src.get("env", "") or "", args, deadline,
+                                   cancel_event)
+            failed = isinstance(result, dict) and result.get("success") is False
+            done.put((index, time.time() - t0, None if failed else _search_list(result),
+                      result.get("error") if failed else None))
+        except Exception as e:
+            done.put((index, time.time() - t0, None, str(e)))
+
+    waiting = list(range(len(sources)))
+    running = set()
+    launched_at = {}
+    hits = 0
+    while (waiting or running) and not cancel_event.is_set():
+        now = time.time()
+        if now >= soft_deadline or (max_hits and hits >= max_hits):
+            break
+        while waiting and len(running) < parallel:
+            index = waiting.pop(0)
+            path = sources[index]["script_path"]
+            if _search_budget.should_skip(path, soft_deadline - now):
+                report[_name(index)] = {"status": "skipped", "expected": round(_search_budget.expected(path), 3)}
+                continue
+            running.add(index)
+            launched_at[index] = now
+            _search_pool.submit(_run, index)
+        if not running:
+            continue
+        try:
+            index, elapsed, items, error = done.get(timeout=max(0.0, min(soft_deadline - time.time(), 1.0)))
+        except queue.Empty:
+            continue
+        path = sources[index]["script_path"]
+        running.discard(index)
+        _search_budget.observe(path, elapsed, ok=error is None)
+        if error is not None:
+            report[_name(index)] = {"status": "error", "elapsed": round(elapsed, 3), "error": error}
+            continue
+        report[_name(index)] = {"status": "ok", "elapsed": round(elapsed, 3), "count": len(items)}
+        for item in items:
+            norm = normalize_vod_name(item.get("vod_name"))
+            if not norm:
+                continue
+            entry = merged.get(norm)
+            if entry is None:
+                rank = _match_rank(norm, norm_wd)
+                merged[norm] = entry = dict(item, sources=[], _rank=rank)
+                hits += rank > 0
+            entry["sources"].append({"source": _name(index), "script_path": path, "vod_id": item.get("vod_id")})
+
+    # 提前返回：未完成的源通过 cancel_event 让其排队/请求尽快放弃；
+    # 因软截止中断的按已耗时计入历史，因命中数已够中断的不计（并非源慢）
+    finished = time.time()
+    enough_hits = bool(max_hits and hits >= max_hits)
+    for index in running:
+        elapsed = finished - launched_at[index]
+        if not enough_hits:
+            _search_budget.observe(sources[index]["script_path"], elapsed, ok=False)
+        report[_name(index)] = {"status": "cancelled" if enough_hits else "timeout", "elapsed": round(elapsed, 3)}
+    for index in waiting:
+        report.setdefault(_name(index), {"status": "not_started"})
+    cancel_event.set()
+
+    order = {key: i for i, key in enumerate(merged)}
+    ranked = sorted(merged.items(), key=lambda kv: (-kv[1]["_rank"], -len(kv[1]["sources"]), order[kv[0]]))
+    result_list = []
+    for _, entry in ranked:
+        entry.pop("_rank", None)
+        result_list.append(entry)
+    return {
+        "list": result_list,
+        "total": len(result_list),
+        "partial": bool(running or waiting),
+        "elapsed": round(finished - started, 3),
+        "sources": report,
+    }
+
+
+def start_metrics_server(host: str, port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # 仅开启 /metrics 时导入
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        """可选的 /metrics 监听（T4_METRICS_PORT），供 Prometheus 抓取"""
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = _ctl_stats(["prometheus"]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="t4-metrics", daemon=True).start()
+    logger.info("Metrics endpoint listening on http://%s:%d/metrics", host, port)
+    return server
 
 
 class T4Handler(StreamRequestHandler):
     def handle(self):
         self.request.settimeout(REQUEST_TIMEOUT)
+        telemetry = _manager.telemetry
+        telemetry.gauge_add("connections", 1)
+        try:
+            self._handle(telemetry)
+        finally:
+            telemetry.gauge_add("connections", -1)
+
+    def _handle(self, telemetry: DaemonMetrics):
         try:
-            req = recv_packet(self.rfile)
+            payload = recv_payload(self.rfile)
+            telemetry.incr("bytes_in", len(payload) + 4)
+            telemetry.incr("requests")
+            req = decode_payload(payload)
+            if "batch" in req:
+                self._handle_batch(req, telemetry)
+                return
+            if "multi_search" in req:
+                self._handle_multi_search(req, telemetry)
+                return
             script_path = req.get("script_path", "")
             method_name = req.get("method_name", "")
             env = req.get("env", "") or ""
             args = req.get("args", []) or []
-            logger.info("T4Handler start: script_path:%s method_name:%s", script_path, method_name)
-            result = _manager.call(script_path, method_name, env, args)
+            logger.info("request script=%s method=%s", script_path, method_name, extra={"event": "request"})
+            if method_name in CONTROL_METHODS:
+                try:
+                    resp = {"success": True, "result": CONTROL_METHODS[method_name](args)}
+                except Exception as e:
+                    resp = {"success": False, "result": None, "error": str(e)}
+                telemetry.incr("bytes_out", send_packet(self.wfile, resp))
+                return
+            deadline = _request_deadline(req)
+            cancel_event = _watcher.watch(self.request)
+            telemetry.gauge_add("inflight_calls", 1)
+            try:
+                result = _manager.call(script_path, method_name, env, args, deadline, cancel_event)
+            finally:
+                telemetry.gauge_add("inflight_calls", -1)
+                _watcher.unwatch(self.request)
+            if cancel_event.is_set():
+                # 客户端已断开（通常是超时放弃），结果无人读取
+                telemetry.incr("client_gone")
+                logger.warning("Client gone before response: script_path:%s method_name:%s", script_path, method_name)
+                return
             # 统一外层返回格式
-            resp = {
-                "success": not (isinstance(result, dict) and result.get("success") is False and "error" in result),
-                "result": result if not (isinstance(result, dict) and result.get("success") is False) else None,
-            }
-            if isinstance(result, dict) and result.get("success") is False:
-                # 为避免泄露过多内部信息，默认只返回 error 字段；如果需要调试，可打开日志
-                resp["error"] = result.get("error")
-                if result.get("traceback"):
-                    # 在非调试模式下，不把 traceback 返回给客户端（但保留日志）
-                    resp["traceback"] = result.get("traceback")
-
-            send_packet(self.wfile, resp)
+            resp = build_response(result)
+
+            if is_stream_result(result):
+                head = list(result)
+                chunks, head[2] = head[2], None
+                if req.get("stream"):
+                    resp["result"], resp["stream"] = head, True
+                    try:
+                        telemetry.incr("bytes_out", send_stream(self.wfile, resp, chunks))
+                    except Exception as e:
+                        # 头包已发出，无法再回错误包；直接断开，客户端按流中断处理
+                        logger.warning("Stream aborted: script_path:%s method_name:%s: %s", script_path, method_name, e)
+                    return
+                head[2] = join_chunks(chunks)
+                resp["result"] = head
+
+            started = time.time()
+            sent, shm_bytes = send_response(self.wfile, resp, shm=bool(req.get("shm")))
+            telemetry.incr("bytes_out", sent)
+            if shm_bytes:
+                telemetry.incr("shm_bytes", shm_bytes)
+            telemetry.observe_phase(script_path, "send", time.time() - started)
         except Exception as e:
             if "peer closed during read" in str(e).lower():
                 logger.warning("Client connected then closed without sending data")
@@ -768,17 +2614,69 @@ class T4Handler(StreamRequestHandler):
                 pass  # 对端已断开
 
 
+    def _handle_batch(self, req: dict, telemetry: DaemonMetrics):
+        entries = req.get("batch") or []
+        if not isinstance(entries, list) or len(entries) > BATCH_MAX_ENTRIES:
+            raise ValueError(f"batch must be a list of at most {BATCH_MAX_ENTRIES} entries")
+        logger.info("request batch entries=%d", len(entries), extra={"event": "request"})
+        cancel_event = _watcher.watch(self.request)
+        telemetry.gauge_add("inflight_calls", 1)
+        try:
+            summary = run_batch(self.wfile, entries, _request_deadline(req), cancel_event, bool(req.get("shm")))
+        finally:
+            telemetry.gauge_add("inflight_calls", -1)
+            _watcher.unwatch(self.request)
+        if summary["timed_out"]:
+            logger.warning("Batch deadline exceeded: %d/%d entries unfinished", len(summary["timed_out"]),
+                           summary["count"])
+
+
+    def _handle_multi_search(self, req: dict, telemetry: DaemonMetrics):
+        spec = req.get("multi_search") or {}
+        if not isinstance(spec, dict):
+            raise ValueError("multi_search must be an object")
+        logger.info("request multi_search wd=%s sources=%d", _Field(spec.get("wd")), len(spec.get("sources") or []),
+                    extra={"event": "request"})
+        cancel_event = _watcher.watch(self.request)
+        telemetry.gauge_add("inflight_calls", 1)
+        try:
+            result = multi_search(spec, _request_deadline(req), cancel_event)
+        finally:
+            telemetry.gauge_add("inflight_calls", -1)
+            _watcher.unwatch(self.request)
+        sent, shm_bytes = send_response(self.wfile, {"success": True, "result": result}, shm=bool(req.get("shm")))
+        telemetry.incr("bytes_out", sent)
+        if shm_bytes:
+            telemetry.incr("shm_bytes", shm_bytes)
+
+
 class ThreadedTCPServer(ThreadingMixIn, TCPServer):
     daemon_threads = True
     allow_reuse_address = True
 
 
+class ThreadedUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # 上次异常退出残留的套接字文件会导致 bind 失败
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        _unlink_quiet(self.server_address)
+
+
 def run():
     def _stop(*_):
         logger.info("Stopping server ...")
         _manager.stop()
         # 让 serve_forever() 退出
-        srv.shutdown()
+        for server in servers:
+            threading.Thread(target=server.shutdown, daemon=True).start()
         logger.info("The service has successfully exited")
         sys.exit(0)  # 保证退出码是 0
 
@@ -787,14 +2685,100 @@ def run():
         signal.signal(signal.SIGINT, _stop)
 
     global srv
-    srv = ThreadedTCPServer((HOST, PORT), T4Handler)
-    logger.info("T4 daemon listening on %s:%d", HOST, PORT)
+    servers = []
+    if UNIX_SOCKET and hasattr(socket, "AF_UNIX"):
+        servers.append(ThreadedUnixServer(UNIX_SOCKET, T4Handler))
+        logger.info("T4 daemon listening on unix:%s", UNIX_SOCKET)
+    if TCP_LISTEN or not servers:
+        servers.append(ThreadedTCPServer((HOST, PORT), T4Handler))
+        logger.info("T4 daemon listening on %s:%d", HOST, PORT)
+    srv = servers[-1]
+    sweep_shm(0)
+    if METRICS_PORT:
+        start_metrics_server(HOST, METRICS_PORT)
+    # 主线程服务最后一个监听，其余监听各起一个线程
+    for server in servers[:-1]:
+        threading.Thread(target=server.serve_forever, args=(0.5,), name="t4-listener", daemon=True).start()
     try:
         srv.serve_forever(poll_interval=0.5)
     finally:
-        srv.server_close()
+        for server in servers:
+            server.server_close()
         logger.info("Server closed.")
 
 
+
+# =========================
+# 隔离 worker 子进程入口（由 IsolatedWorkers 拉起：stdin 收请求帧，原 stdout 回结果帧）
+# =========================
+def _apply_worker_limits():
+    try:
+        import resource
+    except ImportError:
+        return
+    # RLIMIT_CPU 到达软限制时内核发 SIGXCPU 结束进程；Linux 不执行 RLIMIT_RSS，RSS 由父进程按 ISOLATED_RSS_LIMIT 回收
+    for limit, value, hard in ((resource.RLIMIT_CPU, ISOLATED_CPU_LIMIT, ISOLATED_CPU_LIMIT + 5),
+                               (resource.RLIMIT_AS, ISOLATED_AS_LIMIT, ISOLATED_AS_LIMIT)):
+        if value:
+            try:
+                resource.setrlimit(limit, (value, hard))
+            except (ValueError, OSError) as e:
+                logger.warning("setrlimit failed: %s", e)
+
+
+def run_worker():
+    _apply_worker_limits()
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)  # spider 的 print 输出转到 stderr，不混入结果帧
+    rfile = sys.stdin.buffer
+    write_lock = threading.Lock()
+    cancels: dict[int, threading.Event] = {}
+    pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS, thread_name_prefix="t4-worker")
+
+    def _reply(resp: dict):
+        try:
+            frames = _frame(pickle.dumps(resp, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            frames = _frame(pickle.dumps({"id": resp["id"], "result": {"success": False, "error": str(e)}}))
+        with write_lock:
+            write_frames(out, frames)
+
+    def _run(req: dict):
+        resp = {"id": req["id"]}
+        try:
+            result = _manager.call(req.get("script_path", ""), req.get("method_name", ""), req.get("env") or "",
+                                   req.get("args") or [], req.get("deadline"), cancels[req["id"]])
+            if is_stream_result(result):
+                result = list(result)
+                result[2] = join_chunks(result[2])
+                resp["stream"] = True
+            resp["result"] = result
+        except Exception as e:
+            resp["result"] = {"success": False, "error": str(e), "traceback": traceback.format_exc()}
+        finally:
+            cancels.pop(req["id"], None)
+        _reply(resp)
+
+    logger.info("Isolated worker %d ready", os.getpid())
+    while True:
+        try:
+            req = pickle.loads(recv_payload(rfile))
+        except (ConnectionError, EOFError, ValueError):
+            break  # 父进程关闭了管道（回收或退出）
+        if req.get("cancel"):
+            event = cancels.get(req["id"])
+            if event is not None:
+                event.set()
+            continue
+        cancels[req["id"]] = threading.Event()
+        pool.submit(_run, req)
+    pool.shutdown(wait=True)
+    _manager.stop()
+    out.close()
+
+
 if __name__ == "__main__":
-    run()
+    if "--worker" in sys.argv[1:]:
+        run_worker()
+    else:
+        run()
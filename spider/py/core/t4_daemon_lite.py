@@ -36,7 +36,7 @@ except Exception:
 HOST = "127.0.0.1"
 PORT = 57570
 
-MAX_MSG_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_MSG_SIZE = int(os.environ.get("T4_MAX_MSG_SIZE") or 60 * 1024 * 1024)  # 与 bridge.py / bridge.js 一致
 MAX_CACHED_INSTANCES = 100  # ★ 最大缓存实例数
 INIT_TIMEOUT = 10  # ★ 初始化超时（秒）
 REQUEST_TIMEOUT = 30  # ★ 单次请求 socket 超时（秒）
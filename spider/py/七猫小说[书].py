@@ -16,7 +16,8 @@ import sys
 
 sys.path.append('..')
 
-from base.spider import BaseSpider
+from base.spider import BaseSpider, ExpiringLRU
+from base import crypto
 import requests
 from base.htmlParser import jsoup
 import zlib
@@ -25,11 +26,11 @@ import base64
 import json
 from jinja2 import Environment, Template
 import re
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
 import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError
 
 TIMEOUT = 10
+PREFETCH = 3  # 阅读时预取后续章节数
 
 
 class Spider(BaseSpider):
@@ -54,8 +55,16 @@ class Spider(BaseSpider):
         "sign": "fc697243ab534ebaf51d2fa80f251cb4"
     }
 
+    content_key = bytes.fromhex("32343263636238323330643730396531")
+    # 预取调度与章节请求分开两个线程池，避免调度任务等待同池内的请求造成死锁
+    prefetch_pool = ThreadPoolExecutor(max_workers=2)
+    fetch_pool = ThreadPoolExecutor(max_workers=PREFETCH * 2)
+
     def init(self, extend=""):
         print("============{0}============".format(extend))
+        # book_id -> 章节id列表；(book_id, chapter_id) -> 预取中/已解密正文的 Future
+        self.chapter_lists = ExpiringLRU(maxsize=16, ttl=3600)
+        self.chapter_cache = ExpiringLRU(maxsize=64, ttl=600)
 
     def getDependence(self):
         return []
@@ -176,6 +185,7 @@ class Spider(BaseSpider):
         json = r.json()
         chapters = jsp.pjfa(json, 'data.chapters')
         # print('chapters:', chapters)
+        self.chapter_lists[book_id] = [str(it["id"]) for it in chapters]
         lists = [[f'{it["title"]}${book_id}@@{it["id"]}@@{it["title"]}' for it in chapters]]
         vod['vod_play_url'] = '$$$'.join(['#'.join(ls) for ls in lists])
         result = {
@@ -214,18 +224,9 @@ class Spider(BaseSpider):
         return result
 
     def playerContent(self, flag, id, vipFlags):
-        params = {
-            'id': id.split('@@')[0],
-            'chapterId': id.split('@@')[1],
-        }
-        params['sign'] = self.get_sign_str(params)
-        url = 'https://api-ks.wtzw.com/api/v1/chapter/content'
-        url = self.buildUrl(url, params)
-        title = id.split('@@')[2]
-        r = requests.get(url, headers=self.sign_headers, timeout=TIMEOUT)
-        json_str = r.json()
-        result = json_str['data']['content']
-        content = self.decode_content(result)
+        book_id, chapter_id, title = id.split('@@')[:3]
+        content = self.get_chapter(book_id, chapter_id)
+        self.prefetch_pool.submit(self.prefetch, book_id, chapter_id)
         ret = json.dumps({
             'title': title,
             'content': content,
@@ -300,48 +301,95 @@ class Spider(BaseSpider):
         md5_hash = hashlib.md5(sign_str.encode('utf-8')).hexdigest()
         return md5_hash
 
-    @staticmethod
-    def novel_content_decrypt(data, iv):
-        # 将密钥从十六进制字符串转换为字节
-        key_hex = "32343263636238323330643730396531"
-        key = bytes.fromhex(key_hex)
-
-        # 将 IV 从十六进制字符串转换为字节
-        iv_bytes = bytes.fromhex(iv)
-
-        # 将数据从十六进制字符串转换为字节
-        data_bytes = bytes.fromhex(data)
-
-        # 创建 AES 解密器
-        cipher = AES.new(key, AES.MODE_CBC, iv_bytes)
-
-        # 解密数据
-        decrypted = cipher.decrypt(data_bytes)
-
-        # 移除 PKCS7 填充
-        try:
-            unpadded = unpad(decrypted, AES.block_size)
-        except ValueError:
-            # 如果填充不正确，可能已经是未填充的数据
-            unpadded = decrypted
+    @classmethod
+    def novel_content_decrypt(cls, data, iv):
+        """hex 形式的密文与 IV 解密(兼容旧调用)，正文解密走 decode_content 的字节路径"""
+        return cls.decrypt_bytes(bytes.fromhex(data), bytes.fromhex(iv))
 
-        # 转换为 UTF-8 字符串
-        return unpadded.decode('utf-8').strip()
+    @classmethod
+    def decrypt_bytes(cls, data, iv):
+        # 解密并移除 PKCS7 填充；填充不正确时可能已经是未填充的数据，原样返回
+        return crypto.aes_decrypt(data, cls.content_key, iv, strict=False).decode('utf-8').strip()
 
     def decode_content(self, response):
-        # 解码 Base64 响应
-        decoded_bytes = base64.b64decode(response)
+        # 解码 Base64 响应：前 16 字节为 IV，其余为密文，用 memoryview 切片避免复制
+        view = memoryview(base64.b64decode(response))
+        return self.decrypt_bytes(view[16:], view[:16])
 
-        # 转换为字符串（十六进制表示）
-        hex_str = decoded_bytes.hex()
-
-        # 提取前 32 个字符作为 IV
-        iv = hex_str[:32]
-
-        # 提取剩余部分作为内容
-        content_hex = hex_str[32:]
-
-        # 解密内容
-        decrypted_content = self.novel_content_decrypt(content_hex, iv)
+    def fetch_chapter(self, book_id, chapter_id):
+        """请求章节正文，返回 base64 密文"""
+        params = {
+            'id': book_id,
+            'chapterId': chapter_id,
+        }
+        params['sign'] = self.get_sign_str(params)
+        url = self.buildUrl('https://api-ks.wtzw.com/api/v1/chapter/content', params)
+        r = requests.get(url, headers=self.sign_headers, timeout=TIMEOUT)
+        return r.json()['data']['content']
+
+    def get_chapter(self, book_id, chapter_id):
+        """优先使用预取结果(预取中则等待)，否则直接请求并解密"""
+        future = self.chapter_cache.get((book_id, chapter_id))
+        if future is not None:
+            try:
+                return future.result(timeout=TIMEOUT)
+            except Exception:
+                pass
+        return self.decode_content(self.fetch_chapter(book_id, chapter_id))
+
+    def get_chapter_ids(self, book_id):
+        ids = self.chapter_lists.get(book_id)
+        if ids is None:
+            url = self.buildUrl('https://www.qimao.com/api/book/chapter-list', {'book_id': book_id})
+            r = requests.get(url, headers=self.headers, timeout=TIMEOUT)
+            self.chapter_lists[book_id] = ids = [str(it['id']) for it in r.json()['data']['chapters']]
+        return ids
+
+    def prefetch(self, book_id, chapter_id):
+        """并发请求后续 PREFETCH 章，批量解密后放入缓存"""
+        ids = self.get_chapter_ids(book_id)
+        if chapter_id not in ids:
+            return
+        pos = ids.index(chapter_id) + 1
+        pending = []
+        for cid in ids[pos:pos + PREFETCH]:
+            # 检查与占位在缓存锁内一次完成，并发的两次预取不会为同一章各建一个 Future
+            future = Future()
+            if self.chapter_cache.setdefault((book_id, cid), future) is future:
+                pending.append((cid, future))
+        if not pending:
+            return
+        fetched = [self.fetch_pool.submit(self.fetch_chapter, book_id, cid) for cid, _ in pending]
+        ok, views = [], []
+        for (cid, future), task in zip(pending, fetched):
+            try:
+                views.append(memoryview(base64.b64decode(task.result())))
+                ok.append(future)
+            except Exception as e:
+                self._resolve(future, exception=e)
+        try:
+            plains = crypto.aes_cbc_decrypt_batch([v[16:] for v in views], self.content_key, [v[:16] for v in views],
+                                                  strict=False)
+            for future, plain in zip(ok, plains):
+                # 单章解出乱码(strict=False 时可能)只让该章失败，不影响其余章节
+                try:
+                    text = plain.decode('utf-8').strip()
+                except Exception as e:
+                    self._resolve(future, exception=e)
+                else:
+                    self._resolve(future, text)
+        except Exception as e:
+            # 已写回的 Future 会忽略重复设置；保证每个占位都有结果，阅读时不必等满 TIMEOUT
+            for future in ok:
+                self._resolve(future, exception=e)
 
-        return decrypted_content
+    @staticmethod
+    def _resolve(future, result=None, exception=None):
+        # 预取结果写回；条目已被淘汰(Future 被取消)时忽略
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
@@ -238,14 +238,13 @@ import sys, os, json as Bg, threading as x, hashlib, time as X, random as B8
 
 try:
     # from base.spider import Spider as BaseSpider
-    from base.spider import BaseSpider
+    from base.spider import BaseSpider, ExpiringLRU
 except ImportError:
-    from t4.base.spider import BaseSpider
-from requests import session as Bh, utils as Bi, head
+    from t4.base.spider import BaseSpider, ExpiringLRU
+from requests import session as Bh, utils as Bi
 from requests.adapters import HTTPAdapter as Cw, Retry
 from concurrent.futures import ThreadPoolExecutor as Cx, as_completed as Bj
-from functools import reduce
-from urllib.parse import quote as CK, urlencode as Bk
+from urllib.parse import quote as CK, urlencode as Bk, urlsplit
 
 sys.path.append('..')
 y, Cy = os.path.split(os.path.abspath(__file__))
@@ -255,6 +254,113 @@ y = os.path.join(y, 'data')
 # print('y:', y)
 
 
+class MirrorRanker:
+    """
+    按 CDN 主机统计首字节耗时(TTFB)的指数加权均值，跨视频共享。
+    请求失败按惩罚耗时计入；排序时评分低(快)的镜像在前，未测过的主机按先验值参与排序。
+    """
+
+    def __init__(self, alpha=.3, prior=.5, penalty=5., stale=600):
+        self.alpha = alpha
+        self.prior = prior
+        self.penalty = penalty
+        self.stale = stale
+        self._scores = {}  # host -> [ewma, updated_at]
+        self._lock = x.Lock()
+
+    @staticmethod
+    def host(url):
+        return urlsplit(url).hostname or url
+
+    def observe(self, url, ttfb):
+        host = self.host(url)
+        with self._lock:
+            item = self._scores.get(host)
+            score = ttfb if item is None else item[0] + self.alpha * (ttfb - item[0])
+            self._scores[host] = [score, X.time()]
+
+    def fail(self, url):
+        self.observe(url, self.penalty)
+
+    def score(self, url):
+        item = self._scores.get(self.host(url))
+        return self.prior if item is None else item[0]
+
+    def needs_probe(self, url):
+        item = self._scores.get(self.host(url))
+        return item is None or X.time() - item[1] > self.stale
+
+    def order(self, urls):
+        return sorted((url for url in urls if url), key=self.score)
+
+    def stats(self):
+        with self._lock:
+            return {host: AK(item[0] * 1000, 1) for (host, item) in self._scores.items()}
+
+
+class WbiSigner:
+    """
+    WBI 签名。mixin key 由 img_key/sub_key 预先计算一次，并在每个整点前由后台刷新；
+    签名路径只做排序、str.translate 去除特殊字符、urlencode 和 MD5，不发起网络请求。
+    """
+    MIXIN_KEY_ENC_TAB = [46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49, 33, 9, 42, 19,
+                         29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40, 61, 26, 17, 0, 1, 60, 51, 30, 4,
+                         22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11, 36, 20, 34, 44, 52]
+    STRIP_CHARS = str.maketrans('', '', "!'()*")
+    DM_CHARS = 'ABCDEFGHIJK'
+    DM_IMG_INTER = '{"ds":[],"wh":[0,0,0],"of":[0,0,0]}'
+
+    def __init__(self, fetch_keys, refresh_margin=60):
+        self.fetch_keys = fetch_keys  # () -> (img_url, sub_url)
+        self.refresh_margin = refresh_margin
+        self.mixin_key = ''
+        self.updated_at = 0
+        self._lock = x.Lock()
+
+    @classmethod
+    def mixin(cls, img_key, sub_key):
+        raw = img_key + sub_key
+        return ''.join(raw[i] for i in cls.MIXIN_KEY_ENC_TAB)[:32]
+
+    def refresh(self):
+        """拉取 img/sub key 并更新 mixin key；失败时保留旧 key"""
+        with self._lock:
+            img_url, sub_url = self.fetch_keys()
+            stem = lambda url: url.rsplit(AR, 1)[-1].split('.')[0]
+            self.mixin_key = self.mixin(stem(img_url), stem(sub_url))
+            self.updated_at = X.time()
+
+    def seconds_to_refresh(self):
+        """距下一次计划刷新(下个整点前 refresh_margin 秒)的秒数"""
+        return max(0, 3600 - X.time() % 3600 - self.refresh_margin)
+
+    def sign(self, params):
+        ts = AK(X.time())
+        # 仅在首次签名且后台刷新尚未完成时同步拉取
+        if not self.mixin_key: self.refresh()
+        params['wts'] = ts
+        params['dm_img_list'] = '[]'
+        params['dm_img_str'] = B.join(B8.sample(self.DM_CHARS, 2))
+        params['dm_cover_img_str'] = B.join(B8.sample(self.DM_CHARS, 2))
+        params['dm_img_inter'] = self.DM_IMG_INTER
+        strip = self.STRIP_CHARS
+        query = {key: A(value).translate(strip) for (key, value) in sorted(params.items())}
+        encoded = Bk(query)
+        query['w_rid'] = w_rid = hashlib.md5((encoded + self.mixin_key).encode(encoding=Br)).hexdigest()
+        return [encoded + '&w_rid=' + w_rid, query]
+
+    def benchmark(self, n=10000):
+        """本地签名基准：返回单次签名平均耗时(微秒)，不含网络"""
+        key, self.mixin_key = self.mixin_key, self.mixin_key or '0' * 32
+        try:
+            start = X.perf_counter()
+            for i in range(n):
+                self.sign({'mid': i, 'pn': 1, 'ps': 30, 'order': 'pubdate', 'keyword': "it's (a) test!"})
+            return {'n': n, 'sign_us': AK((X.perf_counter() - start) / n * 1e6, 2)}
+        finally:
+            self.mixin_key = key
+
+
 class Spider(BaseSpider):
     defaultConfig = {'currentVersion': '20240815_1', CL: B, CM: B, Bl: AL, Bm: L, Z: 12, BA: '15', Bn: '80', Bo: '7',
                      Ap: '30280', CN: Ab, CO: Ab, Bp: L, BB: [AM, Ac, Ad, AN, Ae, BE, BF, Aq],
@@ -329,6 +435,11 @@ class Spider(BaseSpider):
     session_master.mount(Bs, adapter);
     session_vip.mount(Bs, adapter);
     session_fake.mount(Bs, adapter)
+    # 本地代理拉取媒体分段专用连接池，多个观看者复用 CDN 长连接
+    session_media = Bh();
+    session_media.mount(Bs, Cw(pool_connections=8, pool_maxsize=32, max_retries=Retry(total=2, read=0, backoff_factor=.1)));
+    media_buffer_size = 128 * 1024
+    ranker = MirrorRanker()
 
     def getCookie_dosth(B, co):
         A = co.strip().split('=', 1)
@@ -504,19 +615,26 @@ class Spider(BaseSpider):
                            '5': [3600, 0x4ee2d6d415b85acef80ffffffff]};
         self.time_diff = L;
         self.dynamic_offset = ''
-        self.detailContent_args = {}
-        self.pC_urlDic = {}
+        # 按详情/视频保存的临时状态，长驻实例中限量并过期释放；播放地址条目按签名URL的deadline过期
+        self.detailContent_args = ExpiringLRU(maxsize=64, ttl=3600)
+        self.pC_urlDic = ExpiringLRU(maxsize=64, ttl=7200)
+        self.mpd_cache = ExpiringLRU(maxsize=32, ttl=3600)
         self.load_config();
         self.pool.submit(self.getCookie);
         self.pool.submit(self.getFakeCookie);
         self.pool.submit(self.getCookie, AF);
-        B = AK(
-            X.time());
-        C = X.gmtime(B).tm_hour;
-        self.pool.submit(self.get_wbiKey, C)
+        self.wbi = WbiSigner(self.get_wbiKey)
+        self.pool.submit(self.wbi.refresh)
+
+    wbi_task = None
 
     def init(self, extend=B):
         print('============{0}============'.format(extend))
+        # 每个整点前在后台刷新 WBI key，签名路径不等待网络；
+        # 在 init 中注册(init 失败或被丢弃的实例不留下周期任务)，重复 init 时替换旧任务
+        if self.wbi_task: self.wbi_task.cancel()
+        self.wbi_task = self.schedulePeriodic(3600, self.pool.submit, self.wbi.refresh,
+                                              delay=self.wbi.seconds_to_refresh())
 
     def isVideoFormat(self, url):
         pass
@@ -525,7 +643,13 @@ class Spider(BaseSpider):
         pass
 
     def destroy(self):
-        pass
+        self.detailContent_args.clear();
+        self.pC_urlDic.clear();
+        self.mpd_cache.clear()
+
+    def getMemoryStats(self):
+        return {'detailContent_args': self.detailContent_args.stats(), 'pC_urlDic': self.pC_urlDic.stats(),
+                'mpd_cache': self.mpd_cache.stats()}
 
     def format_img(B, img):
         A = img;
@@ -1166,7 +1290,12 @@ class Spider(BaseSpider):
             if type == BJ: return I.get_follow(pg=O, sort=BU)
             return I.get_history(type=type, pg=O)
         elif D.endswith('_getbangumiseasons'):
-            if F(O) == 1: return {G: I.detailContent_args[D.split(N)[0]][C6]}
+            if F(O) == 1:
+                b = D.split(N)[0];
+                H = I.detailContent_args.get(b)
+                # 详情状态已过期或被淘汰：按剧集 id 重新获取系列列表
+                if not H or C6 not in H: I.detailContent_args[b] = H = {AI: b};I.ysContent(H)
+                return {G: H.get(C6, [])}
         elif D.endswith('_getupvideos'):
             R, P, v = D.split(N);
             return I.get_up_videos(pg=O, mid=R, order=P)
@@ -1700,8 +1829,8 @@ class Spider(BaseSpider):
         B = season;
         D = A(B[A8]);
         E = B[CE];
-        F = C.detailContent_args[B[AI]]
-        if D == F[B5]: F[B7] = E
+        F = C.detailContent_args.get(B[AI], {})
+        if D == F.get(B5): F[B7] = E
         G = B[h];
         H = B[Ax][Aw];
         I = {R: A9 + D, O: E, S: C.format_img(G), Y: H};
@@ -1867,69 +1996,59 @@ class Spider(BaseSpider):
         if U(H): D[G] = H;D[a] = pg;D[f] = 9999;D[g] = 99;D[c] = 999999
         return D
 
-    stop_heartbeat_event = x.Event()
+    heartbeat_task = None
+    # heartbeat_task 由请求线程(开始/停止播放)与调度线程(最后一次上报后结束)共同修改
+    heartbeat_lock = x.RLock()
 
     def stop_heartbeat(A):
         try:
             for B in A.task_pool: B.cancel()
         finally:
-            A.stop_heartbeat_event.set()
+            A._end_heartbeat()
+
+    def _end_heartbeat(A):
+        # 停止播放时按实际经过时间补报一次进度；任务已自行结束(上报次数用完)时不再补报
+        with A.heartbeat_lock:
+            B, A.heartbeat_task = A.heartbeat_task, None
+            if B and not B.cancelled and B.args[1][1] > 0: B.cancel();B.fn(*B.args, final=Ab)
 
     def start_heartbeat(B, aid, cid, ssid, epid, duration, played_time):
-        E = played_time;
         G = F(B.userConfig[BA])
         if not B.userid or not G: return
-        H = F((duration - E) / G) + 1;
-        I = 'https://api.bilibili.com/x/click-interface/web/heartbeat';
         C = {T: A(aid), v: A(cid), Bd: A(B.csrf)}
         if ssid: C['sid'] = A(ssid);C[o] = A(epid);C[k] = AQ
-        D = 0;
-        B.stop_heartbeat_event.clear()
-        while Ab:
-            if D == G or B.stop_heartbeat_event.is_set(): E += D;D = 0
-            if not D:
-                H -= 1
-                if not H: E = -1;B.stop_heartbeat_event.set()
-                C['played_time'] = A(E);
-                C = B.encrypt_wbi(**C)[1];
-                B.pool.submit(B._post_sth, url=I, data=C)
-                if B.stop_heartbeat_event.is_set(): break
-            X.sleep(1);
-            D += 1
-
-    wbi_key = {}
-
-    def get_wbiKey(A, hour):
+        # [已播放秒数, 剩余上报次数, 上次上报时间]
+        D = [played_time, F((duration - played_time) / G) + 1, 0]
+        with B.heartbeat_lock:
+            B._end_heartbeat()
+            B.heartbeat_task = B.schedulePeriodic(G, B._heartbeat_tick, C, D, G, delay=0)
+
+    def _heartbeat_tick(B, params, state, interval, final=False):
+        # 在共享调度线程中执行，签名和上报提交到线程池
+        with B.heartbeat_lock:
+            C = state;
+            if C[1] <= 0: return False
+            D = X.time()
+            if C[2]: C[0] += AK(D - C[2]) if final else interval
+            C[2] = D;
+            C[1] -= 1
+            if not C[1]: C[0] = -1
+            B.pool.submit(B._post_heartbeat, {**params, 'played_time': A(C[0])})
+            E = C[1] > 0 and not final
+            # 最后一次上报后任务结束，清掉引用，之后的 stop_heartbeat 不再补报
+            if not E and B.heartbeat_task and B.heartbeat_task.args[1] is C: B.heartbeat_task = None
+            return E
+
+    def _post_heartbeat(A, data):
+        A._post_sth(url='https://api.bilibili.com/x/click-interface/web/heartbeat', data=A.encrypt_wbi(**data)[1])
+
+    def get_wbiKey(A):
         D = 'wbi_img';
-        C = A.fetch(CP, headers=A.header);
-        F = C.json()[E][D]['img_url'];
-        G = C.json()[E][D][
-            'sub_url'];
-        H = [46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49, 33, 9, 42, 19,
-             29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40, 61, 26, 17, 0, 1, 60, 51, 30, 4,
-             22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11, 36, 20, 34, 44, 52];
-        I = \
-            F.split(AR)[-1].split('.')[0] + G.split(AR)[-1].split('.')[0];
-        J = reduce(lambda s, i: s + I[i], H, B)[
-            :32];
-        A.wbi_key = {W: J, 'hour': hour}
+        C = A.fetch(CP, headers=A.header).json()[E][D];
+        return C['img_url'], C['sub_url']
 
     def encrypt_wbi(D, **C):
-        E = AK(X.time());
-        F = X.gmtime(E).tm_hour
-        if not D.wbi_key or F != D.wbi_key['hour']: D.get_wbiKey(F)
-        C['wts'] = E;
-        G = 'ABCDEFGHIJK';
-        C['dm_img_list'] = '[]';
-        C['dm_img_str'] = B.join(B8.sample(G, 2));
-        C['dm_cover_img_str'] = B.join(B8.sample(G, 2));
-        C['dm_img_inter'] = '{"ds":[],"wh":[0,0,0],"of":[0,0,0]}';
-        C = d(sorted(C.items()));
-        C = {C: B.join(filter(lambda chr: chr not in "!'()*", A(D))) for (C, D) in C.items()};
-        H = Bk(C);
-        I = hashlib.md5((H + D.wbi_key[W]).encode(encoding=Br)).hexdigest();
-        C['w_rid'] = I;
-        return [H + '&w_rid=' + I, C]
+        return D.wbi.sign(C)
 
     def _get_sth(A, url, _type=e, **C):
         E = _type;
@@ -2089,43 +2208,26 @@ class Spider(BaseSpider):
     vod_audio_id = {'30251': 'Hi-Res无损', '30250': '杜比全景声', '30280': Cq, '30232': '132000', '30216': '64000'}
 
     def get_dash_media(E, media, aid, cid, qn):
+        # 选中的音/视频流 -> Representation 的结构化属性
         I = 'SegmentBase';
         C = media;
         F = A(C.get(t));
-        J = C.get(CG, B);
-        K = C.get('codecs');
-        L = C.get('bandwidth');
-        M = C.get('startWithSap');
         H = C.get(Cr);
-        O = C[I].get('indexRange');
-        P = C[I].get('Initialization');
         D = H.split(AR)[0];
         G = B
         if D == p:
-            Q = C.get('frameRate');
-            R = C.get('sar');
-            S = C.get('width');
-            T = C.get(
-                'height');
-            G = f"height='{T}' width='{S}' frameRate='{Q}' sar='{R}'"
+            G = f"height='{C.get('height')}' width='{C.get('width')}' frameRate='{C.get('frameRate')}' sar='{C.get('sar')}'"
         elif D == AZ:
-            U = E.vod_audio_id.get(F, Cq);
-            G = f"numChannels='2' sampleRate='{U}'"
-        V = f"{E.localProxyUrl}{D}&aid={aid}&cid={cid}&qn={qn}".replace('&', '&amp;');
-        F += N + A(J);
-        W = f'''
-      <Representation id="{F}" bandwidth="{L}" codecs="{K}" mimeType="{H}" {G} startWithSAP="{M}">
-        <BaseURL>{V}</BaseURL>
-        <SegmentBase indexRange="{O}">
-          <Initialization range="{P}"/>
-        </SegmentBase>
-      </Representation>''';
-        E.pC_urlDic[f"{aid}_{cid}"][D] = C;
-        return W
-
-    def get_dash_media_list(E, media_lis, aid, cid, qn):
+            G = f"numChannels='2' sampleRate='{E.vod_audio_id.get(F, Cq)}'"
+        V = f"{E.localProxyUrl.replace('&', '&amp;')}{D}&amp;aid={aid}&amp;cid={cid}&amp;qn={qn}"
+        return {k: D, t: F + N + A(C.get(CG, B)), 'bandwidth': C.get('bandwidth'), 'codecs': C.get('codecs'), Cr: H,
+                'attrs': G, 'startWithSAP': C.get('startWithSap'), 'indexRange': C[I].get('indexRange'),
+                'initialization': C[I].get('Initialization'), b: V}
+
+    def get_dash_media_list(E, media_lis, qn):
+        # 按画质/编码(视频)或音质(音频)偏好选出一条流
         F = media_lis
-        if not F: return B
+        if not F: return {}
         G = F[0][Cr].split(AR)[0]
         if G == p:
             I = A(qn);
@@ -2140,22 +2242,50 @@ class Spider(BaseSpider):
                 if not C or A(D[CG]) == H:
                     C = D
                     if A(D[CG]) == H: break
-        J = f'\n    <AdaptationSet>\n      <ContentComponent contentType="{G}"/>{E.get_dash_media(C, aid, cid, qn)}\n    </AdaptationSet>';
-        return J
+        return C
+
+    @staticmethod
+    def render_dash_representation(R):
+        return f'''
+    <AdaptationSet>
+      <ContentComponent contentType="{R[k]}"/>
+      <Representation id="{R[t]}" bandwidth="{R['bandwidth']}" codecs="{R['codecs']}" mimeType="{R[Cr]}" {R['attrs']} startWithSAP="{R['startWithSAP']}">
+        <BaseURL>{R[b]}</BaseURL>
+        <SegmentBase indexRange="{R['indexRange']}">
+          <Initialization range="{R['initialization']}"/>
+        </SegmentBase>
+      </Representation>
+    </AdaptationSet>'''
 
     def get_dash(B, ja, aid, cid, qn):
+        # MPD 按 aid_cid_qn(+音视频偏好) 与播放地址 deadline 缓存，命中时直接返回序列化好的 bytes
         A = ja;
-        D = A.get(n);
-        G = A.get('minBufferTime');
-        H = B.pool.submit(B.get_dash_media_list, A.get(p), aid, cid, qn);
-        C = A.get(AZ, []);
-        E = A.get('dolby', {}).get(AZ)
-        if E: C = E + C
-        F = A.get('flac')
-        if Aa(F) == d: C.insert(0, F.get(AZ))
-        I = B.pool.submit(B.get_dash_media_list, C, aid, cid, qn);
-        J = f'<MPD xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="urn:mpeg:dash:schema:mpd:2011" xsi:schemaLocation="urn:mpeg:dash:schema:mpd:2011 DASH-MPD.xsd" type="static" mediaPresentationDuration="PT{D}S" minBufferTime="PT{G}S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">\n  <Period duration="PT{D}S" start="PT0S">{H.result()}{I.result()}\n  </Period>\n</MPD>';
-        return J
+        K = A.get(p) or [];
+        try:
+            L = F(d(J(lambda x: x.split('=')[:2], K[0]['baseUrl'].split('?')[1].split('&'))).get(Bf, 0))
+        except Exception:
+            L = 0
+        M = f"{aid}_{cid}_{qn}_{B.userConfig[Bo]}_{B.userConfig[Ap]}_{L}"
+        O = B.mpd_cache.get(M)
+        if O is None:
+            D = A.get(n);
+            G = A.get('minBufferTime');
+            C = list(A.get(AZ) or []);
+            E = (A.get('dolby') or {}).get(AZ)
+            if E: C = E + C
+            H = A.get('flac')
+            if Aa(H) == d: C.insert(0, H.get(AZ))
+            I = {p: B.get_dash_media_list(K, qn), AZ: B.get_dash_media_list(C, qn)}
+            P = ''.join(B.render_dash_representation(B.get_dash_media(Q, aid, cid, qn)) for Q in I.values() if Q)
+            R = f'<MPD xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="urn:mpeg:dash:schema:mpd:2011" xsi:schemaLocation="urn:mpeg:dash:schema:mpd:2011 DASH-MPD.xsd" type="static" mediaPresentationDuration="PT{D}S" minBufferTime="PT{G}S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">\n  <Period duration="PT{D}S" start="PT0S">{P}\n  </Period>\n</MPD>'
+            B.mpd_cache[M] = O = (R.encode(Br), I)
+            if L: B.mpd_cache.expire_at(M, L)
+        # 当前选中的音/视频流写回播放地址条目，供 localProxy 取流(画质切换回已缓存的 MPD 时同样需要)
+        S = B.pC_urlDic[f"{aid}_{cid}"]
+        if S.get('dash_key') != M:
+            S.update({Q: R for (Q, R) in O[1].items() if R});
+            S['dash_key'] = M
+        return O[0]
 
     def miao(B, m):
         m = A(m).partition('.')[2]
@@ -2231,7 +2361,8 @@ class Spider(BaseSpider):
         Z = d(J(lambda x: (x[W], x['new_description']), D['support_formats']));
         C['url'] = [];
         U = D.get('dash');
-        V = f"&aid={L}&cid={N}&qn="
+        # epid 随代理地址传递：缓存条目被淘汰后 localProxy 仍按番剧接口重新解析
+        V = f"&aid={L}&cid={N}&epid={P or B}&qn="
         if U:
             I[CH] = U;
             C[AX] = Cu
@@ -2266,7 +2397,7 @@ class Spider(BaseSpider):
         A.fetch('http://127.0.0.1:9978/action?do=refresh&type=detail')
 
     def playerContent(C, flag, id, vipFlags):
-        C.pool.submit(C.stop_heartbeat);
+        C.stop_heartbeat();
         D = {};
         P = B
         if '@' in id: id, P = id.split('@')
@@ -2322,8 +2453,7 @@ class Spider(BaseSpider):
             I[B6] = O;
             C.pool.submit(C._refreshDetail)
         else:
-            c = C.pool.submit(C.start_heartbeat, G, E, Q, J, F(M), Z);
-            C.task_pool.append(c)
+            C.start_heartbeat(G, E, Q, J, F(M), Z)
         return D
 
     def live_playerContent(D, id):
@@ -2353,17 +2483,26 @@ class Spider(BaseSpider):
         C[CI] = {Cv: 'https://live.bilibili.com', AP: D.header[AP]};
         return C
 
-    def _testUrl(A, url, id, mediaType):
-        B = head(url, headers=A.header, timeout=5).status_code
-        if B != 200: A.pC_urlDic[id][mediaType].pop(url)
+    def _testUrl(A, url):
+        # 只取首字节测量 TTFB，更新镜像评分
+        B = X.time()
+        try:
+            with A.session_media.get(url, headers={**A.header, 'Range': 'bytes=0-0'}, stream=Ab, timeout=5) as C:
+                if C.status_code >= 400: raise IOError(C.status_code)
+            A.ranker.observe(url, X.time() - B)
+        except Exception:
+            A.ranker.fail(url)
 
     def get_fastesUrl(C, ja, id, mediaType):
         E = mediaType;
         A = ja;
         D = A
-        if Aa(A) == d: C.pC_urlDic[id][E] = D = [A.get('baseUrl', A.get(b, B))];D.extend(A.get('backup_url', []));
-        C.pC_urlDic[id][Bf] = F(d(J(lambda x: x.split('=')[:2], D[0].split('?')[1].split('&'))).get(Bf, 0))
-        for G in D: C.pool.submit(C._testUrl, G, id, E)
+        H = C.pC_urlDic[id]
+        if Aa(A) == d: H[E] = D = [A.get('baseUrl', A.get(b, B))];D.extend(A.get('backup_url', []));
+        H[Bf] = F(d(J(lambda x: x.split('=')[:2], D[0].split('?')[1].split('&'))).get(Bf, 0))
+        if H[Bf]: C.pC_urlDic.expire_at(id, H[Bf])
+        for G in D:
+            if C.ranker.needs_probe(G): C.pool.submit(C._testUrl, G)
 
     def localProxy(D, param, *args, **kwargs):
         N = 'range';
@@ -2374,26 +2513,77 @@ class Spider(BaseSpider):
         F = E.get(T);
         G = E.get(v);
         H = E.get(AY);
-        C = D.pC_urlDic[f"{F}_{G}"]
+        C = D.pC_urlDic.get(f"{F}_{G}")
+        # 条目已过期或被淘汰：按 aid/cid 重新获取播放地址
+        if not C: D._get_playerContent({}, F, G, E.get(o, B));C = D.pC_urlDic[f"{F}_{G}"]
         if A == 'dash': P = D.get_dash(C[CH], F, G, H);return [200, Cu, P]
         if A in [Be, p, AZ]:
             if A == Be: A = H
             K = AK(X.time());
             I = C.get(Bf)
             if Aa(C[A]) == d or (I - K) % 10 == 0: D.get_fastesUrl(C[A], f"{F}_{G}", A);I = C.get(Bf)
-            J = B8.choice(C[A])
+            J = D.ranker.order(C[A])
             if not J or A != AZ and I - K < 1800:
-                D._get_playerContent({}, F, G, C[o]);
+                D._get_playerContent({}, F, G, C.get(o) or E.get(o, B));
                 C = D.pC_urlDic[f"{F}_{G}"]
                 if A == p: D.get_dash(C[CH], F, G, H)
                 D.get_fastesUrl(C[A], f"{F}_{G}", A);
-                J = B8.choice(C[A])
+                J = D.ranker.order(C[A])
             L = D.header.copy()
             if N in E: L['Range'] = E[N]
-            Q = D.fetch(J, headers=L, stream=Ab);
-            return [206, M, Q.content]
+            Q, J = D.open_media(J, L)
+            R = {S: Q.headers[S] for S in ('Content-Range', 'Content-Length', 'Accept-Ranges') if S in Q.headers}
+            if D.ENV.lower() != 't4':
+                with Q: return [Q.status_code, M, Q.content, R]
+            return [Q.status_code, Q.headers.get('Content-Type', M), D.iter_media(Q, J, L), R]
         return [404, 'text/plain', B]
 
+    def open_media(A, urls, headers):
+        # 按评分依次尝试镜像，返回 (响应, 剩余备选镜像)
+        B = list(urls);
+        E = None
+        while B:
+            C = B.pop(0);
+            D = X.time()
+            try:
+                G = A.session_media.get(C, headers=headers, stream=Ab, timeout=A.clampTimeout(10))
+                if G.status_code >= 400: G.close();raise IOError(f"{G.status_code} {C}")
+                A.ranker.observe(C, X.time() - D);
+                return G, B
+            except (TimeoutError, ConnectionAbortedError):
+                raise
+            except Exception as F:
+                A.ranker.fail(C);
+                E = F
+        raise E or IOError('no mirror available')
+
+    def iter_media(A, rsp, urls, headers):
+        # 固定缓冲区分块读取上游，守护进程逐帧转发；读完或客户端断开(生成器被关闭)时归还连接
+        # 中途读取失败时从已发送位置续传，切换到下一个镜像
+        B = bytearray(A.media_buffer_size);
+        C = memoryview(B);
+        E = 0
+        F, _, G = headers.get('Range', 'bytes=0-').split('=', 1)[-1].partition('-')
+        H = F.isdigit() and int(rsp.headers.get('Content-Length', 0)) or 0
+        try:
+            while Ab:
+                try:
+                    D = rsp.raw.readinto(B)
+                    if not D and E < H: raise IOError('upstream closed early')
+                except Exception:
+                    A.ranker.fail(rsp.url);
+                    rsp.close()
+                    if not urls or not H: raise
+                    I = headers.copy();
+                    I['Range'] = f"bytes={int(F) + E}-{G}"
+                    rsp, urls = A.open_media(urls, I)
+                    continue
+                if not D: break
+                E += D;
+                yield C[:D]
+        finally:
+            rsp.close()
+
     config = {'player': {}, l: {BE: [{W: C5, H: '分类',
                                       K: [{D: B0, C: B0}, {D: BT, C: BT}, {D: C0, C: C0}, {D: B1, C: B1},
                                           {D: C1, C: C1}, {D: '我的粉丝', C: '我的粉丝'}]}], AN: [
@@ -162,7 +162,9 @@ export class DaemonManager {
         return new Promise((resolve, reject) => {
             const tryConnect = () => {
                 // 尝试连接到服务器
-                const socket = net.connect({host, port}, () => {
+                // 配置了 T4_UNIX_SOCKET 时守护进程可能只监听 Unix 域套接字
+                const target = process.env.T4_UNIX_SOCKET ? {path: process.env.T4_UNIX_SOCKET} : {host, port};
+                const socket = net.connect(target, () => {
                     socket.end();
                     resolve(true);
                 });
@@ -202,7 +204,7 @@ export class DaemonManager {
             pythonPath: this.getPythonPath(),
             pythonOptions: ['-u'], // 无缓冲输出
             scriptPath: path.dirname(this.config.daemonScript),
-            env: {PYTHONIOENCODING: 'utf-8'}, // 设置编码
+            env: {...process.env, PYTHONIOENCODING: 'utf-8'}, // 继承 T4_* 等配置并设置编码
             args: [
                 '--pid-file', this.config.pidFile,
                 '--log-file', this.config.logFile,